@@ -2,15 +2,11 @@
 <https://github.com/theno/fabsetup/tree/master/fabsetup>`_
 """
 
-import fabric
-import invoke
-import paramiko
-
-import fabsetup
-import fabsetup.fabfile
-import fabsetup.addons
 from fabsetup._version import __version__  # noqa: F401
 
+# Importing fabsetup is cheap on purpose: fabric, invoke, and paramiko are
+# only imported by the modules which need them (or by ``version_str()``).
+
 
 def _module_str(module, postfix=""):
     """Print module in pip style"""
@@ -22,6 +18,13 @@ def version_str():
     """Return versions of fabsetup addons, fabsetup, fabric, paramiko, and
     invoke.
     """
+    import fabric
+    import invoke
+    import paramiko
+
+    import fabsetup
+    import fabsetup.addons
+
     return "\n".join(
         [_module_str(mod, "-addon-repo") for mod in fabsetup.addons.REPO_MODULES]
         + [_module_str(mod) for mod in fabsetup.addons.PIP_MODULES]  # noqa: W503, E501
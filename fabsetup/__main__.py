@@ -1,24 +1,57 @@
 """Executable of fabsetup"""
 
 import os.path
+import sqlite3
 import subprocess
+import sys
+import time
 
-import fabric.executor
 import invoke
 
 import fabsetup
 import fabsetup.fabfile
 import fabsetup.addons
+import fabsetup.executor
+import fabsetup.utils.events
 import fabsetup.utils.outfile
 import fabsetup.utils.pandoc
+import fabsetup.utils.timing
 
 import fabsetup.main
 
 
-def main(namespace=invoke.Collection.from_module(fabsetup.fabfile)):
+def record_history(program, exit_code):
+    """Add the finished run to the run history index."""
+    import fabsetup.history
+
+    timings = fabsetup.utils.timing.Timings()
+    started = timings.root.started
+    outfile = program.config.outfile.name
+    index = fabsetup.history.History(program.config.history.file)
+    try:
+        index.record(
+            started=started,
+            wall=time.time() - started,
+            command=getattr(program, "command", " ".join(sys.argv)),
+            tasks=[task.name for task in getattr(program, "tasks", [])],
+            hosts=program.hosts() if getattr(program, "core", None) else [],
+            exit_code=exit_code,
+            outfile=os.path.abspath(os.path.expanduser(outfile)) if outfile else "",
+            nodes=list(timings.root.walk())[1:],
+        )
+    finally:
+        index.close()
 
-    pip_addons = fabsetup.addons.load_pip_addons()
-    repo_addons = fabsetup.addons.load_repo_addons()
+
+def main(namespace=None):
+
+    if namespace is None:
+        namespace = invoke.Collection.from_module(fabsetup.fabfile)
+
+    manifest = fabsetup.addons.Manifest.load()
+    pip_addons = fabsetup.addons.load_pip_addons(manifest)
+    repo_addons = fabsetup.addons.load_repo_addons(manifest)
+    manifest.save()
 
     for addon in pip_addons + repo_addons:
         fabsetup.addons.merge_or_add_r(namespace, collection=addon)
@@ -30,7 +63,7 @@ def main(namespace=invoke.Collection.from_module(fabsetup.fabfile)):
         program = fabsetup.main.Fabsetup(
             name="Fabsetup",
             version=fabsetup.__version__,
-            executor_class=fabric.executor.Executor,
+            executor_class=fabsetup.executor.ParallelExecutor,
             # config_class=fabric.main.Config,
             config_class=fabsetup.main.FabsetupConfig,
             namespace=namespace,
@@ -46,58 +79,85 @@ def main(namespace=invoke.Collection.from_module(fabsetup.fabfile)):
 
         if program.config.outfile.name and program.tee:
             program.tee.stop()
+            if program.tee.toc:
+                program.tee.toc.close()
 
             outfile_abspath = os.path.abspath(
                 os.path.expanduser(program.config.outfile.name)
             )
 
-            if not program.config.outfile.keep_color:
-
-                # remove color codes
+            host_html_names = program.host_html_names()
 
-                fabsetup.utils.outfile.remove_color_codes(outfile_abspath)
+            if program.tee.host_outfiles:
 
-                if hasattr(program, "pandoc") and program.config.outfile.pandoc.toc:
+                # index of the outfiles of the hosts, with an HTML file the
+                # links point to the HTML files of the hosts
 
-                    # horizontal line + toc
-
-                    with open(outfile_abspath, "r") as fh_in:
-                        data = fh_in.read()
+                if host_html_names:
+                    index = program.tee.host_outfiles.index_markdown(
+                        os.path.dirname(
+                            os.path.abspath(
+                                os.path.expanduser(
+                                    program.config.outfile.pandoc.html.name
+                                )
+                            )
+                        ),
+                        links=host_html_names,
+                    )
+                else:
+                    index = program.tee.host_outfiles.index_markdown(
+                        os.path.dirname(outfile_abspath)
+                    )
+                index = "\n# Hosts\n\n" + index
 
-                    with open(outfile_abspath, "w") as fh_out:
-                        fh_out.write("----\n\n" + data)
+                with fabsetup.utils.outfile.open_outfile(outfile_abspath, "a") as fh:
+                    fh.write(index)
+                if program.live_html:
+                    program.live_html.feed(index)
 
-                    program.pandoc.add_toc(outfile_abspath)
+            # header of the outfile, prepended at once in order to rewrite
+            # the (compressed) outfile only once
+            header = ""
 
             if program.config.outfile.prepend_executed_fabsetup_command:
 
                 # fabsetup command
 
-                command_postfix = "" if program.config.outfile.pandoc.toc else "----\n"
-
-                with open(outfile_abspath, "r") as fh_in:
-                    data = fh_in.read()
-
-                with open(outfile_abspath, "w") as fh_out:
-                    # eg.
-                    #     ```
-                    #     /path/to/bin/fabsetup taskname
-                    #     [0]
-                    #     ```
-                    #
-                    #     ...output of fabsetup task execution...
-                    #
-                    fh_out.write(
-                        "{}```\n{}\n[{}]\n```\n\n{}".format(
-                            program.config.outfile.fabsetup_command_prefix,
-                            program.command,
-                            exit_code,
-                            command_postfix,
-                        )
-                        + data
-                    )
+                command_postfix = "" if program.tee.toc else "----\n"
+
+                # eg.
+                #     ```
+                #     /path/to/bin/fabsetup taskname
+                #     [0]
+                #     ```
+                #
+                #     ...output of fabsetup task execution...
+                #
+                header += "{}```\n{}\n[{}]\n```\n\n{}".format(
+                    program.config.outfile.fabsetup_command_prefix,
+                    program.command,
+                    exit_code,
+                    command_postfix,
+                )
+
+            if program.tee.toc and program.tee.toc.headings:
+
+                # toc of the headings collected by the tee (horizontal line
+                # already has been written by the tee)
 
-            if program.config.outfile.pandoc.html.name:
+                header += program.tee.toc.markdown() + "\n"
+
+            if header:
+                fabsetup.utils.outfile.prepend_to_file(outfile_abspath, header)
+
+            if program.live_html:
+
+                # html has been rendered while the outfile was written,
+                # complete it with the header of the outfile
+
+                program.live_html.close(header or None)
+
+            elif program.config.outfile.pandoc.html.name:
 
                 # markdown -> html
 
@@ -115,9 +175,38 @@ def main(namespace=invoke.Collection.from_module(fabsetup.fabfile)):
                     inline=True,
                 )
 
+            if host_html_names:
+
+                # markdown -> html of the outfiles of the hosts, in parallel
+
+                fabsetup.utils.pandoc.render_files(
+                    host_html_names.items(),
+                    command=(
+                        program.pandoc.command
+                        if program.pandoc
+                        else fabsetup.utils.pandoc.BUILTIN
+                    ),
+                )
+
+        if program.config.history.record:
+            try:
+                record_history(program, exit_code)
+            except sqlite3.Error as exc:
+                # do not hide the outcome of the run
+                print(
+                    "run not recorded in the history: {}".format(exc), file=sys.stderr
+                )
+
+        events = fabsetup.utils.events.EventLog()
+        events.emit("run_end", exit_code=exit_code)
+        events.close()
+
         if program.config.run_finally:
             subprocess.run(program.config.run_finally, shell=True)
 
+    if exit_code:
+        sys.exit(exit_code)
+
 
 if __name__ == "__main__":
     main()
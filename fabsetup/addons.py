@@ -2,13 +2,23 @@
 
 ``load_pip_addons()`` and ``load_repo_addons()``  will be used in
 ``fabsetup.__main__.main()`` to add fabsetup addons to fabsetup.
+
+When a ``Manifest`` is given, the tasks of an addon are taken from the
+manifest file as long as the addon's source files are unchanged.  Then, the
+addon module will only be imported when one of its tasks is executed.
 """
 
+import inspect
+import json
 import os
 import importlib
+import importlib.util
 import sys
 
 import invoke
+from invoke.util import debug
+
+from fabsetup._version import __version__
 
 
 KNOWN_PIP_PACKAGE_ADDONS = [
@@ -17,6 +27,8 @@ KNOWN_PIP_PACKAGE_ADDONS = [
 
 REPOS_DIR = os.path.expanduser("~/.fabsetup-addon-repos")
 
+MANIFEST_FILE = os.path.expanduser("~/.fabsetup-addon-manifest.json")
+
 REPO_MODULES = []
 PIP_MODULES = []
 
@@ -48,28 +60,308 @@ def module_username(package_name):
     return module, username
 
 
-def load_addon(package_name):
+def source_mtime(path):
+    """Return the latest modification time of file ``path`` or of the
+    directory ``path`` and the Python files and directories below.
+    """
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+    mtimes = []
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames[:] = [name for name in dirnames if name != "__pycache__"]
+        mtimes.append(os.path.getmtime(dirpath))
+        mtimes += [
+            os.path.getmtime(os.path.join(dirpath, name))
+            for name in filenames
+            if name.endswith(".py")
+        ]
+    return max(mtimes)
+
+
+class ManifestModule:
+    """Stand-in for a not (yet) imported addon module with the attributes
+    used by ``fabsetup.version_str()``.
+    """
+
+    def __init__(self, name, version):
+        self.__name__ = name
+        self.__version__ = version
+
+    def __repr__(self):
+        return "ManifestModule({name})".format(name=self.__name__)
+
+
+class NotCacheable(Exception):
+    """The tasks of an addon can not be described by a manifest entry."""
+
+
+_JSON_TYPES = (type(None), bool, int, float, str, list)
+
+
+def _task_entry(task, name, path):
+    if task.pre or task.post:
+        raise NotCacheable("pre- or post-tasks of {}".format(path))
+
+    args = []
+    params = list(inspect.signature(task.body).parameters.values())[1:]
+    for param in params:
+        if param.kind not in (param.POSITIONAL_OR_KEYWORD, param.KEYWORD_ONLY):
+            raise NotCacheable("argument {} of {}".format(param.name, path))
+        arg = {"name": param.name}
+        if param.default is not param.empty:
+            if not isinstance(param.default, _JSON_TYPES):
+                raise NotCacheable("default of {} of {}".format(param.name, path))
+            arg["default"] = param.default
+        args.append(arg)
+
+    return {
+        "name": name,
+        "path": path,
+        "task_name": task.name,
+        "doc": task.__doc__,
+        "args": args,
+        "aliases": list(task.aliases),
+        "positional": list(task.positional),
+        "optional": list(task.optional),
+        "iterable": list(task.iterable),
+        "incrementable": list(task.incrementable),
+        "auto_shortflags": task.auto_shortflags,
+        "help": task.help,
+        "autoprint": task.autoprint,
+        "hosts": getattr(task, "hosts", None),
+    }
+
+
+def _collection_entry(collection, path=""):
+    return {
+        "name": collection.name,
+        "doc": collection.__doc__,
+        "default": collection.default,
+        "configuration": collection._configuration,
+        "tasks": [
+            _task_entry(task, name, path + name)
+            for name, task in collection.tasks.items()
+        ],
+        "collections": [
+            _collection_entry(sub_coll, path + name + ".")
+            for name, sub_coll in collection.collections.items()
+        ],
+    }
+
+
+def _lazy_task(entry, module_name, username):
+    """Return a task described by ``entry`` which imports the module of the
+    addon not until the task is called.
+    """
+    import fabric.tasks
+
+    def body(c, *args, **kwargs):
+        module = importlib.import_module(module_name)
+        collection = invoke.Collection.from_module(module, name=username)
+        return collection[entry["path"]](c, *args, **kwargs)
+
+    body.__name__ = entry["task_name"]
+    body.__doc__ = entry["doc"]
+    body.__module__ = module_name
+    body.__signature__ = inspect.Signature(
+        [inspect.Parameter("c", inspect.Parameter.POSITIONAL_OR_KEYWORD)]
+        + [
+            inspect.Parameter(
+                arg["name"],
+                inspect.Parameter.POSITIONAL_OR_KEYWORD,
+                default=arg.get("default", inspect.Parameter.empty),
+            )
+            for arg in entry["args"]
+        ]
+    )
+
+    return fabric.tasks.Task(
+        body,
+        aliases=tuple(entry["aliases"]),
+        positional=entry["positional"],
+        optional=entry["optional"],
+        auto_shortflags=entry["auto_shortflags"],
+        help=entry["help"],
+        autoprint=entry["autoprint"],
+        iterable=entry["iterable"],
+        incrementable=entry["incrementable"],
+        hosts=entry["hosts"],
+    )
+
+
+def _lazy_collection(entry, module_name, username):
+    collection = invoke.Collection(entry["name"])
+    collection.__doc__ = entry["doc"]
+    for task_entry in entry["tasks"]:
+        collection.add_task(
+            _lazy_task(task_entry, module_name, username), name=task_entry["name"]
+        )
+    for sub_entry in entry["collections"]:
+        collection.add_collection(_lazy_collection(sub_entry, module_name, username))
+    collection.default = entry["default"]
+    collection.configure(entry["configuration"])
+    return collection
+
+
+class Manifest:
+    """Persisted task names, docstrings and argument specs of fabsetup addons.
+
+    An entry of an addon is valid as long as the modification time of the
+    addon's source files (cf. ``source_mtime()``) and the fabsetup version are
+    unchanged.
+
+    :param str filename:
+        Optionally, path of the manifest file, default:
+        ``fabsetup.addons.MANIFEST_FILE``.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename or MANIFEST_FILE
+        self.addons = {}
+        self.changed = False
+
+    @classmethod
+    def load(cls, filename=None):
+        """Return the ``Manifest`` read from ``filename``.
+
+        An unreadable manifest file or a manifest file of another fabsetup
+        version results in an empty manifest.
+        """
+        manifest = cls(filename)
+        try:
+            with open(manifest.filename, "r") as fh_in:
+                data = json.load(fh_in)
+            if data.get("fabsetup") == __version__:
+                manifest.addons = data["addons"]
+        except (OSError, ValueError, KeyError, AttributeError):
+            pass
+        return manifest
+
+    def save(self):
+        """Write the manifest file if any entry has been changed.
+
+        If the manifest file can not be written (e.g. a read-only cache dir)
+        the addons are loaded without manifest on the next run.
+        """
+        if not self.changed:
+            return
+        tmp_filename = "{}.tmp".format(self.filename)
+        try:
+            with open(tmp_filename, "w") as fh_out:
+                json.dump({"fabsetup": __version__, "addons": self.addons}, fh_out)
+            os.replace(tmp_filename, self.filename)
+        except OSError as exc:
+            debug("manifest not saved: {}".format(exc))
+            return
+        self.changed = False
+
+    def lookup(self, package_name, module_dirname):
+        """Return a ``(ManifestModule, collection)`` pair from a valid entry of
+        ``package_name``, else ``None``.
+        """
+        entry = self.addons.get(package_name)
+        if (
+            not entry
+            or entry["collection"] is None
+            or entry["module_dirname"] != module_dirname
+            or entry["mtime"] != source_mtime(module_dirname)
+        ):
+            return None
+        module_name, username = module_username(package_name)
+        module = ManifestModule(module_name, entry["version"])
+        collection = _lazy_collection(entry["collection"], module_name, username)
+        return module, collection
+
+    def update(self, package_name, module_dirname, module, collection):
+        """Create or replace the entry of ``package_name``."""
+        try:
+            collection_entry = _collection_entry(collection)
+            json.dumps(collection_entry)
+        except (NotCacheable, TypeError, ValueError):
+            collection_entry = None  # always import this addon
+        self.addons[package_name] = {
+            "module_dirname": module_dirname,
+            "mtime": source_mtime(module_dirname),
+            "version": getattr(module, "__version__", ""),
+            "collection": collection_entry,
+        }
+        self.changed = True
+
+
+def load_addon(package_name, manifest=None, module_dirname=None):
     """Load fabsetup addon ``package_name`` and return it as a
     ``(module, collection)`` pair.
 
     :param str package_name:
         Package name of the fabsetup addon, e.g. ``'fabsetup-theno-termdown'``.
 
+    :param fabsetup.addons.Manifest manifest:
+        Optionally, take the collection from the manifest if its entry for
+        ``package_name`` is still valid, else import the module and update
+        the manifest.  Then, ``module_dirname`` is required.
+
+    :param str module_dirname:
+        Path of the addon module (directory or file).
+
     :returns:
-        Two-tuple ("fabsetup_USERNAME_TASKNAME", `invoke.Collection`).
+        Two-tuple ("fabsetup_USERNAME_TASKNAME", `invoke.Collection`).  If
+        the collection has been taken from the manifest, the module is a
+        ``fabsetup.addons.ManifestModule``.
     """
+    use_manifest = manifest is not None and module_dirname is not None
+    if use_manifest:
+        try:
+            cached = manifest.lookup(package_name, module_dirname)
+        except OSError:  # source files not found, load without manifest
+            cached = None
+            use_manifest = False
+        if cached:
+            return cached
     module_name, username = module_username(package_name)
     module = importlib.import_module(module_name)
     collection = invoke.Collection.from_module(module, name=username)
+    if use_manifest:
+        try:
+            manifest.update(package_name, module_dirname, module, collection)
+        except OSError:
+            pass
     return module, collection
 
 
-def load_pip_addons():
+def _repo_module_dirname(repo_dirpath, module_name):
+    """Return the path of the addon module in ``repo_dirpath``, a package
+    directory or a single ``.py`` file, or ``None`` if there is none.
+    """
+    module_dirname = os.path.join(repo_dirpath, module_name)
+    if os.path.isdir(module_dirname):
+        return module_dirname
+    if os.path.isfile(module_dirname + ".py"):
+        return module_dirname + ".py"
+    return None
+
+
+def _pip_module_dirname(package_name):
+    """Return the path of the installed addon module, or ``None`` if the
+    addon is not installed.
+    """
+    module_name, _ = module_username(package_name)
+    spec = importlib.util.find_spec(module_name)
+    if spec is None or spec.origin is None:
+        return None
+    if spec.submodule_search_locations:
+        return os.path.dirname(spec.origin)
+    return spec.origin
+
+
+def load_pip_addons(manifest=None):
     """Load all known fabsetup addons which are installed as pypi pip-packages.
 
     The loaded collections are returned as a list and also stored in list
     attribute ``fabsetup.addons.PIP_MODULES``.
 
+    :param fabsetup.addons.Manifest manifest:
+        Optionally, load the addons lazily, cf. ``load_addon()``.
+
     :returns:
         list of `[invoke.Collection`, `invoke.Collection, ...]`,
     """
@@ -78,7 +370,12 @@ def load_pip_addons():
     for package_name in KNOWN_PIP_PACKAGE_ADDONS:
 
         try:
-            module, collection = load_addon(package_name)
+            module_dirname = None
+            if manifest is not None:
+                module_dirname = _pip_module_dirname(package_name)
+                if module_dirname is None:
+                    continue  # non-installed addon
+            module, collection = load_addon(package_name, manifest, module_dirname)
             collections.append(collection)
             PIP_MODULES.append(module)
 
@@ -88,13 +385,16 @@ def load_pip_addons():
     return collections
 
 
-def load_repo_addons():
+def load_repo_addons(manifest=None):
     """Load all fabsetup addons which are stored under
     ``~/.fabsetup-addon-repos`` as git repositories.
 
     The loaded collections are returned as a list and also stored in
     ``fabsetup.addons.REPO_MODULES``.
 
+    :param fabsetup.addons.Manifest manifest:
+        Optionally, load the addons lazily, cf. ``load_addon()``.
+
     :returns:
         list of `[invoke.Collection`, `invoke.Collection, ...]`,
     """
@@ -118,7 +418,10 @@ def load_repo_addons():
             # eg. package_name = 'fabsetup-theno-termdown'
             package_name = repo_dirpath.split("/")[-1]
 
-            module, collection = load_addon(package_name)
+            module_name, _ = module_username(package_name)
+            module_dirname = _repo_module_dirname(repo_dirpath, module_name)
+
+            module, collection = load_addon(package_name, manifest, module_dirname)
             collections.append(collection)
             REPO_MODULES.append(module)
 
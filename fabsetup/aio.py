@@ -0,0 +1,442 @@
+"""Asyncio execution backend of fabsetup tasks.
+
+A task decorated by `task` is a coroutine function which gets an
+`AsyncContext`.  Its ``c.run()``, ``c.local()``, and ``c.put()`` return
+awaitables which execute the command in a child process, remote commands by
+the OpenSSH client (``run.ssh_command``).  On parallel execution (``fabsetup
+-H host1,host2,... --parallel N``) ``fabsetup.executor.ParallelExecutor``
+executes such a task for all hosts in one event loop by `run_batch()`,
+without a thread per host.  Executed sequentially the task is run by
+``asyncio.run()`` per host.
+
+The asyncio backend requires Python 3.7 or newer.
+
+Synchronous tasks and subtasks (decorated by ``fabsetup.task.task`` or
+``fabsetup.task.subtask``) can be awaited within an async task with
+``await c.sync(func)``, they are executed in a worker thread.
+
+Example::
+
+    import fabsetup.aio
+
+    @fabsetup.aio.task
+    async def uptime(c):
+        '''Print the uptime.'''
+        await c.run("uptime")
+        if not (await c.run("test -d ~/repos", warn=True, hide=True)).ok:
+            await c.sync(setup_repos)  # a sync fabsetup subtask
+"""
+
+import asyncio
+import codecs
+import contextlib
+import contextvars
+import functools
+import getpass
+import inspect
+import os
+import shlex
+import socket
+import sys
+
+import fabric
+import invoke
+import invoke.exceptions
+import invoke.runners
+
+from fabsetup.print import print_code_block, print_command_line, print_default
+from fabsetup.task import (
+    append_numbered_index,
+    from_config,
+    get_task_depth,
+    increment_numbered_state,
+    print_duration,
+    remove_numbered_index,
+    wrap_context,
+)
+from fabsetup.utils.colors import config_color, green, magenta, yellow
+from fabsetup.utils.decorate import invoked
+from fabsetup.utils.decorators import print_doc, print_full_name
+from fabsetup.utils.outfile import ContextLocal, OutputDemux
+from fabsetup.utils.timing import Timings
+
+SSH_COMMAND = (
+    "ssh -o BatchMode=yes -o ControlMaster=auto -o ControlPersist=60 "
+    "-o ControlPath=~/.ssh/fabsetup-%C"
+)
+"""Default of ``run.ssh_command``: Connections to the same host are
+multiplexed over one master connection."""
+
+
+async def _read(stream, writer, hidden):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    chunks = []
+    while True:
+        data = await stream.read(64 * 1024)
+        text = decoder.decode(data, final=not data)
+        if text:
+            chunks.append(text)
+            if not hidden:
+                writer.write(text)
+                writer.flush()
+        if not data:
+            return "".join(chunks)
+
+
+class AsyncContext:
+    """Context of an async task executed for one host.
+
+    :param config:
+        The ``invoke.config.Config`` (or ``fabric.config.Config``).
+
+    :param str host:
+        Name of the remote host or ``None`` (or ``'localhost'``) to execute
+        ``run()`` locally.
+
+    :param str user:
+        Remote user, default: the local user.
+
+    :param int port:
+        SSH port, default: the port of the ssh configuration.
+    """
+
+    def __init__(self, config, host=None, user=None, port=None):
+        self.config = config
+        self.host = host
+        self.user = user or getpass.getuser()
+        self.port = port
+        self.c = self  # cf. method-type tasks of fabsetup.utils.decorators
+        self._connection = None
+
+    @classmethod
+    def from_context(cls, c):
+        """Return the `AsyncContext` of ``invoke`` context or ``fabric``
+        connection ``c``."""
+        return cls(
+            c.config,
+            host=getattr(c, "host", None),
+            user=getattr(c, "user", None),
+            port=getattr(c, "port", None),
+        )
+
+    @property
+    def remote(self):
+        return self.host not in (None, "localhost")
+
+    def ssh_argv(self, cmd):
+        """Return the argv of the ssh client which executes ``cmd``."""
+        argv = shlex.split(
+            from_config(self.config, ["run", "ssh_command"], SSH_COMMAND)
+        )
+        if self.port and int(self.port) != 22:
+            argv += ["-p", str(self.port)]
+        return argv + ["{}@{}".format(self.user, self.host), cmd]
+
+    async def _execute(self, cmd, argv, remote, hide, warn):
+        hidden = invoke.runners.normalize_hide(hide)
+        codeblock = hide is not True
+
+        if codeblock:
+            if remote:
+                user, host = self.user, self.host
+                color = config_color(
+                    self.config, ["output", "color", "cmd_remote"], yellow
+                )
+            else:
+                user, host = getpass.getuser(), socket.gethostname()
+                color = config_color(
+                    self.config, ["output", "color", "cmd_local"], green
+                )
+            print_code_block("\n```sh\n", end="")
+            print_command_line("{}@{}> {}".format(user, host, color(cmd, bold=True)))
+
+        with Timings().measure(
+            "command", cmd, host=self.host if remote else None
+        ) as node:
+            process = await asyncio.create_subprocess_exec(
+                *argv,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stdout, stderr = await asyncio.gather(
+                _read(process.stdout, sys.stdout, "stdout" in hidden),
+                _read(process.stderr, sys.stderr, "stderr" in hidden),
+            )
+            node.return_code = await process.wait()
+            node.args["stdout_bytes"] = len(stdout.encode())
+            node.args["stderr_bytes"] = len(stderr.encode())
+
+        if codeblock:
+            if node.return_code != 0:
+                print_default("[{}]\n".format(node.return_code), end="")
+            if from_config(self.config, ["output", "timing"], False):
+                print_default("({:.3f} s)\n".format(node.wall), end="")
+            print_code_block("```\n", end="")
+
+        result = invoke.runners.Result(
+            stdout=stdout,
+            stderr=stderr,
+            command=cmd,
+            shell="/bin/sh",
+            exited=node.return_code,
+            hide=hidden,
+        )
+        if node.return_code != 0 and not warn:
+            raise invoke.exceptions.UnexpectedExit(result)
+        return result
+
+    async def run(self, cmd, hide=None, warn=False):
+        """Execute ``cmd`` on the host (or locally, if there is no remote
+        host) and print it with its output as Markdown code block.
+
+        :returns:
+            ``invoke.runners.Result``
+
+        :raises invoke.exceptions.UnexpectedExit:
+            If the return code is not ``0`` and not ``warn``.
+        """
+        if not self.remote:
+            return await self.local(cmd, hide=hide, warn=warn)
+        return await self._execute(cmd, self.ssh_argv(cmd), True, hide, warn)
+
+    async def local(self, cmd, hide=None, warn=False):
+        """Execute ``cmd`` locally, cf. `run()`."""
+        return await self._execute(cmd, ["/bin/sh", "-c", cmd], False, hide, warn)
+
+    async def put(self, local, remote):
+        """Upload the file ``local`` to ``remote`` by ``cat`` executed by the
+        ssh client (or copy it, if there is no remote host).
+
+        A ``remote`` path beginning with ``~/`` is relative to the home dir
+        of the remote user.
+        """
+        host = self.host if self.remote else "localhost"
+        print_default("\n* put: `{}` → `{}:{}`".format(local, host, remote))
+        if self.remote:
+            if remote.startswith("~/"):
+                remote = remote[2:]
+            argv = self.ssh_argv("cat > {}".format(shlex.quote(remote)))
+        else:
+            argv = ["cp", "-p", local, os.path.expanduser(remote)]
+        with Timings().measure("put", "put {}".format(remote), host=self.host):
+            with open(local, "rb") as stdin:
+                process = await asyncio.create_subprocess_exec(
+                    *argv,
+                    stdin=stdin if self.remote else asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+                _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise OSError(stderr.decode(errors="replace").strip())
+
+    def blocking_context(self):
+        """Return a ``fabric.Connection`` (or ``invoke.Context`` without
+        remote host) for synchronous tasks."""
+        if self._connection is None:
+            if self.remote:
+                self._connection = fabric.Connection(
+                    self.host, user=self.user, port=self.port, config=self.config
+                )
+            else:
+                self._connection = invoke.Context(config=self.config)
+            wrap_context(
+                self._connection,
+                command_output_prefix=from_config(
+                    self.config, ["output", "command_output_prefix"], ""
+                ),
+                command_errput_prefix=from_config(
+                    self.config, ["output", "command_errput_prefix"], ""
+                ),
+            )
+        return self._connection
+
+    async def sync(self, func, *args, **kwargs):
+        """Execute the synchronous task or subtask ``func`` in a worker
+        thread.
+
+        The worker thread inherits the output buffer and the current timing
+        node of the calling asyncio task.
+
+        :returns:
+            The return value of ``func``.
+        """
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            functools.partial(
+                context.run, func, self.blocking_context(), *args, **kwargs
+            ),
+        )
+
+    def close(self):
+        """Close the connection of synchronous tasks."""
+        if isinstance(self._connection, fabric.Connection):
+            self._connection.close()
+        self._connection = None
+
+
+async def run_task(func, c, args=(), kwargs=None, name=None, doc=True, depth=None):
+    """Execute the coroutine function ``func`` as task: Print its Markdown
+    heading (and docstring), measure it and await it.
+    """
+    cur_depth = get_task_depth(c, default=int(depth or 1))
+    color = config_color(c.config, ["output", "color", "task_heading"], magenta)
+    wrapped = print_full_name(
+        color=color,
+        prefix="\n" + "#" * cur_depth + " ",
+        tail="\n",
+        name=name,
+        numbered=increment_numbered_state(c),
+    )(print_doc(prefix="")(func) if doc else func)
+
+    append_numbered_index(c)
+    c.config.output["task_depth"] = cur_depth + 1
+
+    with Timings().measure("task", name or func.__qualname__, host=c.host) as timing:
+        res = await wrapped(c, *args, **(kwargs or {}))
+    print_duration(c, timing)
+
+    remove_numbered_index(c)
+    c.config.output["task_depth"] = cur_depth
+    return res
+
+
+def task(*args, **kwargs):
+    """Decorator of an async fabsetup task, based on `fabric.tasks.task
+    <https://docs.fabfile.org/en/latest/api/tasks.html#fabric.tasks.task>`_.
+
+    The decorated coroutine function gets an `AsyncContext` instead of a
+    connection.  Besides the arguments of ``fabric.tasks.task`` the keyword
+    arguments ``name``, ``doc`` and ``depth`` of ``fabsetup.task.task`` are
+    supported.
+    """
+    name = kwargs.pop("name", None)
+    doc = kwargs.pop("doc", True)
+    depth = kwargs.pop("depth", None)
+
+    def real_decorator(func):
+        @functools.wraps(func)
+        def wrapped_func(c, *argz, **kwargz):
+            # sync adapter, e.g. on sequential execution
+            context = AsyncContext.from_context(c)
+            try:
+                return asyncio.run(
+                    run_task(func, context, argz, kwargz, name, doc, depth)
+                )
+            finally:
+                context.close()
+
+        wrapped_func.__signature__ = inspect.signature(func)
+        wrapped_func.async_body = func
+        wrapped_func.async_task_kwargs = dict(name=name, doc=doc, depth=depth)
+
+        task_args = args
+        if len(args) == 1:
+            task_args = []  # when decorated as `@task`
+
+        return fabric.task(*task_args, **kwargs)(wrapped_func)
+
+    if invoked(args, kwargs):
+        return real_decorator  # when decorated as `@task(...)`
+    return real_decorator(func=args[0])  # when decorated as `@task`
+
+
+def is_async_task(task_):
+    """Return ``True`` if ``task_`` has been decorated by `task`."""
+    return getattr(getattr(task_, "body", None), "async_body", None) is not None
+
+
+@contextlib.contextmanager
+def _pidfd_child_watcher():
+    # before Python 3.12 asyncio waits for each child process in its own
+    # thread, a pidfd is watched by the event loop instead
+    if sys.version_info >= (3, 12) or not hasattr(asyncio, "PidfdChildWatcher"):
+        yield
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):  # not supported by the kernel
+        yield
+        return
+    policy = asyncio.get_event_loop_policy()
+    previous = policy.get_child_watcher()
+    watcher = asyncio.PidfdChildWatcher()
+    watcher.attach_loop(asyncio.get_running_loop())
+    policy.set_child_watcher(watcher)
+    try:
+        yield
+    finally:
+        policy.set_child_watcher(previous)
+        watcher.close()
+
+
+def run_batch(task_, contexts, args=(), kwargs=None, limit=None, replay_context=None):
+    """Execute the async ``task_`` for each of ``contexts`` concurrently in
+    one event loop.
+
+    The output of each execution is buffered and written in the order of
+    ``contexts`` as soon as the execution and all preceding executions have
+    finished.
+
+    :param task_:
+        Task decorated by `task` (or its body).
+
+    :param [AsyncContext] contexts:
+
+    :param int limit:
+        Maximum number of concurrent executions, default: unlimited.
+
+    :param callable replay_context:
+        Optionally called with the index of an execution and its exception
+        (or ``None``), returns the context manager within which the buffered output
+        of the execution is written, e.g.
+        ``fabsetup.utils.outfile.Tee.host_outfile()``.
+
+    :returns:
+        list of tuples ``(result, exception)``.
+    """
+    body = getattr(task_, "body", task_)
+    func = body.async_body
+    task_kwargs = body.async_task_kwargs
+    demux = OutputDemux(local=ContextLocal())
+
+    async def execute_all():
+        with _pidfd_child_watcher():
+            return await execute_contexts()
+
+    async def execute_contexts():
+        semaphore = asyncio.Semaphore(limit or len(contexts) or 1)
+        parent = Timings().current()
+
+        async def execute(context):
+            async with semaphore:
+                with Timings().inherit(parent), demux.buffered() as buffer:
+                    try:
+                        result = await run_task(
+                            func, context, args, kwargs, **task_kwargs
+                        )
+                        return result, None, buffer
+                    except (Exception, SystemExit) as exc:
+                        return None, exc, buffer
+                    finally:
+                        context.close()
+
+        executions = [asyncio.create_task(execute(c)) for c in contexts]
+        outcomes = []
+        for index, execution in enumerate(executions):
+            result, exc, buffer = await execution
+            if replay_context is None:
+                demux.replay(buffer)
+            else:
+                with replay_context(index, exc):
+                    demux.replay(buffer)
+            outcomes.append((result, exc))
+        return outcomes
+
+    demux.start()
+    try:
+        return asyncio.run(execute_all())
+    finally:
+        demux.stop()
@@ -0,0 +1,160 @@
+"""Checkpoints of completed subtasks in order to resume a failed run.
+
+While a task decorated by ``fabsetup.task.task`` is executed, each completed
+subtask is recorded with its ``numbered_state``, its name and a hash of its
+inputs in a JSON file per task and host in ``checkpoint.dir``.  When the task
+has been completed the file is removed.  With ``fabsetup --resume`` (config
+``checkpoint.resume``) subtasks which have been completed by the failed run
+with unchanged inputs are skipped.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import os.path
+import re
+import threading
+import time
+
+from fabsetup.utils.outfile import Singleton
+
+
+def input_hash(func, args, kwargs):
+    """Return a hash of the source code of ``func`` and of its arguments.
+
+    Arguments without a stable ``repr()`` (e.g. objects printed with their
+    memory address) change the hash on each run, so such a subtask is never
+    skipped.
+
+    Example:
+
+        >>> def func(c, name):
+        ...     pass
+        >>> input_hash(func, ('a',), {}) == input_hash(func, ('a',), {})
+        True
+        >>> input_hash(func, ('a',), {}) == input_hash(func, ('b',), {})
+        False
+    """
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = func.__code__.co_code.hex()
+    data = "\n".join([source, repr(args), repr(sorted(kwargs.items()))])
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def checkpoint_filename(directory, task, host):
+    """Return the path of the checkpoint file of ``task`` on ``host``.
+
+    Example:
+
+        >>> checkpoint_filename('/tmp/checkpoints', 'me.hello', 'user@web1')
+        '/tmp/checkpoints/me.hello_user_web1.json'
+        >>> checkpoint_filename('/tmp/checkpoints', 'me.hello', None)
+        '/tmp/checkpoints/me.hello_local.json'
+    """
+    name = re.sub(r"[^\w.-]", "_", "{}_{}".format(task, host or "local"))
+    return os.path.join(os.path.expanduser(directory), name + ".json")
+
+
+class Checkpoint:
+    """Completed subtasks (steps) of one task on one host.
+
+    :param str filename:
+        Path of the checkpoint file, created on the first recorded step.
+
+    :param bool resume:
+        If ``True`` the steps recorded in ``filename`` by a previous run are
+        `completed()`, else an existing ``filename`` is removed.
+
+    Example:
+
+        >>> import tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> filename = checkpoint_filename(directory, 'me.hello', 'web1')
+        >>> checkpoint = Checkpoint(filename)
+        >>> checkpoint.record('1.2', 'greet', 'abc')
+        >>> resumed = Checkpoint(filename, resume=True)
+        >>> resumed.completed('1.2', 'greet', 'abc')
+        True
+        >>> resumed.completed('1.2', 'greet', 'changed')
+        False
+        >>> Checkpoint(filename).completed('1.2', 'greet', 'abc')
+        False
+        >>> os.path.exists(filename)
+        False
+    """
+
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.previous = {}
+        if resume:
+            try:
+                with open(filename) as fh:
+                    self.previous = json.load(fh)["steps"]
+            except (OSError, ValueError, KeyError):
+                self.previous = {}
+        else:
+            self.remove()
+        # steps skipped on resume stay completed if the run fails again
+        self.steps = dict(self.previous)
+
+    def completed(self, numbered_state, name, step_hash):
+        """Return ``True`` if the step has been completed by the previous run
+        with the same inputs.
+        """
+        return self.previous.get(numbered_state) == {
+            "name": name,
+            "hash": step_hash,
+        }
+
+    def record(self, numbered_state, name, step_hash):
+        """Record the step as completed and write the checkpoint file."""
+        with self.lock:
+            self.steps[numbered_state] = {"name": name, "hash": step_hash}
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            tmp_filename = self.filename + ".tmp"
+            with open(tmp_filename, "w") as fh:
+                json.dump({"updated": time.time(), "steps": self.steps}, fh)
+            os.replace(tmp_filename, self.filename)
+
+    def remove(self):
+        """Remove the checkpoint file."""
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
+
+
+class Checkpoints(metaclass=Singleton):
+    """Run-scoped registry of the `Checkpoint` of each executed task and host.
+
+    Uses `fabsetup.utils.outfile.Singleton` as metaclass.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkpoints = {}
+
+    def start(self, directory, task, host, resume=False):
+        """Create and return the `Checkpoint` of ``task`` on ``host``."""
+        checkpoint = Checkpoint(
+            checkpoint_filename(directory, task, host), resume=resume
+        )
+        with self.lock:
+            self.checkpoints[(task, host)] = checkpoint
+        return checkpoint
+
+    def get(self, task, host):
+        """Return the `Checkpoint` of ``task`` on ``host`` or ``None``."""
+        with self.lock:
+            return self.checkpoints.get((task, host))
+
+    def finish(self, task, host):
+        """Remove the checkpoint of the completed ``task`` on ``host``."""
+        with self.lock:
+            checkpoint = self.checkpoints.pop((task, host), None)
+        if checkpoint is not None:
+            checkpoint.remove()
@@ -0,0 +1,223 @@
+"""Execute fabsetup tasks on several hosts in parallel."""
+
+import concurrent.futures
+
+import fabric.executor
+import fabric.tasks
+from invoke.util import debug
+
+import fabsetup.utils.outfile
+
+
+def shifted_numbered_state(numbered_state, offset):
+    """Return ``numbered_state`` with its last index shifted by ``offset``.
+
+    Example:
+
+        >>> shifted_numbered_state('0', 3)
+        '3'
+        >>> shifted_numbered_state('2.1', 2)
+        '2.3'
+    """
+    indices = [int(index) for index in numbered_state.split(".")]
+    indices[-1] += offset
+    return ".".join([str(index) for index in indices])
+
+
+def _last_index(numbered_state):
+    return int(numbered_state.split(".")[-1])
+
+
+class ParallelExecutor(fabric.executor.Executor):
+    """`fabric.executor.Executor` subclass which runs a task on up to
+    ``run.parallel`` hosts at once.
+
+    The calls of a task are executed host after host as by Fabric, but
+    consecutive calls of the same task for different hosts (``-H
+    host1,host2,...``) are executed concurrently in a thread pool.  The output
+    of each host is buffered by a ``fabsetup.utils.outfile.OutputDemux`` and
+    replayed in host order, so the Markdown output (and the outfile) is the
+    same as on sequential execution.
+
+    If ``run.parallel`` is less than 2 the tasks are executed sequentially by
+    `fabric.executor.Executor.execute()`.  With ``outfile.per_host`` the
+    output of each call is written into the outfile of its host (cf.
+    ``fabsetup.utils.outfile.HostOutfiles``).
+    """
+
+    def workers(self):
+        try:
+            return int(self.config.run.parallel or 1)
+        except AttributeError:
+            return 1
+
+    def per_host_outfiles(self):
+        try:
+            return bool(self.config.outfile.per_host and self.config.outfile.name)
+        except AttributeError:
+            return False
+
+    def execute(self, *tasks):
+        if self.workers() < 2 and not self.per_host_outfiles():
+            return super().execute(*tasks)
+
+        calls = self.normalize(tasks)
+        direct = list(calls)
+        expanded = self.expand_calls(calls)
+        try:
+            dedupe = self.config.tasks.dedupe
+        except AttributeError:
+            dedupe = True
+        calls = self.dedupe(expanded) if dedupe else expanded
+
+        results = {}
+        if self.workers() < 2:
+            batches = [[call] for call in calls]
+        else:
+            batches = self.batches(calls)
+        for batch in batches:
+            if len(batch) == 1:
+                with self._host_outfile(batch[0]):
+                    batch_results = [self._execute_call(batch[0], self.config)]
+            else:
+                batch_results = self._execute_batch(batch)
+            for call, result in zip(batch, batch_results):
+                if call in direct and call.autoprint:
+                    print(result)
+                results[call.task] = result
+        return results
+
+    @staticmethod
+    def batches(calls):
+        """Group consecutive host-parameterized calls of the same task.
+
+        :returns:
+            list of lists of calls.
+        """
+        batches = []
+        for call in calls:
+            if (
+                batches
+                and isinstance(call, fabric.tasks.ConnectionCall)
+                and isinstance(batches[-1][-1], fabric.tasks.ConnectionCall)
+                and batches[-1][-1].task is call.task
+            ):
+                batches[-1].append(call)
+            else:
+                batches.append([call])
+        return batches
+
+    @staticmethod
+    def _host_outfile(call, failed=False):
+        """Return a context in which the output of ``call`` is written into
+        the outfile of its host (if ``outfile.per_host`` is set)."""
+        host = getattr(call, "init_kwargs", {}).get("host")
+        return fabsetup.utils.outfile.Tee().host_outfile(host, failed)
+
+    def _load_configs(self, call, config):
+        collection_config = self.collection.configuration(call.called_as)
+        config.load_collection(collection_config)
+        config.load_shell_env()
+
+    def _execute_call(self, call, config):
+        debug("Executing {!r}".format(call))
+        self._load_configs(call, config)
+        context = call.make_context(config)
+        return call.task(context, *call.args, **call.kwargs)
+
+    def _execute_batch(self, batch):
+        """Execute ``batch`` concurrently and replay the buffered output of
+        each call in order.
+
+        Each call gets its own config clone, its ``output.numbered_state``
+        is shifted as if the calls would have been executed one after another.
+        """
+        self._load_configs(batch[0], self.config)
+        numbered_state = self.config.output.numbered_state
+
+        configs = []
+        for offset, _ in enumerate(batch):
+            config = self.config.clone()
+            config.output.numbered_state = shifted_numbered_state(
+                numbered_state, offset
+            )
+            configs.append(config)
+
+        if getattr(batch[0].task.body, "async_body", None) is not None:
+            results, first_exception = self._execute_async_batch(batch, configs)
+        else:
+            results, first_exception = self._execute_threaded_batch(batch, configs)
+
+        # continue numbering after the last call of the batch
+        offset = sum(
+            _last_index(config.output.numbered_state)
+            - _last_index(numbered_state)
+            - start_offset
+            for start_offset, config in enumerate(configs)
+        )
+        self.config.output.numbered_state = shifted_numbered_state(
+            numbered_state, offset
+        )
+
+        if first_exception is not None:
+            raise first_exception
+
+        return results
+
+    def _execute_async_batch(self, batch, configs):
+        """Execute the calls of an async task (cf. ``fabsetup.aio``) in one
+        event loop."""
+        import fabsetup.aio
+
+        contexts = []
+        for call, config in zip(batch, configs):
+            self._load_configs(call, config)
+            contexts.append(
+                fabsetup.aio.AsyncContext.from_context(call.make_context(config))
+            )
+        call = batch[0]
+        outcomes = fabsetup.aio.run_batch(
+            call.task,
+            contexts,
+            call.args,
+            call.kwargs,
+            limit=self.workers(),
+            replay_context=lambda index, exc: self._host_outfile(
+                batch[index], exc is not None
+            ),
+        )
+        exceptions = [exc for _, exc in outcomes if exc is not None]
+        return [result for result, _ in outcomes], next(iter(exceptions), None)
+
+    def _execute_threaded_batch(self, batch, configs):
+        demux = fabsetup.utils.outfile.OutputDemux()
+
+        def buffered_call(call, config):
+            with demux.buffered() as buffer:
+                try:
+                    return self._execute_call(call, config), None, buffer
+                except BaseException as exc:
+                    return None, exc, buffer
+
+        results = []
+        first_exception = None
+        demux.start()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers(), thread_name_prefix="fabsetup"
+            ) as pool:
+                futures = [
+                    pool.submit(buffered_call, call, config)
+                    for call, config in zip(batch, configs)
+                ]
+                for call, future in zip(batch, futures):
+                    result, exc, buffer = future.result()
+                    with self._host_outfile(call, exc is not None):
+                        demux.replay(buffer)
+                    results.append(result)
+                    if exc is not None and first_exception is None:
+                        first_exception = exc
+        finally:
+            demux.stop()
+
+        return results, first_exception
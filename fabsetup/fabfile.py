@@ -217,22 +217,24 @@ def create_files(
         "fabsetup_USER_TASK/_version.py",
     ]
 
-    for filename in filenames:
-        addon.install_file(
-            path="~/.fabsetup-addon-repos/fabsetup-USER-ADDON/{}".format(filename),
-            local=True,
-            username=username,
-            addon_name=addon_name,
-            task_name=task_name,
-            headline=headline,
-            description=description,
-            touched_files=touched_files,
-            author=author,
-            author_email=author_email,
-            USER=username,
-            ADDON=addon_name,
-            TASK=task_name,
-        )
+    addon.install_files(
+        paths=[
+            "~/.fabsetup-addon-repos/fabsetup-USER-ADDON/{}".format(filename)
+            for filename in filenames
+        ],
+        local=True,
+        username=username,
+        addon_name=addon_name,
+        task_name=task_name,
+        headline=headline,
+        description=description,
+        touched_files=touched_files,
+        author=author,
+        author_email=author_email,
+        USER=username,
+        ADDON=addon_name,
+        TASK=task_name,
+    )
 
 
 @subtask
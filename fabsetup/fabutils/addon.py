@@ -1,10 +1,15 @@
 """Create and write local files in the context of a Fabsetup Addon."""
 
 import contextlib
+import hashlib
+import io
 import os
 import os.path
+import tarfile
 import tempfile
 
+from fabsetup.fabutils.facts import shell_path
+
 
 FABSETUP_DOWNLOADS_DIR = os.path.join(os.path.expanduser("~"), ".fabsetup-downloads")
 
@@ -48,11 +53,12 @@ def filled_out_template(filename, **substitutions):
 
 
 @contextlib.contextmanager
-def template_context(from_path, package_name, substitutions):
+def template_context(from_path, package_name, substitutions, from_str=None):
 
     if from_path.endswith(".template"):
 
-        from_str = filled_out_template(from_path, **substitutions)
+        if from_str is None:
+            from_str = filled_out_template(from_path, **substitutions)
 
         with tempfile.NamedTemporaryFile(prefix=package_name) as tmp_file:
 
@@ -210,34 +216,14 @@ class Addon:
 
         to_path_parent = os.path.dirname(to_path)
 
-        cmds_remote = (
-            [
-                (
-                    self.context.local,
-                    "scp {from_path}  "
-                    "{self.context.host}@{self.context.user}:{to_path}",
-                ),
-            ]
-            if os.path.isdir(os.path.expanduser(to_path_parent))
-            else [
-                (self.context.run, "mkdir -p {to_path_parent}"),
-                (
-                    self.context.local,
-                    "scp {from_path}  "
-                    "{self.context.host}@{self.context.user}:{to_path}",
-                ),
-            ]
+        # sftp does not create missing parent dirs, whether they exist on the
+        # remote host is not known locally
+        self.context.run(
+            "mkdir -p {to_path_parent}".format(to_path_parent=to_path_parent)
         )
 
-        self._execute(
-            cmds_remote,
-            formatters=dict(
-                from_path=from_path,
-                to_path=to_path,
-                to_path_parent=to_path_parent,
-                self=self,
-            ),
-        )
+        # sftp over the already established ssh connection
+        self.context.put(from_path, to_path)
 
     def _install_remote_sudo(self, from_path, to_path):
 
@@ -247,26 +233,13 @@ class Addon:
             os.sep, "tmp", self.package_name + "_" + os.path.basename(to_path)
         )
 
-        cmds_remote_sudo = (
-            [
-                (
-                    self.context.local,
-                    "scp {from_path}  "
-                    "{self.context.user}@{self.context.host}:{temp_filename}",
-                ),
-                (self.context.run, "sudo mv --force {temp_filename}  {to_path}"),
-            ]
-            if os.path.isdir(os.path.expanduser(to_path_parent))
-            else [
-                (
-                    self.context.local,
-                    "scp {from_path}  "
-                    "{self.context.user}@{self.context.host}:{temp_filename}",
-                ),
-                (self.context.run, "sudo mkdir -p {to_path_parent}"),
-                (self.context.run, "sudo mv --force {temp_filename}  {to_path}"),
-            ]
-        )
+        # sftp over the already established ssh connection
+        self.context.put(from_path, temp_filename)
+
+        cmds_remote_sudo = [
+            (self.context.run, "sudo mkdir -p {to_path_parent}"),
+            (self.context.run, "sudo mv --force {temp_filename}  {to_path}"),
+        ]
 
         self._execute(
             cmds_remote_sudo,
@@ -279,18 +252,94 @@ class Addon:
             ),
         )
 
+    @staticmethod
+    def _filled_out(from_path, substitutions):
+        """Return the filled out template (``None`` if ``from_path`` is not a
+        template) and the content to install as bytes."""
+        if from_path.endswith(".template"):
+            from_str = filled_out_template(from_path, **substitutions)
+            return from_str, from_str.encode()
+        with open(from_path, "rb") as fp:
+            return None, fp.read()
+
+    @staticmethod
+    def _local_sha256sum(path):
+        try:
+            with open(os.path.expanduser(path), "rb") as fp:
+                return hashlib.sha256(fp.read()).hexdigest()
+        except OSError:
+            return None
+
+    def _sha256sums(self, to_paths, sudo=False, local=False):
+        """Return the sha256 hex digests of the installed files ``to_paths``
+        (``None`` for each file which does not exist or is not readable).
+
+        For remote hosts all digests are determined by a single command.
+        """
+        if local and not sudo:
+            return [Addon._local_sha256sum(to_path) for to_path in to_paths]
+
+        cmd = "; ".join(
+            "{{ {sudo}sha256sum {to_path}  ||  echo -; }} 2>/dev/null".format(
+                sudo="sudo " if sudo else "", to_path=shell_path(to_path)
+            )
+            for to_path in to_paths
+        )
+        execute = self.context.local if local else self.context.run
+        # internal command: no code block, no query with --interactive
+        result = execute(cmd, warn=True, hide=True)
+        lines = result.stdout.splitlines()
+        if len(lines) != len(to_paths):
+            return [None] * len(to_paths)
+        return [None if line == "-" else line.split()[0] for line in lines]
+
+    def _changed(self, files, sudo=False, local=False):
+        """Return the items of ``files`` whose installed file differs.
+
+        :param list `files`:
+            ``(to_path, data, ...)`` tuples with ``data`` as the bytes to
+            install.
+        """
+        sha256sums = self._sha256sums(
+            [to_path for to_path, *_ in files], sudo=sudo, local=local
+        )
+        changed = []
+        for file_, sha256sum in zip(files, sha256sums):
+            to_path, data = file_[:2]
+            if sha256sum == hashlib.sha256(data).hexdigest():
+                print("\n* unchanged: `{to_path}`".format(to_path=to_path))
+            else:
+                changed.append(file_)
+        return changed
+
     def install_file(
-        self, path, sudo=False, local=False, from_path=None, **substitutions
+        self,
+        path,
+        sudo=False,
+        local=False,
+        from_path=None,
+        skip_unchanged=True,
+        **substitutions,
     ):
-        """Install a file locally or on a remote host."""
+        """Install a file locally or on a remote host.
+
+        If ``skip_unchanged`` is ``True`` the file is not installed when the
+        installed file already has the same content.
+        """
 
         if from_path is None:
             from_path = self._determine_from_path(path)
 
         to_path = Addon._substituted(path, substitutions)
 
+        from_str = None
+        if skip_unchanged:
+            from_str, data = Addon._filled_out(from_path, substitutions)
+            if not self._changed([(to_path, data)], sudo=sudo, local=local):
+                return
+
         with template_context(
-            from_path, self.package_name, substitutions
+            from_path, self.package_name, substitutions, from_str=from_str
         ) as from_path_:
 
             if local:
@@ -303,3 +352,172 @@ class Addon:
                     self._install_remote_sudo(from_path_, to_path)
                 else:
                     self._install_remote(from_path_, to_path)
+
+    @staticmethod
+    def _determine_tar_root(to_path):
+        """Return the directory to extract ``to_path`` into and the name of
+        the tar member.
+
+        Example:
+            >>> Addon._determine_tar_root('~/.bashrc')
+            ('~', '.bashrc')
+            >>> Addon._determine_tar_root('/etc/hosts')
+            ('/', 'etc/hosts')
+        """
+        if to_path.startswith("~/"):
+            return "~", to_path[2:]
+        if to_path.startswith(os.sep):
+            return os.sep, to_path.lstrip(os.sep)
+        return ".", to_path
+
+    def _tar_archives(self, files):
+        """Pack ``files`` into one tar archive per destination root dir.
+
+        :param list `files`:
+            ``(to_path, data, from_path)`` tuples.
+
+        :returns:
+            dict of destination root dir -> tar archive content.
+        """
+        archives = {}
+        for to_path, data, from_path in files:
+            root, name = Addon._determine_tar_root(to_path)
+            if root not in archives:
+                archives[root] = (io.BytesIO(), [])
+            buffer, tarinfos = archives[root]
+
+            stat = os.stat(from_path)
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.mode = stat.st_mode & 0o7777
+            tarinfo.mtime = stat.st_mtime
+            tarinfo.size = len(data)
+            tarinfos.append((tarinfo, data))
+
+        result = {}
+        for root, (buffer, tarinfos) in archives.items():
+            with tarfile.open(fileobj=buffer, mode="w") as tar:
+                for tarinfo, data in tarinfos:
+                    tar.addfile(tarinfo, io.BytesIO(data))
+            result[root] = buffer.getvalue()
+        return result
+
+    def _install_tar_local(self, root, data, sudo):
+
+        with tempfile.NamedTemporaryFile(
+            prefix=self.package_name, suffix=".tar"
+        ) as tmp_file:
+
+            tmp_file.write(data)
+            tmp_file.flush()
+
+            cmds_local = [
+                (
+                    self.context.local,
+                    "{sudo}tar --extract --no-same-owner "
+                    "--file {tar_filename}  --directory {root}",
+                ),
+            ]
+
+            self._execute(
+                cmds_local,
+                formatters=dict(
+                    sudo="sudo " if sudo else "",
+                    tar_filename=tmp_file.name,
+                    root=root,
+                    self=self,
+                ),
+            )
+
+    def _install_tar_remote(self, root, data, sudo):
+
+        # the archive could contain secrets of filled out templates: mktemp
+        # creates an unpredictable name only readable by the user
+        tar_filename = self.context.run(
+            "mktemp /tmp/{}_XXXXXXXXXX.tar".format(self.package_name), hide=True
+        ).stdout.strip()
+
+        # sftp over the already established ssh connection
+        self.context.put(io.BytesIO(data), remote=tar_filename)
+
+        # remove the archive even if tar fails, keep the exit code of tar
+        cmds_remote = [
+            (
+                self.context.run,
+                "( {sudo}tar --extract --no-same-owner "
+                "--file {tar_filename}  --directory {root};  "
+                "rc=$?;  rm -f {tar_filename};  exit $rc )",
+            ),
+        ]
+
+        self._execute(
+            cmds_remote,
+            formatters=dict(
+                sudo="sudo " if sudo else "",
+                tar_filename=tar_filename,
+                root=root,
+                self=self,
+            ),
+        )
+
+    def install_files(
+        self, paths, sudo=False, local=False, skip_unchanged=True, **substitutions
+    ):
+        """Install several files locally or on a remote host at once.
+
+        All files (templates filled out) are packed into a tar archive which
+        is copied once over the ssh connection of the context and extracted
+        by a single ``tar`` command (per destination root dir, ``~`` or
+        ``/``).  Missing parent dirs are created by ``tar``, the installed
+        files are owned by the (sudo) user who extracts them.  A symlink at
+        the path of an installed file (e.g. a dotfile linked into a dotfiles
+        repository) is replaced by a regular file, unlike `install_file()`
+        which writes through the symlink.
+
+        If ``skip_unchanged`` is ``True`` the checksums of all installed files
+        are determined at once and files with unchanged content are skipped.
+
+        If the batch installation fails each file is installed by
+        `install_file()`.
+
+        :param list `paths`:
+            Paths to install, each a ``str`` or a ``(path, from_path)``
+            tuple, cf. `install_file()`.
+        """
+        files = []
+        for path in paths:
+            path, from_path = (path, None) if isinstance(path, str) else path
+            if from_path is None:
+                from_path = self._determine_from_path(path)
+            files.append((path, from_path))
+
+        try:
+            pending = []
+            for path, from_path in files:
+                from_str, data = Addon._filled_out(from_path, substitutions)
+                if from_str is not None:
+                    print("\n* template: `{from_path}`".format(from_path=from_path))
+                pending.append(
+                    (Addon._substituted(path, substitutions), data, from_path)
+                )
+            if skip_unchanged:
+                pending = self._changed(pending, sudo=sudo, local=local)
+            archives = self._tar_archives(pending)
+            for root, data in archives.items():
+                if local:
+                    self._install_tar_local(root, data, sudo)
+                else:
+                    self._install_tar_remote(root, data, sudo)
+        except Exception as exc:
+            print(
+                "\n* batch installation failed ({}), "
+                "install files one by one".format(exc)
+            )
+            for path, from_path in files:
+                self.install_file(
+                    path,
+                    sudo=sudo,
+                    local=local,
+                    from_path=from_path,
+                    skip_unchanged=skip_unchanged,
+                    **substitutions,
+                )
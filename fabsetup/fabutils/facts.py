@@ -0,0 +1,302 @@
+"""Facts about a host gathered by one batched shell script.
+
+A task decorated by ``fabsetup.task.task`` has the attribute ``c.facts``, a
+`HostFacts` object.  Facts which are not cached (or expired) are gathered by
+one hidden command and cached per host in memory and in ``facts_cache.dir``
+for ``facts_cache.ttl`` seconds.  Each other command executed (or file
+uploaded) on the host invalidates its facts, as it could have changed
+them: they are dropped in memory and the on-disk cache is removed, so the
+next run does not answer from outdated facts.
+
+Example::
+
+    @task
+    def termdown(c):
+        c.facts.gather(which=["termdown", "pip3"])  # one round trip
+        if not c.facts.which("termdown"):
+            if not c.facts.which("pip3"):
+                install_pip(c)
+            c.run("pip3 install --user termdown")
+"""
+
+import json
+import os
+import os.path
+import re
+import shlex
+import threading
+import time
+
+from fabsetup.utils.timing import Timings
+
+BASE_SCRIPT = r"""
+printf 'os\t%s\n' "$(uname -s)"
+printf 'kernel\t%s\n' "$(uname -r)"
+printf 'machine\t%s\n' "$(uname -m)"
+printf 'hostname\t%s\n' "$(uname -n)"
+if [ -r /etc/os-release ]; then
+    (
+        . /etc/os-release
+        printf 'distribution\t%s\n' "$ID"
+        printf 'distribution_version\t%s\n' "$VERSION_ID"
+    )
+fi
+if command -v dpkg-query >/dev/null 2>&1; then
+    dpkg-query -W -f='${Status}\t${Package}\n' 2>/dev/null \
+        | sed -n 's/^[^\t]* installed\t/package\t/p'
+elif command -v rpm >/dev/null 2>&1; then
+    rpm -qa --qf 'package\t%{NAME}\n' 2>/dev/null
+fi
+"""
+"""Gathers the base facts and the installed packages (dpkg or rpm)."""
+
+BASE_FACTS = (
+    "os",
+    "kernel",
+    "machine",
+    "hostname",
+    "distribution",
+    "distribution_version",
+)
+
+
+def shell_path(path):
+    """Return ``path`` quoted for the shell, a leading ``~/`` is kept.
+
+    Example:
+
+        >>> shell_path('~/.vimrc')
+        '"$HOME"/.vimrc'
+        >>> shell_path('/tmp/my file')
+        "'/tmp/my file'"
+    """
+    if path == "~":
+        return '"$HOME"'
+    if path.startswith("~/"):
+        return '"$HOME"/' + shlex.quote(path[2:])
+    return shlex.quote(path)
+
+
+def facts_script(which=(), paths=(), sha256=(), base=True):
+    """Return the shell script which gathers the facts.
+
+    Each fact is printed as one line ``<key>\\t<value>``.
+
+    :param [str] which:
+        Commands to look up in the ``PATH``.
+
+    :param [str] paths:
+        Paths to test if they exist as file or directory.
+
+    :param [str] sha256:
+        Files to hash.
+
+    :param bool base:
+        Gather the base facts (cf. `BASE_FACTS`) and the installed packages.
+    """
+    lines = [BASE_SCRIPT] if base else []
+    for command in which:
+        lines.append(
+            "printf 'which:%s\\t%s\\n' {0} \"$(command -v {0})\"".format(
+                shlex.quote(command)
+            )
+        )
+    for path in paths:
+        lines.append(
+            "if [ -d {0} ]; then t=dir; elif [ -e {0} ]; then t=file; "
+            "else t=; fi; printf 'path:%s\\t%s\\n' {1} \"$t\"".format(
+                shell_path(path), shlex.quote(path)
+            )
+        )
+    for path in sha256:
+        lines.append(
+            "printf 'sha256:%s\\t%s\\n' {1} "
+            "\"$(sha256sum {0} 2>/dev/null | cut -d' ' -f1)\"".format(
+                shell_path(path), shlex.quote(path)
+            )
+        )
+    return "\n".join(lines) + "\n"
+
+
+def parse_facts(output):
+    """Parse the output of a `facts_script()`.
+
+    Example:
+
+        >>> facts, packages = parse_facts(
+        ...     'os\\tLinux\\npackage\\tvim\\nwhich:pip3\\t/usr/bin/pip3\\n'
+        ... )
+        >>> sorted(facts.items())
+        [('os', 'Linux'), ('which:pip3', '/usr/bin/pip3')]
+        >>> packages
+        ['vim']
+
+    :returns:
+        tuple ``(facts, packages)``, a dict and a list.
+    """
+    facts = {}
+    packages = []
+    for line in output.splitlines():
+        key, sep, value = line.partition("\t")
+        if not sep:
+            continue
+        if key == "package":
+            packages.append(value)
+        else:
+            facts[key] = value
+    return facts, packages
+
+
+def facts_filename(directory, host):
+    """Return the path of the facts cache file of ``host``.
+
+    Example:
+
+        >>> facts_filename('/tmp/facts', 'user@web1')
+        '/tmp/facts/user_web1.json'
+    """
+    name = re.sub(r"[^\w.-]", "_", host)
+    return os.path.join(os.path.expanduser(directory), name + ".json")
+
+
+class HostFacts:
+    """Cached facts about one host.
+
+    :param run:
+        The (not wrapped) run method of the host, e.g.
+        ``fabric.connection.Connection.run``.  It is called with
+        ``hide=True`` and ``warn=True``.
+
+    :param str host:
+        Name of the host, e.g. ``user@web1``.
+
+    :param str directory:
+        Directory of the on-disk cache.  If empty, the facts are only
+        cached in memory.
+
+    :param float ttl:
+        Seconds a gathered fact is valid.
+
+    Example:
+
+        >>> import invoke
+        >>> facts = HostFacts(invoke.Context().run, 'localhost')
+        >>> facts.get('os') == os.uname().sysname  # doctest: +SKIP
+        True
+        >>> facts.exists('/'), facts.is_dir('/')  # doctest: +SKIP
+        (True, True)
+    """
+
+    def __init__(self, run, host, directory="", ttl=3600):
+        self.run = run
+        self.host = host
+        self.filename = facts_filename(directory, host) if directory else ""
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.facts = {}  # key -> [value, time gathered]
+        self.packages = None  # [list of packages, time gathered]
+        self.saved = False  # the on-disk cache holds facts
+        self._load()
+
+    def _load(self):
+        if not self.filename:
+            return
+        try:
+            with open(self.filename) as fh:
+                data = json.load(fh)
+            self.facts = data["facts"]
+            self.packages = data["packages"]
+            self.saved = True
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def _save(self):
+        if not self.filename:
+            return
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as fh:
+            json.dump({"facts": self.facts, "packages": self.packages}, fh)
+        os.replace(tmp_filename, self.filename)
+        self.saved = True
+
+    def _fresh(self, entry):
+        return entry is not None and time.time() - entry[1] < self.ttl
+
+    def gather(self, which=(), paths=(), sha256=()):
+        """Gather all facts which are not cached or expired by one command.
+
+        Call this before asking for several ``which``, ``paths``, or
+        ``sha256`` facts to fetch them in one round trip.
+        """
+        with self.lock:
+            which = [x for x in which if not self._fresh(self.facts.get("which:" + x))]
+            paths = [x for x in paths if not self._fresh(self.facts.get("path:" + x))]
+            sha256 = [
+                x for x in sha256 if not self._fresh(self.facts.get("sha256:" + x))
+            ]
+            base = not self._fresh(self.packages)
+            if not (base or which or paths or sha256):
+                return
+
+            script = facts_script(which, paths, sha256, base=base)
+            with Timings().measure("facts", "gather facts", host=self.host):
+                res = self.run(script, hide=True, warn=True)
+            facts, packages = parse_facts(res.stdout)
+
+            now = time.time()
+            for key in BASE_FACTS if base else []:
+                self.facts[key] = [facts.pop(key, ""), now]
+            for key, value in facts.items():
+                self.facts[key] = [value, now]
+            if base:
+                self.packages = [sorted(packages), now]
+            self._save()
+
+    def invalidate(self):
+        """Forget all facts, e.g. after a command has changed the host.
+
+        The facts are dropped in memory and the on-disk cache is removed.
+        The file is removed only once after it has been written, so
+        invalidating after each command costs no file operation until the
+        facts are gathered again.
+        """
+        with self.lock:
+            self.facts = {}
+            self.packages = None
+            if self.saved:
+                self.saved = False
+                try:
+                    os.remove(self.filename)
+                except FileNotFoundError:
+                    pass
+
+    def get(self, name):
+        """Return the base fact ``name`` (cf. `BASE_FACTS`), e.g. ``'os'``."""
+        self.gather()
+        return self.facts[name][0]
+
+    def installed(self, package):
+        """Return ``True`` if the dpkg or rpm ``package`` is installed."""
+        self.gather()
+        return package in self.packages[0]
+
+    def which(self, command):
+        """Return the path of ``command`` or ``''`` if it is not found."""
+        self.gather(which=[command])
+        return self.facts["which:" + command][0]
+
+    def exists(self, path):
+        """Return ``True`` if ``path`` exists."""
+        self.gather(paths=[path])
+        return self.facts["path:" + path][0] != ""
+
+    def is_dir(self, path):
+        """Return ``True`` if ``path`` is a directory."""
+        self.gather(paths=[path])
+        return self.facts["path:" + path][0] == "dir"
+
+    def sha256(self, path):
+        """Return the sha256 hex digest of file ``path`` or ``''``."""
+        self.gather(sha256=[path])
+        return self.facts["sha256:" + path][0]
@@ -0,0 +1,293 @@
+"""Execute consecutive commands in one long-lived shell.
+
+A task decorated by ``fabsetup.task.task`` has the attribute
+``c.pipeline``, a `Pipeline`.  Within ``with c.pipeline():`` the commands of
+``c.run()`` are sent to one shell started by the run method of the task
+instead of opening a new SSH channel (and starting a new shell) per command.
+Each command still is printed in its own Markdown code block with its own
+return code.
+
+Example::
+
+    @task
+    def dotfiles(c):
+        with c.pipeline():
+            c.run("mkdir -p ~/repos")
+            c.run("cd ~/repos")  # the shell state is kept
+            c.run("git clone https://github.com/theno/dotfiles.git")
+
+The commands are executed like the lines of a script by one shell, so
+``cd`` and variables persist and ``exit`` terminates the session.  Their
+stdin is ``/dev/null``.  Commands executed with other arguments than
+``hide``, ``warn``, ``out_stream``, or ``err_stream`` (e.g. ``pty=True``) are
+executed as usual, outside of the shell session.
+"""
+
+import contextlib
+import sys
+import threading
+import uuid
+
+import invoke.exceptions
+import invoke.runners
+
+SESSION_KWARGS = {"hide", "warn", "out_stream", "err_stream"}
+"""Arguments of ``c.run()`` supported within a shell session."""
+
+COMMAND_TEMPLATE = """\
+{{ {cmd}
+}} </dev/null
+__fabsetup_rc=$?
+printf '%s %d\\n' '{sentinel}' "$__fabsetup_rc" >&2
+printf '%s %d\\n' '{sentinel}' "$__fabsetup_rc"
+"""
+
+
+def partial_suffix(text, sentinel):
+    """Return the length of the longest end of ``text`` which is the
+    beginning of ``sentinel``.
+
+    Example:
+
+        >>> partial_suffix('output\\n__fab', '__fabsetup__')
+        5
+        >>> partial_suffix('output\\n', '__fabsetup__')
+        0
+    """
+    for length in range(min(len(text), len(sentinel) - 1), 0, -1):
+        if text.endswith(sentinel[:length]):
+            return length
+    return 0
+
+
+class _Command:
+    def __init__(self, streams, hidden):
+        self.streams = streams
+        self.hidden = hidden
+        self.output = {"stdout": [], "stderr": []}
+        self.return_codes = {}
+
+
+class _FramedStream:
+    """Writer handed over to invoke as ``out_stream`` or ``err_stream`` of
+    the shell."""
+
+    def __init__(self, session, stream_name):
+        self.session = session
+        self.stream_name = stream_name
+
+    def write(self, text):
+        self.session.received(self.stream_name, text)
+
+    def flush(self):
+        pass
+
+
+class ShellSession:
+    """One shell executing the commands written to its stdin.
+
+    The end of the output of a command is marked on stdout and on stderr by
+    a sentinel line with its return code.
+
+    :param run_method:
+        The (not wrapped) run method, e.g.
+        ``fabric.connection.Connection.run``.
+
+    :param str shell:
+        The shell command, default: ``'/bin/sh'``.
+
+    :param hide_default:
+        Callable returning the default of ``hide``, e.g. ``run.hide`` of the
+        config.
+
+    Example:
+
+        >>> import invoke
+        >>> session = ShellSession(invoke.Context().run)
+        >>> session.run('cd /tmp && echo foo', hide=True).stdout
+        'foo\\n'
+        >>> session.run('pwd', hide=True).stdout
+        '/tmp\\n'
+        >>> session.run('false', warn=True).return_code
+        1
+        >>> session.close()
+        0
+    """
+
+    def __init__(self, run_method, shell="/bin/sh", hide_default=None):
+        self.shell = shell
+        self.hide_default = hide_default or (lambda: None)
+        self.sentinel = "__fabsetup_pipeline_{}__".format(uuid.uuid4().hex)
+        self.thread_id = threading.get_ident()
+        self.cond = threading.Condition()
+        self.pending = {"stdout": "", "stderr": ""}
+        self.command = None
+        self.exit_code = None
+        self.promise = run_method(
+            shell,
+            asynchronous=True,
+            in_stream=False,
+            out_stream=_FramedStream(self, "stdout"),
+            err_stream=_FramedStream(self, "stderr"),
+            hide=False,
+            warn=True,
+            pty=False,
+        )
+
+    @property
+    def alive(self):
+        return self.exit_code is None
+
+    def received(self, stream_name, text):
+        """Split the ``text`` written by the shell into the output of the
+        current command and the sentinels.
+        """
+        with self.cond:
+            buf = self.pending[stream_name] + text
+            while buf:
+                index = buf.find(self.sentinel)
+                if index < 0:
+                    keep = partial_suffix(buf, self.sentinel)
+                    self._emit(stream_name, buf[: len(buf) - keep])
+                    buf = buf[len(buf) - keep :]
+                    break
+                self._emit(stream_name, buf[:index])
+                end = buf.find("\n", index)
+                if end < 0:
+                    buf = buf[index:]  # wait for the rest of the sentinel
+                    break
+                return_code = int(buf[index + len(self.sentinel) : end])
+                if self.command is not None:
+                    self.command.return_codes[stream_name] = return_code
+                    self.cond.notify_all()
+                buf = buf[end + 1 :]
+            self.pending[stream_name] = buf
+
+    def _emit(self, stream_name, text):
+        command = self.command
+        if not text or command is None:
+            return
+        command.output[stream_name].append(text)
+        if stream_name not in command.hidden:
+            stream = command.streams[stream_name]
+            stream.write(text)
+            stream.flush()
+
+    def _finished(self):
+        """Wait for the exited shell and return its exit code."""
+        try:
+            self.exit_code = self.promise.join().exited
+        except Exception:
+            self.exit_code = -1
+        return self.exit_code
+
+    def run(self, cmd, hide=None, warn=False, out_stream=None, err_stream=None):
+        """Execute ``cmd`` by the shell.
+
+        :returns:
+            ``invoke.runners.Result``
+
+        :raises invoke.exceptions.UnexpectedExit:
+            If the return code is not ``0`` and not ``warn``.
+        """
+        if hide is None:
+            hide = self.hide_default()
+        hidden = invoke.runners.normalize_hide(hide, out_stream, err_stream)
+        command = _Command(
+            {
+                "stdout": out_stream or sys.stdout,
+                "stderr": err_stream or sys.stderr,
+            },
+            hidden,
+        )
+        with self.cond:
+            self.command = command
+        self.promise.runner.write_proc_stdin(
+            COMMAND_TEMPLATE.format(cmd=cmd, sentinel=self.sentinel)
+        )
+
+        exited = False
+        with self.cond:
+            while len(command.return_codes) < 2:
+                if self.promise.runner.process_is_finished:
+                    exited = True
+                    break
+                self.cond.wait(0.1)
+        if exited:
+            # e.g. `exit` or a syntax error, remaining output is written
+            # while the shell is joined
+            self._finished()
+        with self.cond:
+            self.command = None
+        return_code = command.return_codes.get("stdout", self.exit_code)
+
+        result = invoke.runners.Result(
+            stdout="".join(command.output["stdout"]),
+            stderr="".join(command.output["stderr"]),
+            command=cmd,
+            shell=self.shell,
+            exited=return_code,
+            hide=hidden,
+        )
+        if return_code != 0 and not warn:
+            raise invoke.exceptions.UnexpectedExit(result)
+        return result
+
+    def close(self):
+        """Close the stdin of the shell and return its exit code."""
+        if self.alive:
+            self.promise.runner.close_proc_stdin()
+            self._finished()
+        return self.exit_code
+
+
+class Pipeline:
+    """Callable which returns a context manager, within its context the
+    commands of ``run_method`` executed by the current thread are sent to
+    one `ShellSession`.
+
+    :param run_method:
+        The (not wrapped) run method of the task.
+
+    :param config:
+        The config of the task, its ``run.hide`` is the default of ``hide``.
+    """
+
+    def __init__(self, run_method, config=None):
+        self.run = run_method
+        self.config = config
+        self.session = None
+
+    def _hide_default(self):
+        try:
+            return self.config.run.hide
+        except AttributeError:
+            return None
+
+    @contextlib.contextmanager
+    def __call__(self, shell="/bin/sh"):
+        if self.session is not None:
+            # nested `with c.pipeline():`
+            yield self.session
+            return
+        self.session = ShellSession(self.run, shell, self._hide_default)
+        try:
+            yield self.session
+        finally:
+            session, self.session = self.session, None
+            session.close()
+
+    def active_session(self, run_method, kwargs):
+        """Return the `ShellSession` which executes a command of
+        ``run_method`` with ``kwargs`` or ``None``.
+        """
+        session = self.session
+        if (
+            session is None
+            or not session.alive
+            or session.thread_id != threading.get_ident()
+            or run_method != self.run
+            or set(kwargs) - SESSION_KWARGS
+        ):
+            return None
+        return session
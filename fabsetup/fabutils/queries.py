@@ -4,6 +4,7 @@ import readline
 import sys
 
 import fabsetup.print
+import fabsetup.utils.events
 import fabsetup.utils.outfile
 from fabsetup.utils.colors import magenta, no_color
 
@@ -19,6 +20,12 @@ def interactive(prompt, cmd_color, prefill=""):
 
         tee.resume(missed_output="{}{}\n".format(prompt, cmd_color(result, bold=True)))
 
+        fabsetup.utils.events.EventLog().emit(
+            "query",
+            prompt=fabsetup.utils.outfile.remove_color_codes_str(prompt),
+            answer=result,
+        )
+
         return result
     finally:
         readline.set_startup_hook()
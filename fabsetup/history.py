@@ -0,0 +1,257 @@
+"""Index of past fabsetup runs in an SQLite database.
+
+At the end of each run ``fabsetup.__main__.main()`` records the run (tasks,
+hosts, exit code, outfile) and the timings of all of its tasks, subtasks and
+commands (cf. ``fabsetup.utils.timing``) when ``history.record`` is set.
+``fabsetup --history`` queries the index.
+"""
+
+import datetime
+import os
+import os.path
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    wall REAL,
+    command TEXT,
+    exit_code INTEGER,
+    outfile TEXT
+);
+CREATE TABLE IF NOT EXISTS run_tasks (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    task TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS run_hosts (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    host TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    host TEXT,
+    started REAL,
+    wall REAL,
+    cpu REAL,
+    return_code INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_started ON runs(started);
+CREATE INDEX IF NOT EXISTS run_tasks_task ON run_tasks(task, run_id);
+CREATE INDEX IF NOT EXISTS run_hosts_host ON run_hosts(host, run_id);
+CREATE INDEX IF NOT EXISTS nodes_run_id ON nodes(run_id);
+CREATE INDEX IF NOT EXISTS nodes_name ON nodes(kind, name);
+"""
+
+
+def parse_query(query):
+    """Parse a ``--history`` query into a dict of filters.
+
+    :param str query:
+        Comma separated filters ``task=NAME``, ``host=HOST``,
+        ``command=SUBSTRING``, ``failed`` and ``limit=N``.
+
+    Example:
+
+        >>> sorted(parse_query('task=me.hello,host=web1,failed').items())
+        [('failed', True), ('host', 'web1'), ('task', 'me.hello')]
+        >>> parse_query('')
+        {}
+    """
+    filters = {}
+    for item in query.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        key, sep, value = item.partition("=")
+        key = key.strip()
+        if key not in ("task", "host", "command", "failed", "limit"):
+            raise ValueError("unknown history filter: '{}'".format(key))
+        if not sep:
+            filters[key] = True
+        elif key == "limit":
+            filters[key] = int(value)
+        else:
+            filters[key] = value.strip()
+    return filters
+
+
+def _timestamp(seconds):
+    return datetime.datetime.fromtimestamp(seconds).strftime("%F %H:%M:%S")
+
+
+def _table_cell(text):
+    return str(text).replace("\n", " ").replace("|", "\\|")
+
+
+class History:
+    """SQLite index of fabsetup runs.
+
+    :param str filename:
+        Path of the database file, parent dirs are created if required.
+    """
+
+    def __init__(self, filename):
+        fname = os.path.abspath(os.path.expanduser(filename))
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        self.connection = sqlite3.connect(fname)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, started, wall, command, tasks, hosts, exit_code, outfile, nodes):
+        """Add a run to the index.
+
+        :param list nodes:
+            ``fabsetup.utils.timing.TimingNode`` objects of the run.
+
+        :returns:
+            id of the run.
+        """
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO runs (started, wall, command, exit_code, outfile) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (started, wall, command, exit_code, outfile),
+            )
+            run_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO run_tasks (run_id, task) VALUES (?, ?)",
+                [(run_id, task) for task in tasks],
+            )
+            self.connection.executemany(
+                "INSERT INTO run_hosts (run_id, host) VALUES (?, ?)",
+                [(run_id, host) for host in hosts],
+            )
+            self.connection.executemany(
+                "INSERT INTO nodes "
+                "(run_id, kind, name, host, started, wall, cpu, return_code) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        run_id,
+                        node.kind,
+                        node.name,
+                        node.host,
+                        node.started,
+                        node.wall,
+                        node.cpu,
+                        node.return_code,
+                    )
+                    for node in nodes
+                ],
+            )
+        return run_id
+
+    def runs(self, task=None, host=None, failed=False, limit=20, **_):
+        """Return the latest runs as list of dicts, newest first.
+
+        :param str task:
+            Only runs which executed this task.
+
+        :param str host:
+            Only runs on this host.
+
+        :param bool failed:
+            Only runs with a non-zero exit code.
+        """
+        where = []
+        params = []
+        if task:
+            where.append("id IN (SELECT run_id FROM run_tasks WHERE task = ?)")
+            params.append(task)
+        if host:
+            where.append("id IN (SELECT run_id FROM run_hosts WHERE host = ?)")
+            params.append(host)
+        if failed:
+            where.append("exit_code != 0")
+        sql = "SELECT id, started, wall, command, exit_code, outfile FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY started DESC LIMIT ?"
+        params.append(limit)
+
+        runs = []
+        for row in self.connection.execute(sql, params):
+            run = dict(
+                zip(["id", "started", "wall", "command", "exit_code", "outfile"], row)
+            )
+            run["tasks"] = [
+                task
+                for (task,) in self.connection.execute(
+                    "SELECT task FROM run_tasks WHERE run_id = ?", (run["id"],)
+                )
+            ]
+            run["hosts"] = [
+                host
+                for (host,) in self.connection.execute(
+                    "SELECT host FROM run_hosts WHERE run_id = ?", (run["id"],)
+                )
+            ]
+            runs.append(run)
+        return runs
+
+    def commands(self, command, host=None, failed=False, limit=20, **_):
+        """Return the latest executions of commands containing ``command`` as
+        list of dicts, newest first."""
+        sql = (
+            "SELECT nodes.run_id, nodes.started, nodes.name, nodes.host, "
+            "nodes.wall, nodes.return_code FROM nodes "
+            "WHERE nodes.kind = 'command' AND nodes.name LIKE ?"
+        )
+        params = ["%{}%".format(command)]
+        if host:
+            sql += " AND nodes.host = ?"
+            params.append(host)
+        if failed:
+            sql += " AND nodes.return_code != 0"
+        sql += " ORDER BY nodes.started DESC LIMIT ?"
+        params.append(limit)
+        return [
+            dict(zip(["run_id", "started", "name", "host", "wall", "return_code"], row))
+            for row in self.connection.execute(sql, params)
+        ]
+
+    def query_markdown(self, query):
+        """Return the result of a ``--history`` query as Markdown table."""
+        filters = parse_query(query)
+        lines = []
+        if "command" in filters:
+            lines += [
+                "| Run | Started | Command | Host | Wall [s] | Return Code |",
+                "|--:|---|---|---|--:|--:|",
+            ]
+            for row in self.commands(**filters):
+                lines.append(
+                    "| {} | {} | {} | {} | {:.3f} | {} |".format(
+                        row["run_id"],
+                        _timestamp(row["started"]),
+                        _table_cell(row["name"]),
+                        row["host"] or "",
+                        row["wall"] or 0,
+                        "" if row["return_code"] is None else row["return_code"],
+                    )
+                )
+        else:
+            lines += [
+                "| Run | Started | Tasks | Hosts | Wall [s] | Exit Code | Outfile |",
+                "|--:|---|---|---|--:|--:|---|",
+            ]
+            for run in self.runs(**filters):
+                lines.append(
+                    "| {} | {} | {} | {} | {:.3f} | {} | {} |".format(
+                        run["id"],
+                        _timestamp(run["started"]),
+                        _table_cell(" ".join(run["tasks"])),
+                        _table_cell(" ".join(run["hosts"])),
+                        run["wall"] or 0,
+                        run["exit_code"],
+                        run["outfile"] or "",
+                    )
+                )
+        return "\n".join(lines) + "\n"
@@ -23,8 +23,11 @@ from invoke.util import debug
 
 import fabsetup.addons
 import fabsetup.print
+import fabsetup.utils.events
+import fabsetup.utils.markdown
 import fabsetup.utils.outfile
 import fabsetup.utils.pandoc
+import fabsetup.utils.timing
 
 # import fabsetup.fabutils.queries
 
@@ -78,6 +81,56 @@ class Defaults:
                         "is set with the current date: "
                         "``now = datetime.datetime.now().strftime(now_format)``.",
                     ),
+                    Entry(
+                        "compression",
+                        "",
+                        "Compress the outfile while it is written: ``'gzip'`` "
+                        "or ``'zstd'`` (requires the ``zstandard`` package). "
+                        "The suffix ``.gz`` or ``.zst`` is appended to "
+                        "``outfile.name``.  ``fabsetup --cat-run`` shows a "
+                        "compressed outfile.",
+                    ),
+                    Entry(
+                        "truncate",
+                        description="Limit the output of each command written "
+                        "into the outfile, the terminal output is not limited. "
+                        "Could be overwritten per command by the keyword "
+                        "arguments ``truncate_head``, ``truncate_tail`` and "
+                        "``truncate_spill`` of ``c.run()`` and ``c.local()``.",
+                        default_value=[
+                            Entry(
+                                "head",
+                                0,
+                                "Keep the first ``head`` lines of a command "
+                                "output.",
+                            ),
+                            Entry(
+                                "tail",
+                                0,
+                                "Keep the last ``tail`` lines of a command "
+                                "output.  If ``head`` and ``tail`` are ``0`` "
+                                "the output is not truncated.",
+                            ),
+                            Entry(
+                                "spill",
+                                True,
+                                "If ``True`` write the complete output of a "
+                                "truncated command into a file in the "
+                                "directory ``<outfile>.d`` and reference it in "
+                                "the outfile.",
+                            ),
+                        ],
+                    ),
+                    Entry(
+                        "per_host",
+                        False,
+                        "If ``True`` and hosts are given by ``-H`` write the "
+                        "output of each host into its own outfile in the "
+                        "directory ``<outfile>.d``, named by "
+                        "``outfile.basename_formatter`` with the host as "
+                        "``hosts``.  The outfile becomes an index with the "
+                        "status of each host and links to their outfiles.",
+                    ),
                     Entry(
                         "keep_color",
                         False,
@@ -93,13 +146,18 @@ class Defaults:
                                 "command",
                                 "pandoc",
                                 "Pandoc executable, could be set for example to "
-                                "``'pandoc'`` or ``'/usr/bin/pandoc'``.",
+                                "``'pandoc'`` or ``'/usr/bin/pandoc'``.  With "
+                                "``'builtin'`` the renderer of "
+                                "``fabsetup.utils.markdown`` is used instead of "
+                                "a pandoc process.",
                             ),
                             Entry(
                                 "toc",
                                 False,
                                 "If ``True`` add a table of contents to the "
-                                "markdown outfile.",
+                                "markdown outfile.  The headings are collected "
+                                "while the outfile is written, pandoc is not "
+                                "required.",
                             ),
                             Entry(
                                 "html",
@@ -123,6 +181,16 @@ class Defaults:
                                         "the basename of the markdown outfile "
                                         "without the trailing ``.md``.",
                                     ),
+                                    Entry(
+                                        "live",
+                                        False,
+                                        "If ``True`` render the HTML file "
+                                        "with ``fabsetup.utils.markdown`` "
+                                        "while the outfile is written, each "
+                                        "completed section is appended and "
+                                        "the page reloads its body until the "
+                                        "run has finished.",
+                                    ),
                                     Entry(
                                         "css",
                                         [
@@ -167,6 +235,20 @@ class Defaults:
                         "*Executed fabsetup command:*\n\n",
                         "",
                     ),
+                    Entry(
+                        "events",
+                        "",
+                        "If non-empty append one JSON line per event (start and "
+                        "end of tasks, subtasks, commands and uploads, output "
+                        "chunk sizes, query answers) to this file.",
+                    ),
+                    Entry(
+                        "trace_file",
+                        "",
+                        "If non-empty write the timings of all tasks, subtasks, "
+                        "commands and uploads in the Chrome Trace Event Format "
+                        "(viewable in Perfetto) into this file.",
+                    ),
                     Entry(
                         "command_output_prefix",
                         "(stdout) ",
@@ -270,6 +352,18 @@ class Defaults:
                         1,
                         "",
                     ),
+                    Entry(
+                        "timing",
+                        False,
+                        "If ``True`` print the duration of each task, subtask "
+                        "and command.",
+                    ),
+                    Entry(
+                        "timing_summary",
+                        0,
+                        "If greater than 0 print tables of this number of the "
+                        "slowest tasks and commands at the end of the output.",
+                    ),
                 ],
             ),
             Entry(
@@ -281,6 +375,28 @@ class Defaults:
                         False,
                         "",
                     ),
+                    Entry(
+                        "parallel",
+                        1,
+                        "Run a task on up to this number of hosts at once "
+                        "(``-H host1,host2,...``). The output of each host is "
+                        "buffered and written in host order.",
+                    ),
+                    Entry(
+                        "subtask_workers",
+                        4,
+                        "Maximum number of subtasks executed at once by "
+                        "``fabsetup.task.run_subtasks()``, each on its own "
+                        "SSH channel.",
+                    ),
+                    Entry(
+                        "ssh_command",
+                        "ssh -o BatchMode=yes -o ControlMaster=auto "
+                        "-o ControlPersist=60 -o ControlPath=~/.ssh/fabsetup-%C",
+                        "OpenSSH client command which executes the commands "
+                        "of async tasks (``fabsetup.aio``). Connections to "
+                        "the same host are multiplexed.",
+                    ),
                 ],
             ),
             Entry(
@@ -304,6 +420,63 @@ class Defaults:
                 "",
                 "Command hook to be executed after fabsetup execution.",
             ),
+            Entry(
+                "history",
+                description="Configure the index of past fabsetup runs.",
+                default_value=[
+                    Entry(
+                        "file",
+                        "~/.fabsetup-runs/history.sqlite3",
+                        "SQLite database file of the run history index.",
+                    ),
+                    Entry(
+                        "record",
+                        False,
+                        "If ``True`` add each run (tasks, hosts, exit code, "
+                        "outfile and timings of tasks and commands) to the "
+                        "run history index.",
+                    ),
+                ],
+            ),
+            Entry(
+                "checkpoint",
+                description="Configure the checkpoints of completed subtasks.",
+                default_value=[
+                    Entry(
+                        "dir",
+                        "~/.fabsetup-runs/checkpoints",
+                        "Directory of the checkpoint files which record the "
+                        "completed subtasks of a task per host.  A checkpoint "
+                        "file is removed when its task has been completed.  "
+                        "If empty no checkpoints are recorded.",
+                    ),
+                    Entry(
+                        "resume",
+                        False,
+                        "If ``True`` skip the subtasks which have been "
+                        "completed with unchanged inputs by the previous, "
+                        "failed run.",
+                    ),
+                ],
+            ),
+            Entry(
+                "facts_cache",
+                description="Configure the cache of host facts (``c.facts``).",
+                default_value=[
+                    Entry(
+                        "dir",
+                        "~/.fabsetup-runs/facts",
+                        "Directory of the per host cache files of gathered "
+                        "facts.  If empty, facts are only cached in memory "
+                        "during a run.",
+                    ),
+                    Entry(
+                        "ttl",
+                        3600,
+                        "Seconds a gathered fact is valid.",
+                    ),
+                ],
+            ),
         ]
 
     @staticmethod
@@ -414,6 +587,8 @@ class Fabsetup(fabric.main.Fab):
 
     def __init__(self, *args, **kwargs):
         self.tee = None
+        self.pandoc = None
+        self.live_html = None
         super().__init__(*args, **kwargs)
 
     def core_args(self):
@@ -462,6 +637,18 @@ class Fabsetup(fabric.main.Fab):
                 default=False,
                 help="Hide `print()` output.",
             ),
+            invoke.Argument(
+                names=("timing",),
+                kind=bool,
+                default=False,
+                help="Print durations of tasks and commands.",
+            ),
+            invoke.Argument(
+                names=("timing-summary",),
+                kind=int,
+                default=0,
+                help="Print the N slowest tasks and commands at the end.",
+            ),
             invoke.Argument(
                 names=("unnumbered",),
                 kind=bool,
@@ -475,6 +662,18 @@ class Fabsetup(fabric.main.Fab):
                 help="Confirm and optionally change every command "
                 "(disables `--hide-command-line`).",
             ),
+            invoke.Argument(
+                names=("resume",),
+                kind=bool,
+                default=False,
+                help="Skip subtasks completed by the previous, failed run.",
+            ),
+            invoke.Argument(
+                names=("parallel",),
+                kind=int,
+                default=0,
+                help="Run tasks on up to N hosts in parallel.",
+            ),
             invoke.Argument(
                 names=("color-keep",),
                 kind=bool,
@@ -494,6 +693,18 @@ class Fabsetup(fabric.main.Fab):
                 default="",
                 help="Write markdown output (stdout and stderr) to file.",
             ),
+            invoke.Argument(
+                names=("events-file",),
+                kind=str,
+                default="",
+                help="Append a JSON lines event log of the execution to file.",
+            ),
+            invoke.Argument(
+                names=("trace-file",),
+                kind=str,
+                default="",
+                help="Write a Chrome trace of the execution to file.",
+            ),
             invoke.Argument(
                 names=("pandoc-add-toc",),
                 kind=str,
@@ -506,12 +717,49 @@ class Fabsetup(fabric.main.Fab):
                 default="",
                 help="Convert outfile to html file.",
             ),
+            invoke.Argument(
+                names=("live-html",),
+                kind=bool,
+                default=False,
+                help="Render the html file while the tasks are executed.",
+            ),
+            invoke.Argument(
+                names=("outfile-per-host",),
+                kind=bool,
+                default=False,
+                help="Write the output of each host into its own outfile.",
+            ),
             invoke.Argument(
                 names=("known-addons",),
                 kind=bool,
                 default=False,
                 help="List known Fabsetup addons.",
             ),
+            invoke.Argument(
+                names=("history",),
+                kind=str,
+                optional=True,
+                default="",
+                help="Show past runs and exit. Optionally filter by "
+                "'task=NAME,host=HOST,command=SUBSTRING,failed,limit=N'.",
+            ),
+            invoke.Argument(
+                names=("cat-run",),
+                kind=str,
+                optional=True,
+                default="",
+                help="Print the (decompressed) outfile of a run and exit. "
+                "Without a value print the latest outfile of 'outfile.dir'.",
+            ),
+            invoke.Argument(
+                names=("render-runs",),
+                kind=str,
+                optional=True,
+                default="",
+                help="Create the html files of all outfiles in DIR (default: "
+                "'outfile.dir') by a pool of processes and exit. Html files "
+                "newer than their outfile are skipped.",
+            ),
             invoke.Argument(
                 names=("show-config",),
                 kind=bool,
@@ -581,6 +829,96 @@ class Fabsetup(fabric.main.Fab):
             )
             raise invoke.exceptions.Exit
 
+        history = self.args.get("history").value
+        if history:
+            self.print_history("" if history is True else history)
+            raise invoke.exceptions.Exit
+
+        cat_run = self.args.get("cat-run").value
+        if cat_run:
+            self.cat_run("" if cat_run is True else cat_run)
+            raise invoke.exceptions.Exit
+
+        render_runs = self.args.get("render-runs").value
+        if render_runs:
+            self.render_runs("" if render_runs is True else render_runs)
+            raise invoke.exceptions.Exit
+
+    def print_history(self, query):
+        """Print past runs from the run history index as Markdown table."""
+        import fabsetup.history
+
+        index = fabsetup.history.History(self.config.history.file)
+        try:
+            print(index.query_markdown(query), end="")
+        except ValueError as exc:
+            raise invoke.exceptions.Exit(str(exc), code=2)
+        finally:
+            index.close()
+
+    def cat_run(self, filename):
+        """Print the decompressed outfile ``filename``, or if empty the latest
+        outfile in ``outfile.dir``."""
+        if not filename:
+            outfile_dir = os.path.expanduser(self.config.outfile.dir)
+            outfiles = []
+            if outfile_dir and os.path.isdir(outfile_dir):
+                outfiles = [
+                    entry
+                    for entry in os.scandir(outfile_dir)
+                    if entry.is_file()
+                    and not entry.name.startswith(".")
+                    and not entry.name.endswith(".html")
+                ]
+            if not outfiles:
+                print("no outfile found, 'outfile.dir' is empty or not set")
+                return
+            filename = max(outfiles, key=lambda entry: entry.stat().st_mtime).path
+        try:
+            fabsetup.utils.outfile.cat_run(filename)
+        except (OSError, ImportError) as exc:
+            print(exc)
+
+    def render_runs(self, directory):
+        """Create the HTML files of the outfiles in ``directory``, or if
+        empty in ``outfile.dir``, and print a Markdown table of the created
+        and failed HTML files."""
+        directory = directory or self.config.outfile.dir
+        if not directory or not os.path.isdir(os.path.expanduser(directory)):
+            print("no directory given, 'outfile.dir' is empty or not set")
+            return
+        pandoc = fabsetup.utils.pandoc.Pandoc(self.config.outfile.pandoc.command)
+        if not pandoc.command_available():
+            print("command {} not available".format(pandoc.command))
+            return
+        results = fabsetup.utils.pandoc.render_runs(
+            directory,
+            command=pandoc.command,
+            html_dir=self.config.outfile.pandoc.html.dir,
+        )
+        rows = [result for result in results if result[2] != "up to date"]
+        if rows:
+            print("| Outfile | HTML file | Status |")
+            print("| ------- | --------- | ------ |")
+            for filename_from, filename_to, status in rows:
+                print("| {} | {} | {} |".format(filename_from, filename_to, status))
+            print()
+        print(
+            "{} created, {} failed, {} up to date".format(
+                *[
+                    sum(1 for result in results if result[2] == status)
+                    for status in ["created", "failed", "up to date"]
+                ]
+            )
+        )
+
+    def hosts(self):
+        """Return the hosts given by ``-H`` as list."""
+        hs = self.core[0].as_kwargs["H"]
+        if hs:
+            return hs.split(",")
+        return []
+
     def _load(self, program, collection_name):
         program.config = self.config
 
@@ -638,6 +976,12 @@ class Fabsetup(fabric.main.Fab):
         if self.args.interactive.value:
             self.config.run.interactive = True
 
+        if self.args.get("parallel").value:
+            self.config.run.parallel = self.args.get("parallel").value
+
+        if self.args.get("resume").value:
+            self.config.checkpoint.resume = True
+
         if self.args.get("color-off").value:
             self.config.output.color_off = True
 
@@ -659,6 +1003,12 @@ class Fabsetup(fabric.main.Fab):
         if self.args.get("hide-print").value:
             self.config.output.hide_print = True
 
+        if self.args.get("timing").value:
+            self.config.output.timing = True
+
+        if self.args.get("timing-summary").value:
+            self.config.output.timing_summary = self.args.get("timing-summary").value
+
         if self.args.get("unnumbered").value:
             self.config.output.numbered = False
 
@@ -668,6 +1018,18 @@ class Fabsetup(fabric.main.Fab):
         if self.args.get("outfile").value:
             self.config.outfile.name = self.args.get("outfile").value
 
+        if self.args.get("events-file").value:
+            self.config.outfile.events = self.args.get("events-file").value
+
+        if self.args.get("trace-file").value:
+            self.config.outfile.trace_file = self.args.get("trace-file").value
+
+        if self.args.get("live-html").value:
+            self.config.outfile.pandoc.html.live = True
+
+        if self.args.get("outfile-per-host").value:
+            self.config.outfile.per_host = True
+
         if self.args.get("load-inv").value:
             self.config.load_invoke_tasks_file = True
 
@@ -694,8 +1056,92 @@ class Fabsetup(fabric.main.Fab):
         if self.config.output.hide_print:
             fabsetup.print.print_default.enabled = False
 
+    def control_events(self):
+
+        if self.config.outfile.events:
+
+            events = fabsetup.utils.events.EventLog()
+            events.open(self.config.outfile.events)
+            events.emit(
+                "run_start",
+                command=" ".join(sys.argv[:]),
+                tasks=[task.name for task in self.tasks],
+                hosts=self.hosts(),
+            )
+
+    def outfile_basename(self, hosts):
+        """Return ``outfile.basename_formatter`` formatted with the start of
+        the run, the tasks and ``hosts``."""
+
+        now_str = self.started.strftime(self.config.outfile.now_format)
+
+        # eg. `fabsetup task1 task2 long.task.name` results
+        # in: tasks_str = "_task1_task2_long-task-name"
+        # eg. `fabsetup` (no tasks given) results
+        # in: tasks_str = ""
+        tasks_str = "".join(
+            ["_{}".format(task.name.replace(".", "-")) for task in self.tasks]
+        )
+
+        # eg. hosts_str = "_host1_user@host2"
+        # eg. hosts_str = "_user@host"
+        # eg. hosts_str = ""
+        hosts_str = "".join(["_{}".format(user_host) for user_host in hosts])
+
+        # eg.
+        # basename = "fabsetup_2021-02-21_10-30-01_taskname_user@host.md"
+        return self.config.outfile.basename_formatter.format(
+            now=now_str,
+            tasks=tasks_str,
+            hosts=hosts_str,
+        )
+
+    def host_outfiles(self, outfile_abspath):
+        """Return the ``fabsetup.utils.outfile.HostOutfiles`` of the hosts
+        given by ``-H`` if ``outfile.per_host`` is set, else ``None``.
+
+        The outfile of a host is located in the directory ``<outfile>.d``
+        next to the outfile (the index) and compressed like the outfile.
+        """
+        if not (self.config.outfile.per_host and self.hosts()):
+            return None
+
+        compression = fabsetup.utils.outfile.compression_of(outfile_abspath)
+        stem = outfile_abspath
+        if compression:
+            stem = stem[: -len(fabsetup.utils.outfile.COMPRESSION_SUFFIXES[compression])]
+        directory = os.path.splitext(stem)[0] + ".d"
+
+        def filename_of(host):
+            return fabsetup.utils.outfile.compressed_name(
+                os.path.join(directory, self.outfile_basename([host])), compression
+            )
+
+        return fabsetup.utils.outfile.HostOutfiles(filename_of)
+
+    def host_html_names(self):
+        """Return the HTML files to render from the outfiles of the hosts,
+        ``{outfile: html file}``.
+
+        The HTML file of a host is located in the directory ``<html file>.d``
+        next to the HTML file of the run.  Empty if no HTML file is created.
+        """
+        html_name = self.config.outfile.pandoc.html.name
+        if not (html_name and self.tee and self.tee.host_outfiles):
+            return {}
+        html_abspath = os.path.abspath(os.path.expanduser(html_name))
+        directory = os.path.splitext(html_abspath)[0] + ".d"
+        return {
+            filename: os.path.join(
+                directory, fabsetup.utils.pandoc.html_basename(filename)
+            )
+            for filename in self.tee.host_outfiles.filenames.values()
+        }
+
     def control_outfile(self):
 
+        self.started = datetime.datetime.now()
+
         # auto-set self.config.outfile.name
 
         if not self.config.outfile.name:
@@ -704,37 +1150,9 @@ class Fabsetup(fabric.main.Fab):
 
             if outfile_dir:
 
-                now = datetime.datetime.now()
-                now_str = now.strftime(self.config.outfile.now_format)
-
-                # eg. `fabsetup task1 task2 long.task.name` results
-                # in: tasks_str = "_task1_task2_long-task-name"
-                # eg. `fabsetup` (no tasks given) results
-                # in: tasks_str = ""
-                tasks_str = "".join(
-                    ["_{}".format(task.name.replace(".", "-")) for task in self.tasks]
-                )
-
-                # eg. hosts_str = "_host1_user@host2"
-                # eg. hosts_str = "_user@host"
-                # eg. hosts_str = ""
-                hosts = []
-                hs = self.core[0].as_kwargs["H"]
-                if hs:
-                    hosts = hs.split(",")
-                hosts_str = "".join(["_{}".format(user_host) for user_host in hosts])
-
-                # eg.
-                # basename = "fabsetup_2021-02-21_10-30-01_taskname_user@host.md"
-                basename = self.config.outfile.basename_formatter.format(
-                    now=now_str,
-                    tasks=tasks_str,
-                    hosts=hosts_str,
-                )
-
                 self.config.outfile.name = os.path.join(
                     os.path.abspath(os.path.expanduser(outfile_dir)),
-                    basename,
+                    self.outfile_basename(self.hosts()),
                 )
 
         if self.config.outfile.name and not self.config.outfile.pandoc.html.name:
@@ -743,16 +1161,29 @@ class Fabsetup(fabric.main.Fab):
 
             if html_dir:
 
-                html_basename = (
-                    os.path.basename(self.config.outfile.name).rsplit(".")[0] + ".html"
-                )
-
                 self.config.outfile.pandoc.html.name = os.path.join(
                     os.path.abspath(os.path.expanduser(html_dir)),
-                    html_basename,
+                    fabsetup.utils.pandoc.html_basename(self.config.outfile.name),
                 )
 
-        if self.config.outfile.pandoc.html.name:
+        if self.config.outfile.name and self.config.outfile.compression:
+            try:
+                self.config.outfile.name = fabsetup.utils.outfile.compressed_name(
+                    self.config.outfile.name, self.config.outfile.compression
+                )
+                fabsetup.utils.outfile.compress(b"", self.config.outfile.compression)
+            except (ValueError, ImportError) as exc:
+                print(exc)
+                raise invoke.exceptions.Exit
+
+        live_html = (
+            self.config.outfile.pandoc.html.name
+            and self.config.outfile.pandoc.html.live
+            and self.config.outfile.name
+            and not self.config.outfile.keep_color
+        )
+
+        if self.config.outfile.pandoc.html.name and not live_html:
 
             self.pandoc = fabsetup.utils.pandoc.Pandoc(
                 self.config.outfile.pandoc.command
@@ -778,17 +1209,56 @@ class Fabsetup(fabric.main.Fab):
 
             debug("outfile_abspath: '{}'".format(outfile_abspath))
 
+            # horizontal line between toc (added after task execution) and
+            # the output of the task execution; the tee collects the headings
+            with_toc = (
+                self.config.outfile.pandoc.toc and not self.config.outfile.keep_color
+            )
+
             self.tee = fabsetup.utils.outfile.Tee()
+
+            events = fabsetup.utils.events.EventLog()
+            if events.enabled:
+                self.tee.on_write = lambda stream, size: events.emit(
+                    "output", stream=stream, bytes=size
+                )
+
             self.tee.set_outfile(
                 outfile_abspath,
                 # prefix="```sh\n{}\n```\n\n----\n".format(" ".join(sys.argv[:])),
-                # prefix="----\n",
-                prefix="",
+                prefix="----\n\n" if with_toc else "",
+                strip_color_codes=not self.config.outfile.keep_color,
+                toc=with_toc,
+                host_outfiles=self.host_outfiles(outfile_abspath),
             )
-            self.tee.start()
 
             self.command = " ".join(sys.argv[:])
 
+            if live_html:
+                preamble = ""
+                if self.config.outfile.prepend_executed_fabsetup_command:
+                    # replaced by the command with its exit code and the toc
+                    # at the end of the run
+                    preamble = "{}```\n{}\n```\n\n".format(
+                        self.config.outfile.fabsetup_command_prefix,
+                        self.command,
+                    )
+                self.live_html = fabsetup.utils.markdown.LiveHtml(
+                    self.config.outfile.pandoc.html.name,
+                    css_url=fabsetup.utils.pandoc.OUTFILE_CSS,
+                    after_body=fabsetup.utils.pandoc.HTML_SCRIPT,
+                    preamble=preamble,
+                    # no space reserved for a header which is not written
+                    header_size=(
+                        fabsetup.utils.markdown.HEADER_SIZE
+                        if preamble or with_toc
+                        else 0
+                    ),
+                )
+                self.tee.outfile_observers.append(self.live_html.feed)
+
+            self.tee.start()
+
     def execute(self):
         """Add hooks to ``invoke.program.`` in order to run external command
         before fabsetup task execution, control output and outfile of fabsetup
@@ -797,7 +1267,12 @@ class Fabsetup(fabric.main.Fab):
         if self.config.run_before:
             subprocess.run(self.config.run_before, shell=True)
 
+        if self.config.run.parallel > 1 and self.config.run.interactive:
+            print("--interactive can not be combined with --parallel")
+            raise invoke.exceptions.Exit
+
         self.control_output()
+        self.control_events()
         self.control_outfile()
 
         debug("\n" + pprint.pformat(dict(self.config)))
@@ -807,7 +1282,27 @@ class Fabsetup(fabric.main.Fab):
             pprint.pprint(self.config.as_dict())
             raise invoke.exceptions.Exit
 
-        super().execute()
+        fabsetup.utils.timing.Timings().reset()
+
+        try:
+            super().execute()
+        finally:
+            self.print_timing_summary()
+            if self.config.outfile.trace_file:
+                fabsetup.utils.timing.Timings().write_chrome_trace(
+                    self.config.outfile.trace_file
+                )
+
+    def print_timing_summary(self):
+        """Print tables of the slowest tasks and commands if
+        ``output.timing_summary`` is set."""
+        if self.config.output.timing_summary:
+            print(
+                fabsetup.utils.timing.Timings().summary(
+                    self.config.output.timing_summary
+                ),
+                end="",
+            )
 
     def run(self, argv=None, exit=True):
         """"""
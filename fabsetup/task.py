@@ -1,19 +1,33 @@
+import concurrent.futures
+import contextlib
+import copy
 import inspect
 import getpass
 import os
+import posixpath
+import shutil
 import socket
 import sys
 from functools import wraps
 
 import fabric
 import fabric.connection
+import fabric.transfer
 import invoke.context
+import invoke.exceptions
 from invoke.util import debug
 
 import fabsetup.fabutils.queries
+from fabsetup.checkpoint import Checkpoints, input_hash
+from fabsetup.executor import shifted_numbered_state
+from fabsetup.fabutils.facts import HostFacts
+from fabsetup.fabutils.pipeline import Pipeline
 from fabsetup.utils.decorators import print_doc, print_full_name
 from fabsetup.utils.colors import yellow, green, cyan, magenta, config_color
 from fabsetup.utils.decorate import invoked
+from fabsetup.utils.outfile import OutputDemux, Tee, stream_demux
+from fabsetup.utils.events import EventLog
+from fabsetup.utils.timing import Timings
 from fabsetup.print import print_default, print_code_block
 from fabsetup.print import print_command_line
 
@@ -103,6 +117,245 @@ def get_task_depth(c, default=1):
     return int(c.config["output"]["task_depth"])
 
 
+@contextlib.contextmanager
+def task_checkpoint(c, name):
+    """Within this context the completed subtasks of task ``name`` are
+    recorded in a `fabsetup.checkpoint.Checkpoint` (if ``checkpoint.dir`` is
+    set).  The checkpoint is removed if the task has been completed.
+    """
+    directory = from_config(c.config, ["checkpoint", "dir"], "")
+    if not directory:
+        yield None
+        return
+    host = getattr(c, "host", None)
+    outer_task = c.config["checkpoint"].get("task", None)
+    c.config["checkpoint"]["task"] = name
+    checkpoints = Checkpoints()
+    try:
+        yield checkpoints.start(
+            directory,
+            name,
+            host,
+            resume=bool(from_config(c.config, ["checkpoint", "resume"], False)),
+        )
+        checkpoints.finish(name, host)
+    finally:
+        c.config["checkpoint"]["task"] = outer_task
+
+
+def current_checkpoint(c):
+    """Return the `fabsetup.checkpoint.Checkpoint` of the currently executed
+    task or ``None``.
+    """
+    task_name = from_config(c.config, ["checkpoint", "task"], None)
+    if task_name is None:
+        return None
+    return Checkpoints().get(task_name, getattr(c, "host", None))
+
+
+def print_skipped(c_or_self, *args, **kwargs):
+    print_default("*Skipped, completed by the resumed run.*\n")
+
+
+def timed_run(run_method, cmd, *args, host=None, **kwargs):
+    """Execute ``run_method(cmd, *args, **kwargs)`` measured as a command of
+    the run-scoped `fabsetup.utils.timing.Timings`.
+
+    :returns:
+        Tuple of the result of ``run_method`` and the
+        `fabsetup.utils.timing.TimingNode` of the command.
+    """
+    with Timings().measure("command", cmd, host=host) as node:
+        try:
+            res = run_method(cmd, *args, **kwargs)
+        except invoke.exceptions.UnexpectedExit as exc:
+            node.return_code = exc.result.return_code
+            raise
+        node.return_code = getattr(res, "return_code", None)
+        for stream in ("stdout", "stderr"):
+            output = getattr(res, stream, None)
+            if isinstance(output, str):
+                node.args[stream + "_bytes"] = len(output.encode())
+    return res, node
+
+
+def _attach(c, name, factory):
+    # set as attribute of the context (or connection) object itself, setting
+    # ``c.<name>`` would store it in the config which is shared by the
+    # connections to all hosts of ``-H``
+    if vars(c).get(name) is None:
+        object.__setattr__(c, name, factory())
+
+
+def attach_facts(c, run_method, host):
+    """Set ``c.facts`` to the `fabsetup.fabutils.facts.HostFacts` of
+    ``host`` gathered by ``run_method``, if not already set (e.g. by the
+    calling task).
+    """
+    _attach(
+        c,
+        "facts",
+        lambda: HostFacts(
+            run_method,
+            host,
+            directory=from_config(c.config, ["facts_cache", "dir"], ""),
+            ttl=float(from_config(c.config, ["facts_cache", "ttl"], 3600)),
+        ),
+    )
+
+
+def attach_pipeline(c, run_method):
+    """Set ``c.pipeline`` to a `fabsetup.fabutils.pipeline.Pipeline` of
+    ``run_method``, if not already set (e.g. by the calling task).
+    """
+    _attach(c, "pipeline", lambda: Pipeline(run_method, c.config))
+
+
+def pipeline_session(c, run_method, kwargs):
+    """Return the shell session of ``with c.pipeline():`` which executes the
+    command of ``run_method`` or ``None``.
+    """
+    pipeline = vars(c).get("pipeline")
+    if pipeline is None:
+        return None
+    return pipeline.active_session(run_method, kwargs)
+
+
+def invalidate_facts(c, run_method=None):
+    """Invalidate ``c.facts`` because a command executed by ``run_method``
+    or an upload could have changed the host.
+
+    Commands executed by another run method than the one of the facts, e.g.
+    ``c.local()`` within a task executed on a remote host, do not invalidate
+    the facts.
+    """
+    facts = vars(c).get("facts")
+    if facts is None:
+        return
+    if run_method is None or run_method == facts.run:
+        facts.invalidate()
+
+
+def print_duration(c, node):
+    """Print the duration of a task or subtask if ``output.timing`` is set."""
+    if from_config(c.config, ["output", "timing"], False):
+        print_default("\n*Duration of {}: {:.3f} s*".format(node.name, node.wall))
+
+
+def sftp_put(c, local, remote, recursive=False):
+    """Upload ``local`` to ``remote`` like ``scp`` but over the SFTP channel
+    of the ssh connection already established by ``c``.
+
+    A ``remote`` path beginning with ``~/`` is relative to the home dir of
+    the remote user.
+
+    :param fabric.connection.Connection c:
+
+    :param local:
+        Local path or file-like object.
+
+    :param str remote:
+        Remote path.
+
+    :param bool recursive:
+        Upload the local directory ``local`` recursively.
+
+    :returns:
+        ``fabric.transfer.Result`` or, if ``recursive``, a list of them.
+    """
+    if remote == "~":
+        remote = "."
+    elif remote.startswith("~/"):
+        remote = remote[2:]
+
+    print_default("\n* put: `{}` → `{}:{}`".format(local, c.host, remote))
+
+    with Timings().measure("put", "put {}".format(remote), host=c.host) as node:
+        res = _sftp_put(c, local, remote, recursive)
+        node.args["bytes"] = _put_bytes(res)
+    return res
+
+
+def _put_bytes(res):
+    results = res if isinstance(res, list) else [res]
+    count = 0
+    for result in results:
+        local = getattr(result, "local", None)
+        if isinstance(local, str) and os.path.isfile(local):
+            count += os.path.getsize(local)
+        elif hasattr(local, "getbuffer"):
+            count += local.getbuffer().nbytes
+    return count
+
+
+def _sftp_put(c, local, remote, recursive):
+
+    transfer = fabric.transfer.Transfer(c)
+
+    if not (recursive and isinstance(local, str) and os.path.isdir(local)):
+        return transfer.put(local, remote=remote)
+
+    if transfer.is_remote_dir(remote):
+        remote = posixpath.join(remote, os.path.basename(os.path.normpath(local)))
+
+    results = []
+    for dirpath, _, filenames in os.walk(local):
+        remote_dir = posixpath.normpath(
+            posixpath.join(remote, os.path.relpath(dirpath, local))
+        )
+        if not transfer.is_remote_dir(remote_dir):
+            transfer.sftp.mkdir(remote_dir)
+        for filename in filenames:
+            results.append(
+                transfer.put(
+                    os.path.join(dirpath, filename),
+                    remote=posixpath.join(remote_dir, filename),
+                )
+            )
+    return results
+
+
+def cp_put(c, local, remote, recursive=False):
+    """Local counterpart of `sftp_put()`, copies ``local`` to ``remote`` by
+    ``cp`` executed with ``c.local``.
+
+    :param invoke.context.Context c:
+
+    :param local:
+        Local path or file-like object.
+
+    :param str remote:
+        Path of the copy.
+
+    :param bool recursive:
+        Copy the directory ``local`` recursively.
+    """
+    with Timings().measure("put", "put {}".format(remote)):
+        return _cp_put(c, local, remote, recursive)
+
+
+def _cp_put(c, local, remote, recursive):
+    if not isinstance(local, str):
+        # file-like object
+        mode = "w" if isinstance(local.read(0), str) else "wb"
+        with open(os.path.expanduser(remote), mode) as fh:
+            shutil.copyfileobj(local, fh)
+        return None
+
+    rcsv = ""
+    if recursive:
+        rcsv = " -r"
+
+    res = c.local(
+        "cp{rcsv} {local} {remote}".format(
+            rcsv=rcsv,
+            local=local,
+            remote=remote,
+        )
+    )
+    return res
+
+
 def wrapped_run_method(c, run_method, remote, **kwargs):
     """Wrap ``run_method`` with internal function
     ``cmd_in_markdown_codeblock()``.
@@ -136,6 +389,10 @@ def wrapped_run_method(c, run_method, remote, **kwargs):
     :param str postfix_formatter:
         Optional, default: ``3*'`'+'\\n'``
 
+    :param str duration_formatter:
+        Printed after the command output if ``output.timing`` is set.
+        Optional, default: ``'({duration:.3f} s)\\n'``
+
     :param dict format_kwargs:
         Optional, default: ``dict(language='', prompt_end='> ')``
 
@@ -144,6 +401,21 @@ def wrapped_run_method(c, run_method, remote, **kwargs):
 
     :param str command_errput_prefix:
         Optional, default: ``"(STDERR) "`` (without quotation marks).
+
+    :param int truncate_head:
+        Keep only the first ``truncate_head`` lines of the command output in
+        the outfile (together with ``truncate_tail``).
+        Optional, default: ``outfile.truncate.head`` of the config.
+
+    :param int truncate_tail:
+        Keep only the last ``truncate_tail`` lines of the command output in
+        the outfile.
+        Optional, default: ``outfile.truncate.tail`` of the config.
+
+    :param bool truncate_spill:
+        Write the complete output of a truncated command into a side file
+        which is referenced in the outfile.
+        Optional, default: ``outfile.truncate.spill`` of the config.
     """
 
     # workaround: do not wrap if already wrapped
@@ -167,6 +439,7 @@ def wrapped_run_method(c, run_method, remote, **kwargs):
     )
     return_code_formatter = kwargs.get("return_code_formatter", "[{return_code}]\n")
     postfix_formatter = kwargs.get("postfix_formatter", "```\n")
+    duration_formatter = kwargs.get("duration_formatter", "({duration:.3f} s)\n")
     format_kwargs = {
         **{
             # "language": "",  # 'sh'
@@ -179,6 +452,16 @@ def wrapped_run_method(c, run_method, remote, **kwargs):
     command_output_prefix = kwargs.get("command_output_prefix", "")  # "(stdout) ")
     command_errput_prefix = kwargs.get("command_errput_prefix", "")  # "(STDERR) ")
 
+    truncate_head = kwargs.get(
+        "truncate_head", from_config(c.config, ["outfile", "truncate", "head"], 0)
+    )
+    truncate_tail = kwargs.get(
+        "truncate_tail", from_config(c.config, ["outfile", "truncate", "tail"], 0)
+    )
+    truncate_spill = kwargs.get(
+        "truncate_spill", from_config(c.config, ["outfile", "truncate", "spill"], True)
+    )
+
     # wrapped_run_method.num_calls += 1
 
     @wraps(run_method)
@@ -215,6 +498,7 @@ def wrapped_run_method(c, run_method, remote, **kwargs):
             "return_code_formatter", return_code_formatter
         )
         inner_postfix_formatter = kwargs.pop("postfix_formatter", postfix_formatter)
+        inner_duration_formatter = kwargs.pop("duration_formatter", duration_formatter)
         inner_format_kwargs = {**format_kwargs, **kwargs.pop("format_kwargs", {})}
 
         inner_command_output_prefix = kwargs.pop(
@@ -223,10 +507,23 @@ def wrapped_run_method(c, run_method, remote, **kwargs):
         inner_command_errput_prefix = kwargs.pop(
             "command_errput_prefix", command_errput_prefix
         )
+        inner_truncate_head = kwargs.pop("truncate_head", truncate_head)
+        inner_truncate_tail = kwargs.pop("truncate_tail", truncate_tail)
+        inner_truncate_spill = kwargs.pop("truncate_spill", truncate_spill)
+
+        timing_host = c.host if remote else None
+
+        # the command could change the host, e.g. install a package
+        invalidate_facts(c, run_method)
+
+        # within `with c.pipeline():` the command is sent to its shell
+        session = None if args else pipeline_session(c, run_method, kwargs)
+        runner = session.run if session else run_method
 
         if kwargs.get("hide", None) is True:
             # no output, no markdown codeblock
-            return run_method(cmd, *args, **kwargs)
+            res, _ = timed_run(runner, cmd, *args, host=timing_host, **kwargs)
+            return res
 
         # kwargs['hide'] != True
 
@@ -289,7 +586,29 @@ def wrapped_run_method(c, run_method, remote, **kwargs):
                 sys.stderr.add_prefix = True
                 sys.stderr.stream2_line_prefix = inner_command_errput_prefix
 
-            res = run_method(cmd, *args, **kwargs)
+            limiter = Tee().output_limiter(
+                inner_truncate_head, inner_truncate_tail, inner_truncate_spill
+            )
+            if limiter and hasattr(sys.stdout, "set_stream2_limiter"):
+                # stdout and stderr share the limiter as they share the outfile
+                sys.stdout.set_stream2_limiter(limiter)
+                sys.stderr.set_stream2_limiter(limiter)
+
+            # on parallel execution invoke's worker threads have to write
+            # into the output buffer of this thread
+            if isinstance(sys.stdout, stream_demux):
+                kwargs.setdefault("out_stream", sys.stdout.thread_stream())
+            if isinstance(sys.stderr, stream_demux):
+                kwargs.setdefault("err_stream", sys.stderr.thread_stream())
+
+            try:
+                res, timing = timed_run(
+                    runner, cmd, *args, host=timing_host, **kwargs
+                )
+            finally:
+                if limiter and hasattr(sys.stdout, "close_stream2_limiter"):
+                    sys.stderr.set_stream2_limiter(None)
+                    sys.stdout.close_stream2_limiter()
 
             # import sys
             # from fabsetup.utils import red
@@ -314,6 +633,11 @@ def wrapped_run_method(c, run_method, remote, **kwargs):
                 # print_briefly(return_code, end='')
                 print_default(return_code, end="")
 
+            if from_config(c.config, ["output", "timing"], False):
+                print_default(
+                    inner_duration_formatter.format(duration=timing.wall), end=""
+                )
+
             # end codeblock
 
         finally:
@@ -336,6 +660,87 @@ def wrapped_run_method(c, run_method, remote, **kwargs):
 # wrapped_run_method.num_calls = 0  # TODO DEBUG
 
 
+def wrap_context(c, **wrap_kwargs):
+    """Wrap ``c.run()``, ``c.local()`` and ``c.put()`` of the context (or
+    connection) ``c`` in order to print the commands and their output as
+    Markdown code blocks, and attach ``c.facts`` and ``c.pipeline``.
+
+    Called by the decorator `task` (and by ``fabsetup.aio.AsyncContext`` for
+    the context of synchronous tasks and subtasks).
+
+    :param wrap_kwargs:
+        Keyword arguments of `wrapped_run_method()`.
+    """
+    if (
+        isinstance(c, fabric.connection.Connection)
+        and hasattr(c, "host")
+        and c.host != "localhost"
+    ):
+        # `fabsetup` or `fab` was called with -H argument
+
+        debug(f"called with `-H {c.user}@{c.host}`".format(c))
+
+        attach_facts(c, c.run, "{}@{}".format(c.user, c.host))
+        attach_pipeline(c, c.run)
+        c.run = wrapped_run_method(
+            c, run_method=c.run, remote=True, **wrap_kwargs
+        )
+        c.local = wrapped_run_method(
+            c, run_method=c.local, remote=False, **wrap_kwargs
+        )
+
+        def put_sftp(local, remote, recursive=False):
+            invalidate_facts(c)
+            return sftp_put(c, local, remote, recursive=recursive)
+
+        c.put = put_sftp
+
+    elif hasattr(c, "host") and c.host == "localhost":
+
+        debug("`-H localhost` is used")
+
+        attach_facts(c, c.local, "{}@localhost".format(getpass.getuser()))
+        attach_pipeline(c, c.local)
+        c.local = wrapped_run_method(
+            c, run_method=c.local, remote=False, **wrap_kwargs
+        )
+        c.run = c.local
+
+        def put_cp(local, remote, recursive=False):
+            invalidate_facts(c)
+            return cp_put(c, local, remote, recursive=recursive)
+
+        c.put = put_cp
+
+    else:
+        # type of c is invoke.context.Context
+        # `fabsetup` or `fab` was called without -H argument
+        # or `invoke` was called
+
+        debug("no `-H` argument used")
+
+        attach_facts(c, c.run, "{}@localhost".format(getpass.getuser()))
+        attach_pipeline(c, c.run)
+        c.run = wrapped_run_method(
+            c,
+            run_method=c.run,
+            remote=False,
+            local_cmd_formatter=wrap_kwargs.pop(
+                "local_cmd_formatter",
+                "{cmd}"
+                # "local_cmd_formatter", "{prompt_end}{cmd}"
+            ),
+            **wrap_kwargs,
+        )
+        c.local = c.run
+
+        def put_cp(local, remote, recursive=False):
+            invalidate_facts(c)
+            return cp_put(c, local, remote, recursive=recursive)
+
+        c.put = put_cp
+
+
 def task(*args, **kwargs):
     '''Decorator based on `fabric.tasks.task
     <https://docs.fabfile.org/en/latest/api/tasks.html#fabric.tasks.task>`_
@@ -476,102 +881,7 @@ def task(*args, **kwargs):
                 ),
             )
 
-            if (
-                isinstance(c, fabric.connection.Connection)
-                and hasattr(c, "host")
-                and c.host != "localhost"
-            ):
-                # `fabsetup` or `fab` was called with -H argument
-
-                debug(f"called with `-H {c.user}@{c.host}`".format(c))
-
-                c.run = wrapped_run_method(
-                    c, run_method=c.run, remote=True, **wrap_kwargs
-                )
-                c.local = wrapped_run_method(
-                    c, run_method=c.local, remote=False, **wrap_kwargs
-                )
-
-                def put_scp(local, remote, recursive=False):
-
-                    rcsv = ""
-                    if recursive:
-                        rcsv = " -r"
-
-                    res = c.local(
-                        "scp{rcsv} {local} {c.user}@{c.host}:{remote}".format(
-                            rcsv=rcsv,
-                            local=local,
-                            remote=remote,
-                            c=c,
-                        )
-                    )
-                    return res
-
-                c.put = put_scp
-
-            elif hasattr(c, "host") and c.host == "localhost":
-
-                debug("`-H localhost` is used")
-
-                c.local = wrapped_run_method(
-                    c, run_method=c.local, remote=False, **wrap_kwargs
-                )
-                c.run = c.local
-
-                def put_cp(local, remote, recursive=False):
-
-                    rcsv = ""
-                    if recursive:
-                        rcsv = " -r"
-
-                    res = c.local(
-                        "cp{rcsv} {local} {remote}".format(
-                            rcsv=rcsv,
-                            local=local,
-                            remote=remote,
-                        )
-                    )
-                    return res
-
-                c.put = put_cp
-
-            else:
-                # type of c is invoke.context.Context
-                # `fabsetup` or `fab` was called without -H argument
-                # or `invoke` was called
-
-                debug("no `-H` argument used")
-
-                c.run = wrapped_run_method(
-                    c,
-                    run_method=c.run,
-                    remote=False,
-                    local_cmd_formatter=wrap_kwargs.pop(
-                        "local_cmd_formatter",
-                        "{cmd}"
-                        # "local_cmd_formatter", "{prompt_end}{cmd}"
-                    ),
-                    **wrap_kwargs,
-                )
-                c.local = c.run
-
-                def put_cp(local, remote, recursive=False):
-
-                    rcsv = ""
-                    if recursive:
-                        rcsv = " -r"
-
-                    res = c.local(
-                        "cp{rcsv} {local} {remote}".format(
-                            rcsv=rcsv,
-                            local=local,
-                            remote=remote,
-                        )
-                    )
-                    return res
-
-                c.put = put_cp
+            wrap_context(c, **wrap_kwargs)
 
             # TODO: raise c is no context or connection TypeError
 
@@ -598,7 +908,12 @@ def task(*args, **kwargs):
             append_numbered_index(c)
             c.config.output["task_depth"] = cur_depth + 1
 
-            res = wrapped(c, *argz, **kwargz)
+            task_name = name_ or func.__qualname__
+            with task_checkpoint(c, task_name), Timings().measure(
+                "task", task_name, host=getattr(c, "host", None)
+            ) as timing:
+                res = wrapped(c, *argz, **kwargz)
+            print_duration(c, timing)
 
             remove_numbered_index(c)
             c.config.output["task_depth"] = cur_depth
@@ -652,6 +967,11 @@ def subtask(*args, **kwargs):
         Optionally define a name which is printed as the heading text instead
         of the name of the subtask function (default: ``None``).
 
+    :param [function] after:
+        Optionally declare the subtasks which have to be finished before this
+        subtask is started by `run_subtasks()` (default: ``[]``).  Has no
+        effect when the subtask is called directly.
+
     Example:
 
         >>> import invoke.context
@@ -678,6 +998,7 @@ def subtask(*args, **kwargs):
     doc = kwargs.get("doc", True)
     color = kwargs.get("color", None)
     name = kwargs.get("name", None)
+    after = kwargs.get("after", [])
 
     def real_decorator(func):
         @wraps(func)
@@ -703,24 +1024,53 @@ def subtask(*args, **kwargs):
             if pfx is None:
                 pfx = "\n" + "#" * cur_depth + " "
 
+            numbered = increment_numbered_state(c)
+            step_name = name or func.__qualname__
+
+            checkpoint = current_checkpoint(c)
+            if checkpoint is not None:
+                step_hash = input_hash(func, argz, kwargz)
+                if checkpoint.completed(numbered, step_name, step_hash):
+                    print_full_name(
+                        color=col,
+                        prefix=pfx,
+                        tail=tail,
+                        name=step_name,
+                        numbered=numbered,
+                    )(print_skipped)(c_or_self)
+                    EventLog().emit(
+                        "subtask_skipped",
+                        name=step_name,
+                        host=getattr(c, "host", None),
+                    )
+                    return None
+
             wrapped = print_full_name(
                 color=col,
                 prefix=pfx,
                 tail=tail,
                 name=name,
-                numbered=increment_numbered_state(c),
+                numbered=numbered,
             )(print_doc(func) if doc else func)
 
             append_numbered_index(c)
             c.config.output["task_depth"] = cur_depth + 1
 
-            res = wrapped(c_or_self, *argz, **kwargz)
+            with Timings().measure(
+                "subtask", step_name, host=getattr(c, "host", None)
+            ) as timing:
+                res = wrapped(c_or_self, *argz, **kwargz)
+            print_duration(c, timing)
+
+            if checkpoint is not None:
+                checkpoint.record(numbered, step_name, step_hash)
 
             remove_numbered_index(c)
             c.config.output["task_depth"] = cur_depth
 
             return res
 
+        wrapped_func.after = list(after)
         return wrapped_func
 
     if invoked(args, kwargs):
@@ -728,6 +1078,197 @@ def subtask(*args, **kwargs):
     return real_decorator(func=args[0])  # when decorated as `@subtask`
 
 
+def subtask_dependencies(subtasks):
+    """Return the indices of the dependencies (``after``) of each subtask.
+
+    Dependencies which are not contained in ``subtasks`` are ignored, they
+    are expected to have been executed before.
+
+    Example:
+
+        >>> @subtask
+        ... def first(c):
+        ...     pass
+        >>> @subtask(after=[first])
+        ... def second(c):
+        ...     pass
+        >>> subtask_dependencies([first, second])
+        [set(), {0}]
+        >>> subtask_dependencies([second])
+        [set()]
+
+    :raises ValueError:
+        If a subtask is listed before one of its dependencies.
+    """
+    dependencies = []
+    for index, subtask_ in enumerate(subtasks):
+        indices = set()
+        for dependency in getattr(subtask_, "after", []):
+            if dependency not in subtasks:
+                continue
+            dependency_index = subtasks.index(dependency)
+            if dependency_index >= index:
+                raise ValueError(
+                    "subtask {} has to be listed after its dependency {}".format(
+                        subtask_.__qualname__, dependency.__qualname__
+                    )
+                )
+            indices.add(dependency_index)
+        dependencies.append(indices)
+    return dependencies
+
+
+def run_subtasks(c, subtasks, workers=None):
+    """Execute ``subtasks`` and start each as soon as the subtasks it has
+    been declared to run ``after`` are finished.
+
+    Independent subtasks are executed concurrently in a thread pool.  Each
+    gets a copy of ``c`` with its own config clone, the copies share the
+    connection of ``c``, so every command is run on its own SSH channel.
+    The output of each subtask is buffered and replayed in the order of
+    ``subtasks``, its ``output.numbered_state`` is shifted as if the
+    subtasks would have been executed one after another.  So the Markdown
+    output is the same as on sequential execution.
+
+    With ``run.interactive`` or ``workers`` less than 2 the subtasks are
+    executed sequentially.
+
+    If a subtask fails no further subtask is started, the output of the
+    finished subtasks is replayed and the exception of the first failed
+    subtask is raised.
+
+    Example::
+
+        @subtask
+        def install_vim_config(c):
+            ...
+
+        @subtask
+        def install_tmux_config(c):
+            ...
+
+        @subtask(after=[install_vim_config])
+        def install_vim_plugins(c):
+            ...
+
+        @task
+        def dotfiles(c):
+            run_subtasks(
+                c, [install_vim_config, install_tmux_config, install_vim_plugins]
+            )
+
+    :param c:
+        `fabric.connection.Connection` or `invoke.context.Context` passed
+        to each subtask.
+
+    :param [function] subtasks:
+        Subtask functions taking ``c`` as their only argument, listed in
+        output order: A subtask has to be listed after its dependencies.
+
+    :param int workers:
+        Maximum number of subtasks executed at once,
+        default: config ``run.subtask_workers`` or ``4``.
+
+    :returns:
+        list of the return values of the subtasks.
+    """
+    subtasks = list(subtasks)
+    dependencies = subtask_dependencies(subtasks)
+
+    if workers is None:
+        workers = from_config(c.config, ["run", "subtask_workers"], 4)
+    if from_config(c.config, ["run", "interactive"], False):
+        workers = 1  # queries can not be answered concurrently
+    if int(workers) < 2 or len(subtasks) < 2:
+        return [subtask_(c) for subtask_ in subtasks]
+
+    if isinstance(c, fabric.connection.Connection):
+        # connect once, before the threads open their channels
+        c.open()
+
+    c.config["output"] = c.config.get("output", {})
+    numbered_state = c.config["output"].get("numbered_state", "0")
+    contexts = []
+    for offset, _ in enumerate(subtasks):
+        context = copy.copy(c)
+        context.config = c.config.clone()
+        context.config["output"]["numbered_state"] = shifted_numbered_state(
+            numbered_state, offset
+        )
+        contexts.append(context)
+
+    parent = Timings().current()
+    demux = OutputDemux()
+
+    def buffered_call(subtask_, context):
+        with Timings().inherit(parent), demux.buffered() as buffer:
+            try:
+                return subtask_(context), None, buffer
+            except BaseException as exc:
+                return None, exc, buffer
+
+    results = [None] * len(subtasks)
+    buffers = {}
+    exceptions = {}
+    futures = {}
+    finished = set()
+    replayed = 0
+    demux.start()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=int(workers), thread_name_prefix="fabsetup-subtask"
+        ) as pool:
+            pending = set()
+            while True:
+                if not exceptions:
+                    for index, subtask_ in enumerate(subtasks):
+                        if index in futures.values():
+                            continue
+                        if dependencies[index] <= finished:
+                            future = pool.submit(
+                                buffered_call, subtask_, contexts[index]
+                            )
+                            futures[future] = index
+                            pending.add(future)
+                if not pending:
+                    break
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    index = futures[future]
+                    results[index], exc, buffers[index] = future.result()
+                    if exc is None:
+                        finished.add(index)
+                    else:
+                        exceptions[index] = exc
+                while replayed in buffers:
+                    demux.replay(buffers.pop(replayed))
+                    replayed += 1
+        # subtasks finished after a failed one or while a preceding one was
+        # not started
+        for index in sorted(buffers):
+            demux.replay(buffers[index])
+    finally:
+        demux.stop()
+
+    # continue numbering after the last subtask
+    offset = sum(
+        int(context.config["output"]["numbered_state"].split(".")[-1])
+        - int(numbered_state.split(".")[-1])
+        - start_offset
+        for start_offset, context in enumerate(contexts)
+    )
+    c.config["output"]["numbered_state"] = shifted_numbered_state(
+        numbered_state, offset
+    )
+
+    if exceptions:
+        raise exceptions[min(exceptions)]
+
+    return results
+
+
 # def subsubtask(*args, **kwargs):
 #     """Decorator which prints out the name and docstring of the decorated
 #     function on execution.
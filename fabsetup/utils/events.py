@@ -0,0 +1,83 @@
+"""Write a structured log of a fabsetup run as JSON lines."""
+
+import json
+import os
+import os.path
+import threading
+import time
+
+from fabsetup.utils.outfile import Singleton
+
+
+class EventLog(metaclass=Singleton):
+    """Single instance class which appends one JSON object per line to the
+    events file.
+
+    Uses `fabsetup.utils.outfile.Singleton` as metaclass.  As long as no
+    events file has been opened `emit()` does nothing.
+
+    Each event has the keys ``ts`` (seconds since the epoch), ``event`` (the
+    event type) and ``thread`` plus the keyword arguments given to `emit()`.
+
+    Example:
+
+        >>> import io
+        >>> events = EventLog()
+        >>> events.open(io.StringIO())
+        >>> events.emit('command_end', name='true', return_code=0)
+        >>> line = events.fh.getvalue()
+        >>> sorted(json.loads(line))
+        ['event', 'name', 'return_code', 'thread', 'ts']
+        >>> events.close()
+    """
+
+    def __init__(self):
+        self.fh = None
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.fh is not None
+
+    def open(self, filename, buffering=64 * 1024):
+        """Append events to ``filename``.
+
+        Recursively create parent dirs of ``filename`` if they not exist.
+
+        :param filename:
+            Path of the events file or an already opened filehandle.
+
+        :param int buffering:
+            Buffer size of the file, events are written when the buffer is
+            full and on `close()`.
+        """
+        if not isinstance(filename, str):
+            self.fh = filename
+            return
+        fname = os.path.abspath(os.path.expanduser(filename))
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        self.fh = open(fname, "a", buffering=buffering)
+
+    def emit(self, event, **fields):
+        """Write an event of type ``event`` with the given ``fields``."""
+        if self.fh is None:
+            return
+        line = json.dumps(
+            {
+                "ts": time.time(),
+                "event": event,
+                "thread": threading.current_thread().name,
+                **fields,
+            },
+            default=str,
+        )
+        with self.lock:
+            if self.fh is not None:
+                self.fh.write(line + "\n")
+
+    def close(self):
+        """Flush and close the events file."""
+        with self.lock:
+            if self.fh is not None:
+                self.fh.close()
+                self.fh = None
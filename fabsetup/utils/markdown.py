@@ -0,0 +1,728 @@
+"""Built-in, streaming Markdown to HTML renderer for fabsetup outfiles.
+
+Selected by ``outfile.pandoc.command = "builtin"`` as an alternative to the
+pandoc executable (cf. `fabsetup.utils.pandoc.Pandoc`).  It covers the
+Markdown dialect written by fabsetup: ATX headings, fenced and indented code
+blocks, paragraphs with inline code, emphasis and links, (nested) bullet
+lists, pipe tables and horizontal rules.
+
+The HTML resembles pandoc's HTML5 output, heading ids are created like
+pandoc's ``auto_identifiers``.  Fenced code blocks are rendered without
+syntax highlighting (like ``pandoc --no-highlight``), e.g. as ``<pre
+class="sh"><code>``.
+"""
+
+import html
+import os
+import os.path
+import pathlib
+import re
+import shutil
+
+BUILTIN = "builtin"
+
+HEADER_SIZE = 16 * 1024
+"""Bytes reserved by `LiveHtml` for the header written by its `close()`."""
+
+HEADING_REGEX = re.compile(r"^(#{1,6})[ \t]+(.*?)[ \t#]*$")
+FENCE_REGEX = re.compile(r"^(`{3,}|~{3,})[ \t]*\{?\.?([\w+-]*)\}?[ \t]*$")
+HR_REGEX = re.compile(r"^ {0,3}([-*_])([ \t]*\1){2,}[ \t]*$")
+LIST_ITEM_REGEX = re.compile(r"^( *)[-*+][ \t]+(.*)$")
+TABLE_SEPARATOR_REGEX = re.compile(r"^\|?[ \t]*:?-+:?[ \t]*(\|[ \t]*:?-+:?[ \t]*)*\|?$")
+
+INLINE_REGEX = re.compile(
+    r"(?P<code>(?P<ticks>`+)(?P<code_text>.+?)(?P=ticks))"
+    r"|(?P<link>\[(?P<link_text>[^\]]+)\]\((?P<link_url>[^)\s]+)\))"
+    r"|(?P<autolink><(?P<autolink_url>https?://[^>\s]+)>)"
+    r"|(?P<strong>\*\*(?P<strong_text>\S(?:.*?\S)?)\*\*)"
+    r"|(?P<em>\*(?P<em_text>[^\s*](?:[^*]*?[^\s*])?)\*)"
+)
+
+HEAD_STYLE = """\
+    code{white-space: pre-wrap;}
+    span.smallcaps{font-variant: small-caps;}
+    span.underline{text-decoration: underline;}
+    div.column{display: inline-block; vertical-align: top; width: 50%;}
+    div.hanging-indent{margin-left: 1.5em; text-indent: -1.5em;}
+    ul.task-list{list-style: none;}
+"""
+
+
+def inline_html(text):
+    """Render inline Markdown of ``text`` as HTML.
+
+    Example:
+
+        >>> inline_html('*Executed* `ls -l` & [docs](https://example.com)')
+        '<em>Executed</em> <code>ls -l</code> &amp; <a href="https://example.com">docs</a>'
+    """
+    result = []
+    pos = 0
+    for match in INLINE_REGEX.finditer(text):
+        result.append(html.escape(text[pos : match.start()], quote=False))
+        pos = match.end()
+        if match.group("code"):
+            result.append(
+                "<code>{}</code>".format(
+                    html.escape(match.group("code_text").strip(), quote=False)
+                )
+            )
+        elif match.group("link"):
+            result.append(
+                '<a href="{}">{}</a>'.format(
+                    html.escape(match.group("link_url")),
+                    inline_html(match.group("link_text")),
+                )
+            )
+        elif match.group("autolink"):
+            url = match.group("autolink_url")
+            result.append(
+                '<a href="{}" class="uri">{}</a>'.format(
+                    html.escape(url), html.escape(url, quote=False)
+                )
+            )
+        elif match.group("strong"):
+            result.append(
+                "<strong>{}</strong>".format(inline_html(match.group("strong_text")))
+            )
+        else:
+            result.append("<em>{}</em>".format(inline_html(match.group("em_text"))))
+    result.append(html.escape(text[pos:], quote=False))
+    return "".join(result)
+
+
+def plain_text(text):
+    """Return ``text`` without inline Markdown formatting."""
+    return re.sub(r"<[^>]+>", "", html.unescape(inline_html(text)))
+
+
+class Identifiers:
+    """Create unique heading identifiers like pandoc's ``auto_identifiers``
+    extension.
+
+    Example:
+
+        >>> identifiers = Identifiers()
+        >>> identifiers('1.2 Show task help')
+        'show-task-help'
+        >>> identifiers('1.3 Show task help')
+        'show-task-help-1'
+        >>> identifiers('42')
+        'section'
+    """
+
+    def __init__(self):
+        self.used = {}
+
+    def __call__(self, heading):
+        text = plain_text(heading).lower()
+        text = "".join(
+            char for char in text if char.isalnum() or char in "_-. " or char.isspace()
+        )
+        text = re.sub(r"\s+", "-", text.strip())
+        text = re.sub(r"^[^a-z]+", "", text)
+        identifier = text or "section"
+        if identifier in self.used:
+            self.used[identifier] += 1
+            identifier = "{}-{}".format(identifier, self.used[identifier])
+            while identifier in self.used:
+                identifier += "-1"
+        self.used.setdefault(identifier, 0)
+        return identifier
+
+
+def _table_cells(line):
+    line = line.strip()
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|") and not line.endswith("\\|"):
+        line = line[:-1]
+    return [cell.strip().replace("\\|", "|") for cell in re.split(r"(?<!\\)\|", line)]
+
+
+def _table_aligns(line):
+    aligns = []
+    for cell in _table_cells(line):
+        if cell.startswith(":") and cell.endswith(":"):
+            aligns.append("center")
+        elif cell.endswith(":"):
+            aligns.append("right")
+        elif cell.startswith(":"):
+            aligns.append("left")
+        else:
+            aligns.append(None)
+    return aligns
+
+
+class HtmlRenderer:
+    """Render Markdown lines to HTML, line after line.
+
+    Only the current block (paragraph, table) is held in memory.
+
+    :param callable write:
+        Called with each piece of created HTML.
+
+    Example:
+
+        >>> out = []
+        >>> renderer = HtmlRenderer(out.append)
+        >>> for line in ['# 1 task', '', 'Say *hello*.', '', '```sh', 'echo a<b',
+        ...              '```']:
+        ...     renderer.feed(line)
+        >>> renderer.close()
+        >>> print(''.join(out), end='')
+        <h1 id="task">1 task</h1>
+        <p>Say <em>hello</em>.</p>
+        <pre class="sh"><code>echo a&lt;b</code></pre>
+    """
+
+    def __init__(self, write):
+        self.write = write
+        self.identifiers = Identifiers()
+        self.paragraph = []
+        self.fence = None  # fence string while in a fenced code block
+        self.code = None  # lines of the current code block
+        self.indented_code = None
+        self.lists = []  # indentation of open lists
+        self.table = None  # (aligns, header cells) of the current table
+        self.pending_table_header = None
+
+    # -- blocks ------------------------------------------------------------
+
+    def _close_paragraph(self):
+        if self.pending_table_header is not None:
+            self.paragraph.append(self.pending_table_header)
+            self.pending_table_header = None
+        if self.paragraph:
+            self.write("<p>{}</p>\n".format(inline_html("\n".join(self.paragraph))))
+            self.paragraph = []
+
+    def _close_indented_code(self):
+        if self.indented_code is not None:
+            lines = self.indented_code
+            while lines and not lines[-1].strip():
+                lines.pop()
+            self.write(
+                "<pre><code>{}</code></pre>\n".format(
+                    html.escape("\n".join(lines), quote=False)
+                )
+            )
+            self.indented_code = None
+
+    def _close_lists(self, indent=-1):
+        while self.lists and self.lists[-1] > indent:
+            self.lists.pop()
+            self.write("</li>\n</ul>\n")
+
+    def _close_table(self):
+        if self.table is not None:
+            self.write("</tbody>\n</table>\n")
+            self.table = None
+
+    def _close_blocks(self):
+        self._close_paragraph()
+        self._close_indented_code()
+        self._close_lists()
+        self._close_table()
+
+    def _table_row(self, cells, tag):
+        aligns = self.table[0]
+        row = []
+        for index, cell in enumerate(cells):
+            align = aligns[index] if index < len(aligns) else None
+            style = ' style="text-align: {};"'.format(align) if align else ""
+            row.append(
+                "<{tag}{style}>{cell}</{tag}>".format(
+                    tag=tag, style=style, cell=inline_html(cell)
+                )
+            )
+        return "<tr>\n" + "\n".join(row) + "\n</tr>\n"
+
+    # -- public interface --------------------------------------------------
+
+    def feed(self, line):
+        """Render the next Markdown ``line`` (without line break)."""
+        line = line.rstrip("\n")
+
+        if self.fence is not None:
+            if line.strip().startswith(self.fence) and not line.strip().strip(
+                self.fence[0]
+            ):
+                self.write(
+                    "{}</code></pre>\n".format(
+                        html.escape("\n".join(self.code), quote=False)
+                    )
+                )
+                self.fence = None
+                self.code = None
+            else:
+                self.code.append(line)
+            return
+
+        if self.indented_code is not None:
+            if line.startswith("    ") or not line.strip():
+                self.indented_code.append(line[4:])
+                return
+            self._close_indented_code()
+
+        if self.table is not None:
+            if line.strip().startswith("|") or (
+                "|" in line and line.strip() and not self.lists
+            ):
+                self.write(self._table_row(_table_cells(line), "td"))
+                return
+            self._close_table()
+
+        if self.pending_table_header is not None:
+            header = self.pending_table_header
+            self.pending_table_header = None
+            if TABLE_SEPARATOR_REGEX.match(line.strip()):
+                self._close_paragraph()
+                self.table = (_table_aligns(line), None)
+                self.write("<table>\n<thead>\n")
+                self.write(self._table_row(_table_cells(header), "th"))
+                self.write("</thead>\n<tbody>\n")
+                return
+            self.paragraph.append(header)
+
+        if not line.strip():
+            self._close_paragraph()
+            return
+
+        fence = FENCE_REGEX.match(line)
+        if fence:
+            self._close_blocks()
+            self.fence = fence.group(1)
+            self.code = []
+            language = fence.group(2)
+            self.write(
+                '<pre class="{}"><code>'.format(language) if language else "<pre><code>"
+            )
+            return
+
+        heading = HEADING_REGEX.match(line)
+        if heading:
+            self._close_blocks()
+            level = len(heading.group(1))
+            text = heading.group(2)
+            self.write(
+                '<h{level} id="{id}">{text}</h{level}>\n'.format(
+                    level=level, id=self.identifiers(text), text=inline_html(text)
+                )
+            )
+            return
+
+        if HR_REGEX.match(line) and not self.paragraph:
+            self._close_blocks()
+            self.write("<hr />\n")
+            return
+
+        item = LIST_ITEM_REGEX.match(line)
+        if item and (not self.paragraph or self.lists):
+            self._close_paragraph()
+            indent = len(item.group(1))
+            if self.lists and indent > self.lists[-1]:
+                self.write("\n<ul>\n<li>")
+                self.lists.append(indent)
+            else:
+                self._close_lists(indent)
+                if self.lists:
+                    self.write("</li>\n<li>")
+                else:
+                    self._close_blocks()
+                    self.write("<ul>\n<li>")
+                    self.lists.append(indent)
+            self.write(inline_html(item.group(2)))
+            return
+
+        if self.lists:
+            if line.startswith(" "):
+                # continuation of a list item
+                self.write("\n" + inline_html(line.strip()))
+                return
+            self._close_lists()
+
+        if line.startswith("    ") and not self.paragraph:
+            self._close_blocks()
+            self.indented_code = [line[4:]]
+            return
+
+        if "|" in line and not self.paragraph:
+            self.pending_table_header = line
+            return
+
+        self.paragraph.append(line)
+
+    def close(self):
+        """Close all open blocks."""
+        if self.fence is not None:
+            self.feed(self.fence)
+        self._close_blocks()
+
+
+def render_html_body(lines, write):
+    """Render an iterable of Markdown ``lines`` to HTML."""
+    renderer = HtmlRenderer(write)
+    for line in lines:
+        renderer.feed(line)
+    renderer.close()
+
+
+def html_head(title, css_url="", extra=""):
+    """Return the beginning of a standalone HTML document up to ``<body>``.
+
+    :param str css_url:
+        Optional path of a CSS file which is embedded.
+
+    :param str extra:
+        Optional additional lines of the ``<head>`` element.
+    """
+    head = (
+        "<!DOCTYPE html>\n"
+        '<html xmlns="http://www.w3.org/1999/xhtml" lang="" xml:lang="">\n'
+        "<head>\n"
+        '  <meta charset="utf-8" />\n'
+        '  <meta name="generator" content="fabsetup" />\n'
+        '  <meta name="viewport" content="width=device-width, '
+        'initial-scale=1.0, user-scalable=yes" />\n'
+        "{extra}"
+        "  <title>{title}</title>\n"
+        "  <style>\n{style}  </style>\n".format(
+            extra=extra, title=html.escape(title), style=HEAD_STYLE
+        )
+    )
+    if css_url:
+        with open(os.path.expanduser(css_url), "r") as fh_css:
+            head += "  <style>\n{}  </style>\n".format(fh_css.read())
+    return head + "</head>\n<body>\n"
+
+
+def create_html(filename_from, filename_to, css_url="", inline=False, after_body=""):
+    """From a Markdown file create an HTML file like
+    `fabsetup.utils.pandoc.Pandoc.create_html()` does.
+
+    If ``inline`` is ``True`` a standalone HTML document with the CSS file
+    embedded is created, else only the HTML fragment (as pandoc does without
+    ``--standalone``).
+
+    :param str after_body:
+        Path of a file whose content is included after the body.
+    """
+    import fabsetup.utils.outfile
+
+    fname_from = os.path.abspath(os.path.expanduser(filename_from))
+    fname_to = os.path.abspath(os.path.expanduser(filename_to))
+    os.makedirs(os.path.dirname(fname_to), exist_ok=True)
+
+    fh_in = fabsetup.utils.outfile.open_outfile(fname_from, "r")
+    with fh_in, open(fname_to, "w") as fh_out:
+
+        if inline:
+            fh_out.write(html_head(pathlib.Path(fname_to).stem, css_url))
+
+        render_html_body(fh_in, fh_out.write)
+
+        if after_body:
+            with open(after_body, "r") as fh_after:
+                fh_out.write(fh_after.read())
+
+        if inline:
+            fh_out.write("</body>\n</html>\n")
+
+    return True
+
+
+LIVE_SCRIPT = """\
+  <script>
+  // reload the body while the run is in progress, keep scroll position and
+  // collapsed code blocks; stop when the live meta tag has been removed
+  (function () {
+    var key = 'fabsetup-live:' + location.pathname;
+    function getState() {
+      var items = document.getElementsByClassName('sh');
+      var heights = [];
+      for (var i = 0; i < items.length; i++) {
+        heights.push(items[i].style.height);
+      }
+      return {x: window.scrollX, y: window.scrollY, heights: heights,
+              cur_height: window.cur_height};
+    }
+    function setState(state) {
+      var items = document.getElementsByClassName('sh');
+      for (var i = 0; i < items.length && i < state.heights.length; i++) {
+        if (state.heights[i]) {
+          items[i].style.height = state.heights[i];
+        }
+      }
+      if (state.cur_height) {
+        window.cur_height = state.cur_height;
+      }
+      window.scrollTo(state.x, state.y);
+    }
+    function replaceBody(text) {
+      var state = getState();
+      var doc = new DOMParser().parseFromString(text, 'text/html');
+      document.body.innerHTML = doc.body.innerHTML;
+      // scripts inserted by innerHTML are not executed
+      var scripts = document.body.getElementsByTagName('script');
+      for (var i = 0; i < scripts.length; i++) {
+        var script = document.createElement('script');
+        script.text = scripts[i].text;
+        scripts[i].parentNode.replaceChild(script, scripts[i]);
+      }
+      setState(state);
+      return doc.querySelector('meta[name="fabsetup-live"]') !== null;
+    }
+    window.addEventListener('load', function () {
+      var state = sessionStorage.getItem(key);
+      if (state) {
+        sessionStorage.removeItem(key);
+        setState(JSON.parse(state));
+      }
+      var live = document.querySelector('meta[name="fabsetup-live"]');
+      if (!live) {
+        return;
+      }
+      var timer = setInterval(function () {
+        fetch(location.href, {cache: 'no-store'})
+          .then(function (response) { return response.text(); })
+          .then(function (text) {
+            if (!replaceBody(text)) {
+              clearInterval(timer);
+            }
+          })
+          .catch(function () {
+            // browsers which do not fetch() file:// URLs reload the page
+            clearInterval(timer);
+            sessionStorage.setItem(key, JSON.stringify(getState()));
+            location.reload();
+          });
+      }, 1000 * live.content);
+    });
+  })();
+  </script>
+"""
+
+
+class LiveHtml:
+    """Render an HTML file while its Markdown source is being written.
+
+    The Markdown is fed in arbitrary pieces (cf.
+    `fabsetup.utils.outfile.OutfileBuffer`).  Each time a heading starts a
+    new section the HTML of the completed sections is written to the file,
+    followed by the ``after_body`` content and the closing tags.  So at
+    every point the file is a complete HTML document with a working
+    collapse / expand script.  The tail is overwritten by the next section.
+
+    While the run is in progress a script fetches the page every
+    ``refresh`` seconds and replaces the body, the scroll position and the
+    collapsed code blocks are kept.  `close()` removes the ``fabsetup-live``
+    meta tag which stops the reloading.
+
+    :param str filename:
+        Path of the HTML file, parent dirs are created if required.
+
+    :param str css_url:
+        Optional path of a CSS file which is embedded.
+
+    :param str after_body:
+        Optional path of a file whose content is included after the body.
+
+    :param int refresh:
+        Reload interval of the page in seconds.
+
+    :param str preamble:
+        Markdown rendered at the beginning of the body, replaced by the
+        ``header`` argument of `close()`.
+
+    :param int header_size:
+        Bytes reserved after the ``preamble`` for the HTML of the ``header``
+        in order to write it in place.  A bigger header requires `close()` to
+        copy the whole file.
+    """
+
+    def __init__(
+        self,
+        filename,
+        css_url="",
+        after_body="",
+        refresh=5,
+        preamble="",
+        header_size=HEADER_SIZE,
+    ):
+        fname = os.path.abspath(os.path.expanduser(filename))
+        self.filename = fname
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+
+        self.tail = b"</body>\n</html>\n"
+        if after_body:
+            with open(after_body, "rb") as fh_after:
+                self.tail = fh_after.read() + self.tail
+
+        self.live = '  <meta name="fabsetup-live" content="{}" />\n'.format(
+            refresh
+        ).encode()
+        head = html_head(pathlib.Path(fname).stem, css_url, extra=LIVE_SCRIPT).encode()
+        self.live_offset = head.index(b"  <title>")
+
+        self.fh = open(fname, "w+b")
+        self.fh.write(head[: self.live_offset] + self.live + head[self.live_offset :])
+        self.header_offset = self.fh.tell()
+        self.chunks = []
+        if preamble:
+            render_html_body(preamble.splitlines(), self.chunks.append)
+        self.chunks.append(" " * header_size + "\n")
+        self.renderer = HtmlRenderer(self.chunks.append)
+        self.pending = ""  # incomplete last line
+        self._write_sections()
+        self.body_offset = self.fh.tell()
+
+    def feed(self, text):
+        """Render the complete lines of ``text``."""
+        lines = (self.pending + text).split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            section_starts = self.renderer.fence is None and line.startswith("#")
+            if section_starts:
+                # close the blocks of the completed section
+                self.renderer.close()
+                self._write_sections()
+            self.renderer.feed(line)
+
+    def _write_sections(self):
+        if self.chunks:
+            self.fh.write("".join(self.chunks).encode())
+            self.chunks.clear()
+        position = self.fh.tell()
+        self.fh.write(self.tail)
+        self.fh.truncate()
+        self.fh.flush()
+        self.fh.seek(position)
+
+    def close(self, header=None):
+        """Render the rest, write the tail and stop the page reloading.
+
+        :param str header:
+            Optional Markdown which replaces the ``preamble``, e.g. the
+            executed command with its exit code and the table of contents.
+        """
+        if self.fh is None:
+            return
+        if self.pending:
+            self.renderer.feed(self.pending)
+            self.pending = ""
+        self.renderer.close()
+        self._write_sections()
+        self.fh.seek(self.live_offset)
+        self.fh.write(b" " * (len(self.live) - 1) + b"\n")
+        if header is not None:
+            chunks = []
+            render_html_body(header.splitlines(), chunks.append)
+            header_html = "".join(chunks).encode()
+            space = self.body_offset - self.header_offset - 1
+            if len(header_html) <= space:
+                self.fh.seek(self.header_offset)
+                self.fh.write(header_html.ljust(space) + b"\n")
+            else:
+                self._replace_header(header_html)
+        self.fh.close()
+        self.fh = None
+
+    def _replace_header(self, header_html):
+        # copy the sections in chunks into a new file behind the header
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "wb") as fh_tmp:
+            self.fh.seek(0)
+            fh_tmp.write(self.fh.read(self.header_offset) + header_html)
+            self.fh.seek(self.body_offset)
+            shutil.copyfileobj(self.fh, fh_tmp)
+        os.replace(tmp_filename, self.filename)
+
+
+class TableOfContents:
+    """Collect the headings of Markdown text which is fed in arbitrary
+    pieces, e.g. while it is written into the outfile.
+
+    Lines of fenced code blocks are skipped.
+
+    Example:
+
+        >>> toc = TableOfContents()
+        >>> toc.feed('# 1 task\\n```\\n# no heading\\n```\\n## 1.1 sub')
+        >>> toc.feed('task\\n')
+        >>> print(toc.markdown(), end='')
+        -   [1 task](#task)
+            -   [1.1 subtask](#subtask)
+    """
+
+    def __init__(self):
+        self.headings = []  # (level, text)
+        self.pending = ""  # incomplete last line
+        self.fence = None
+
+    def feed(self, text):
+        """Collect the headings of ``text``."""
+        text = self.pending + text
+        if "#" not in text and "```" not in text and "~~~" not in text:
+            # fast path: no heading and no fence
+            self.pending = text.rpartition("\n")[2]
+            return
+        lines = text.split("\n")
+        self.pending = lines.pop()
+        for line in lines:
+            if line.startswith(("#", "```", "~~~")):
+                self._add_line(line)
+
+    def _add_line(self, line):
+        fence = FENCE_REGEX.match(line)
+        if self.fence is not None:
+            if fence and line.startswith(self.fence):
+                self.fence = None
+        elif fence:
+            self.fence = fence.group(1)
+        else:
+            heading = HEADING_REGEX.match(line)
+            if heading:
+                self.headings.append((len(heading.group(1)), heading.group(2)))
+
+    def close(self):
+        """Collect the heading of an incomplete last line."""
+        if self.pending:
+            self._add_line(self.pending)
+            self.pending = ""
+
+    def markdown(self, toc_depth=6):
+        """Return the table of contents as nested Markdown list of links to
+        the headings, or an empty string if there are no headings."""
+        identifiers = Identifiers()
+        toc = [
+            (level, text, identifiers(text))
+            for level, text in self.headings
+            if level <= toc_depth
+        ]
+        if not toc:
+            return ""
+        min_level = min(level for level, _, _ in toc)
+        return "".join(
+            "{}-   [{}](#{})\n".format("    " * (level - min_level), text, identifier)
+            for level, text, identifier in toc
+        )
+
+
+def add_toc(filename, toc_depth=6):
+    """Add a table of contents (a nested list of links to the headings) to
+    the Markdown file ``filename`` (inplace).
+    """
+    import fabsetup.utils.outfile
+
+    fname = os.path.abspath(os.path.expanduser(filename))
+    toc = TableOfContents()
+    with fabsetup.utils.outfile.open_outfile(fname, "r") as fh:
+        for line in fh:
+            toc.feed(line)
+    toc.close()
+
+    toc_markdown = toc.markdown(toc_depth)
+    if toc_markdown:
+        fabsetup.utils.outfile.prepend_to_file(fname, toc_markdown + "\n")
+    return True
@@ -1,12 +1,27 @@
 """While preserving output handles write stdout and stderr to outfile."""
 
+import codecs
+import collections
+import contextlib
 import fileinput
+import functools
+import gzip
+import itertools
 import os
 import os.path
 import re
+import shutil
 import sys
+import tempfile
+import threading
+
+try:
+    import contextvars
+except ImportError:  # Python < 3.7
+    contextvars = None
 
 import fabsetup.utils.colors
+import fabsetup.utils.markdown
 
 
 # Adapted from:
@@ -36,6 +51,10 @@ class stream_tee:
         Optionally define lines which woud not prepended by a prefix when
         written.
 
+    :param callable stream2_filter:
+        Optionally set a function which is applied on each text written to
+        stream2, e.g. a ``ColorCodeFilter``.
+
     :returns:
         `stream1` wrapper which applies the tee feature.
 
@@ -75,6 +94,13 @@ class stream_tee:
         ]  # put no prefix on empty strings without newline at the end
         self.add_prefix = False
 
+        self.stream2_filter = kwargs.get("stream2_filter", None)
+
+    def flush_stream2_filter(self):
+        """Write text held back by ``stream2_filter`` (if any) to stream2."""
+        if self.stream2_filter and hasattr(self.stream2_filter, "flush"):
+            self.stream2.write(self.stream2_filter.flush())
+
     def __getattribute__(self, name):
         return object.__getattribute__(self, name)
 
@@ -87,19 +113,22 @@ class stream_tee:
         # hook into callable2
 
         callable2 = getattr(self.stream2, self.__missing_method_name)
+        args2 = args
+        if self.stream2_filter and self.__missing_method_name == "write":
+            args2 = (self.stream2_filter(args[0]),) + args[1:]
         prefix = self.stream2_line_prefix
         if self.add_prefix and self.__missing_method_name == "write" and prefix:
             callable2(
                 "".join(
                     "{}{}\n".format(prefix, line)
-                    for line in args[0].split("\n")
+                    for line in args2[0].split("\n")
                     if line not in self.stream2_no_prefix_lines
                 ),
-                *args[1:],
+                *args2[1:],
                 **kwargs,
             )
         else:
-            callable2(*args, **kwargs)
+            callable2(*args2, **kwargs)
 
         # apply method to callable1
 
@@ -113,6 +142,428 @@ class stream_tee:
         return callable1(*args, **kwargs)
 
 
+def _prefix_lines(text, prefix, no_prefix_lines):
+    return "".join(
+        "{}{}\n".format(prefix, line)
+        for line in text.split("\n")
+        if line not in no_prefix_lines
+    )
+
+
+class OutfileBuffer:
+    """Thread-safe write buffer in front of a filehandle.
+
+    Texts are collected until ``buffer_size`` characters are pending and then
+    written to ``stream`` at once.  An ``OutfileBuffer`` can be shared by
+    several ``buffered_stream_tee`` instances (e.g. for stdout and stderr),
+    they synchronize on its ``lock`` so the order of the texts is kept.
+
+    :param typing.TextIO stream:
+        Filehandle to write to.
+
+    :param int buffer_size:
+        Number of characters to collect before writing to ``stream``.
+
+    :param callable on_text:
+        Optionally called with each text in the order the texts are written,
+        e.g. ``fabsetup.utils.markdown.TableOfContents.feed``.
+    """
+
+    def __init__(self, stream, buffer_size=64 * 1024, on_text=None):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.on_text = on_text
+        self.lock = threading.RLock()
+        self.chunks = []
+        self.size = 0
+
+    def write(self, text):
+        with self.lock:
+            if self.on_text:
+                self.on_text(text)
+            self.chunks.append(text)
+            self.size += len(text)
+            if self.size >= self.buffer_size:
+                self._write_chunks()
+        return len(text)
+
+    def _write_chunks(self):
+        if self.chunks:
+            self.stream.write("".join(self.chunks))
+            self.chunks = []
+            self.size = 0
+
+    def flush(self):
+        """Write pending texts to ``stream`` and flush it."""
+        with self.lock:
+            self._write_chunks()
+            self.stream.flush()
+
+
+class HostOutfiles:
+    """Route the texts written to the outfile into one outfile per host
+    (cf. ``outfile.per_host``).
+
+    Used as ``stream2`` of the ``buffered_stream_tee`` instances of `Tee`.
+    Within `host()` the texts are written to the outfile of that host, else
+    to the ``index`` (the outfile of the run).  The outfile of a host is
+    created on its first text.
+
+    :param callable filename_of:
+        Returns the path of the outfile of a host.
+
+    Example:
+
+        >>> import io, tempfile
+        >>> directory = tempfile.mkdtemp()
+        >>> outfiles = HostOutfiles(lambda host: os.path.join(directory, host))
+        >>> index = io.StringIO()
+        >>> outfiles.open(OutfileBuffer(index))
+        >>> with outfiles.host('web1'):
+        ...     _ = outfiles.write('output of web1')
+        >>> _ = outfiles.write('output of the run')
+        >>> outfiles.status('web1', failed=True)
+        >>> outfiles.flush()
+        >>> outfiles.close()
+        >>> index.getvalue()
+        'output of the run'
+        >>> open(os.path.join(directory, 'web1')).read()
+        'output of web1'
+        >>> print(outfiles.index_markdown(directory))
+        | Host | Status | Outfile |
+        | ---- | ------ | ------- |
+        | web1 | failed | [web1](web1) |
+        <BLANKLINE>
+    """
+
+    def __init__(self, filename_of):
+        self.filename_of = filename_of
+        self.lock = threading.RLock()
+        self.index = None
+        self.current = None
+        self.filenames = {}  # host -> filename, in order of the first text
+        self.statuses = {}  # host -> 'ok' or 'failed'
+        self.handles = {}
+        self.buffers = {}
+
+    def open(self, index):
+        """Write texts written outside of `host()` to the `OutfileBuffer`
+        ``index``."""
+        with self.lock:
+            self.index = index
+
+    def _buffer(self, host):
+        if host not in self.buffers:
+            append = host in self.filenames
+            if not append:
+                self.filenames[host] = self.filename_of(host)
+            filename = self.filenames[host]
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            self.handles[host] = open_outfile(filename, "a" if append else "w")
+            self.buffers[host] = OutfileBuffer(self.handles[host])
+        return self.buffers[host]
+
+    def write(self, text):
+        with self.lock:
+            if self.current is None:
+                return self.index.write(text)
+            if not text:
+                return 0
+            return self._buffer(self.current).write(text)
+
+    def flush(self):
+        with self.lock:
+            for buffer in self.buffers.values():
+                buffer.flush()
+            self.index.flush()
+
+    def close(self):
+        """Flush and close the outfiles of the hosts, the ``index`` is not
+        closed."""
+        with self.lock:
+            for host, buffer in self.buffers.items():
+                buffer.flush()
+                self.handles[host].close()
+            self.handles = {}
+            self.buffers = {}
+
+    @contextlib.contextmanager
+    def host(self, host):
+        """Within this context write texts to the outfile of ``host``."""
+        with self.lock:
+            previous, self.current = self.current, host
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.current = previous
+
+    def status(self, host, failed):
+        """Record the status of an execution on ``host``, a host stays
+        ``'failed'`` once an execution on it has failed."""
+        with self.lock:
+            if failed or self.statuses.get(host) != "failed":
+                self.statuses[host] = "failed" if failed else "ok"
+
+    def index_markdown(self, directory, links=None):
+        """Return a Markdown table of the hosts with their status and a link
+        to their outfile relative to ``directory``.
+
+        :param dict links:
+            Optionally link to other files than the outfiles, e.g. to the
+            HTML files rendered from them, ``{outfile: path}``.
+        """
+        links = links or {}
+        lines = ["| Host | Status | Outfile |", "| ---- | ------ | ------- |"]
+        for host in list(self.filenames) + [
+            host for host in self.statuses if host not in self.filenames
+        ]:
+            filename = self.filenames.get(host)
+            link = ""
+            if filename:
+                target = links.get(filename, filename)
+                relpath = os.path.relpath(target, directory)
+                link = "[{}]({})".format(os.path.basename(target), relpath)
+            lines.append(
+                "| {} | {} | {} |".format(host, self.statuses.get(host, ""), link)
+            )
+        return "\n".join(lines) + "\n"
+
+
+class OutputLimiter:
+    """Keep only the first ``head`` and the last ``tail`` lines of a stream
+    of texts, e.g. of the output of a command written to the outfile.
+
+    If lines are omitted a note is put between head and tail and, if
+    ``spill_filename`` is given, the complete text is written to this file
+    (cf. `open_outfile()`).
+
+    Example:
+
+        >>> limiter = OutputLimiter(head=2, tail=1)
+        >>> limiter('1\\n2\\n3\\n') + limiter('4\\n5\\n') + limiter.close()
+        '1\\n2\\n[... 2 lines omitted ...]\\n5\\n'
+    """
+
+    def __init__(self, head, tail, spill_filename=None):
+        self.head = head
+        self.tail = collections.deque(maxlen=tail)
+        self.lines = 0  # number of complete lines passed through as head
+        self.partial = ""  # incomplete last line after the head
+        self.omitted = 0
+        self.head_texts = []
+        self.spill_filename = spill_filename
+        self.spill = None
+
+    def __call__(self, text):
+        """Return the part of ``text`` to be written."""
+        if self.spill:
+            self.spill.write(text)
+        head = ""
+        if self.lines < self.head:
+            newlines = text.count("\n")
+            if self.lines + newlines < self.head or (
+                self.lines + newlines == self.head and text.endswith("\n")
+            ):
+                self.lines += newlines
+                if self.spill_filename:
+                    self.head_texts.append(text)
+                return text
+            index = -1
+            for _ in range(self.head - self.lines):
+                index = text.index("\n", index + 1)
+            self.lines = self.head
+            head, text = text[: index + 1], text[index + 1 :]
+            self._start_spill(head + text)
+        elif self.spill_filename and not self.spill:
+            self._start_spill(text)
+
+        lines = (self.partial + text).split("\n")
+        self.partial = lines.pop()
+        dropped = len(self.tail) + len(lines) - self.tail.maxlen
+        if dropped > 0:
+            self.omitted += dropped
+        self.tail.extend(lines)
+        return head
+
+    def _start_spill(self, text):
+        self.head_texts.append(text)
+        if self.spill_filename:
+            os.makedirs(os.path.dirname(self.spill_filename), exist_ok=True)
+            self.spill = open_outfile(self.spill_filename, "w")
+            self.spill.write("".join(self.head_texts))
+        self.head_texts = []
+
+    def close(self):
+        """Return the held back tail, preceded by a note if lines have been
+        omitted."""
+        note = ""
+        if self.spill:
+            self.spill.close()
+            if self.omitted:
+                note = "[... {} lines omitted, full output: {} ...]\n".format(
+                    self.omitted, self.spill_filename
+                )
+            else:
+                os.unlink(self.spill_filename)
+        elif self.omitted:
+            note = "[... {} lines omitted ...]\n".format(self.omitted)
+        tail = "".join(line + "\n" for line in self.tail)
+        self.tail.clear()
+        return note + tail + self.partial
+
+
+class buffered_stream_tee:
+    """Tee `stream1` to `stream2` with explicit ``write()``, ``writelines()``
+    and ``flush()`` methods.
+
+    Has the same parameters and prefix attributes (``add_prefix``,
+    ``stream2_line_prefix``) as `stream_tee` but does not dispatch every call
+    through ``__getattr__``.  Optionally, the callable ``on_write`` is called
+    with the length of each written text.  The bytes written to ``buffer``
+    (like ``sys.stdout.buffer``) are decoded and written by ``write()``,
+    too.  Other attributes are looked up on ``stream1`` only, so writes to
+    its file descriptor (``fileno()``) bypass stream2.  The texts for
+    stream2 could be truncated by an `OutputLimiter` (cf.
+    `set_stream2_limiter()`).
+
+    Writes to both streams are done under a lock (the ``lock`` of ``stream2``
+    if it is an ``OutfileBuffer``), so concurrent writers produce the same
+    order of texts on both streams.  The ``stream2_filter`` is applied under
+    this lock, too.  ``flush()`` only flushes ``stream1``, the texts for
+    ``stream2`` are written when its buffer is full or on ``flush_stream2()``.
+
+    Example:
+
+        >>> import io
+        >>> stream1, stream2 = io.StringIO(), io.StringIO()
+        >>> tee = buffered_stream_tee(stream1, OutfileBuffer(stream2))
+        >>> tee.writelines(["foo\\n", "bar\\n"])
+        >>> stream1.getvalue(), stream2.getvalue()
+        ('foo\\nbar\\n', '')
+        >>> tee.flush_stream2()
+        >>> stream2.getvalue()
+        'foo\\nbar\\n'
+    """
+
+    def __init__(self, stream1, stream2, **kwargs):
+        self.stream1 = stream1
+        self.stream2 = stream2
+        self.lock = getattr(stream2, "lock", None) or threading.RLock()
+
+        self.stream1_color = kwargs.get("stream1_color", None)
+
+        self.stream2_line_prefix = kwargs.get("stream2_line_prefix", None)
+        self.stream2_no_prefix_lines = set(
+            kwargs.get("stream2_no_prefix_lines", []) + [""]
+        )  # put no prefix on empty strings without newline at the end
+        self.add_prefix = False
+
+        self.stream2_filter = kwargs.get("stream2_filter", None)
+        self.stream2_limiter = None
+        self.on_write = kwargs.get("on_write", None)
+        self._buffer = None
+
+    def write(self, text):
+        if self.on_write:
+            self.on_write(len(text))
+        text1 = self.stream1_color(text) if self.stream1_color else text
+        with self.lock:
+            # the stream2_filter holds back incomplete color codes, so it has
+            # to see the texts in the order they are written to stream2
+            text2 = text
+            if self.stream2_filter:
+                text2 = self.stream2_filter(text2)
+            if self.add_prefix and self.stream2_line_prefix:
+                text2 = _prefix_lines(
+                    text2, self.stream2_line_prefix, self.stream2_no_prefix_lines
+                )
+            if self.stream2_limiter:
+                text2 = self.stream2_limiter(text2)
+            self.stream2.write(text2)
+            return self.stream1.write(text1)
+
+    def set_stream2_limiter(self, limiter):
+        """Pass the texts for stream2 through the `OutputLimiter` ``limiter``
+        (or stop it with ``None``)."""
+        with self.lock:
+            self.stream2_limiter = limiter
+
+    def close_stream2_limiter(self):
+        """Write the texts held back by the current ``stream2_limiter`` to
+        stream2 and stop it."""
+        with self.lock:
+            if self.stream2_limiter:
+                self.stream2.write(self.stream2_limiter.close())
+                self.stream2_limiter = None
+
+    def writelines(self, lines):
+        self.write("".join(lines))
+
+    def flush(self):
+        self.stream1.flush()
+
+    def flush_stream2(self):
+        """Write text held back by ``stream2_filter`` (if any) to stream2 and
+        flush stream2."""
+        with self.lock:
+            self.flush_stream2_filter()
+            self.stream2.flush()
+
+    def flush_stream2_filter(self):
+        """Write text held back by ``stream2_filter`` (if any) to stream2."""
+        if self.stream2_filter and hasattr(self.stream2_filter, "flush"):
+            with self.lock:
+                self.stream2.write(self.stream2_filter.flush())
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            self._buffer = _BinaryTee(self)
+        return self._buffer
+
+    def __getattr__(self, name):
+        return getattr(self.stream1, name)
+
+
+class _BinaryTee:
+    """Binary interface of a `buffered_stream_tee` (cf. ``sys.stdout.buffer``).
+
+    Example:
+
+        >>> import io
+        >>> stream1, stream2 = io.StringIO(), io.StringIO()
+        >>> tee = buffered_stream_tee(stream1, OutfileBuffer(stream2))
+        >>> tee.buffer.write('ä\\n'.encode()[:1])
+        1
+        >>> tee.buffer.write('ä\\n'.encode()[1:])
+        2
+        >>> tee.flush_stream2()
+        >>> stream1.getvalue(), stream2.getvalue()
+        ('ä\\n', 'ä\\n')
+    """
+
+    def __init__(self, tee):
+        self.tee = tee
+        # keeps incomplete multibyte sequences until the next write
+        self.decoder = codecs.getincrementaldecoder(
+            getattr(tee.stream1, "encoding", None) or "utf-8"
+        )(errors="replace")
+
+    def write(self, data):
+        self.tee.write(self.decoder.decode(bytes(data)))
+        return len(data)
+
+    def writelines(self, lines):
+        self.write(b"".join(lines))
+
+    def flush(self):
+        self.tee.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.tee.stream1.buffer, name)
+
+
 # Adapted from this discussion on how to create a singleton in Python:
 # https://stackoverflow.com/q/6760685
 class Singleton(type):
@@ -150,7 +601,24 @@ class Tee(metaclass=Singleton):
         self.outfile_stdout_no_prefix_lines = []
         self.outfile_stderr_line_prefix = None
 
-    def set_outfile(self, filename, prefix=""):
+        self.strip_color_codes = False
+        self.on_write = None
+        self.toc = None
+        self.outfile_observers = []
+        self.spill_count = itertools.count(1)
+        self.outfile_buffer = None
+        self.stdout_tee = None
+        self.stderr_tee = None
+        self.host_outfiles = None
+
+    def set_outfile(
+        self,
+        filename,
+        prefix="",
+        strip_color_codes=False,
+        toc=False,
+        host_outfiles=None,
+    ):
         """Define the outfile where stdout and stderr will be written to.
 
         Recursively create parent dirs of ``filename`` if they not exist.
@@ -158,12 +626,34 @@ class Tee(metaclass=Singleton):
         If the outfile already exists it will be overwritten.
 
         :param str `filename`:
+            If it ends with ``.gz`` or ``.zst`` the outfile is written
+            through a streaming compressor (cf. `open_outfile()`).
 
         :param str `prefix`:
             Optionally write `prefix` to outfile at first.
+
+        :param bool `strip_color_codes`:
+            If ``True`` remove ANSI color codes from the output while it is
+            written to the outfile.
+
+        :param bool `toc`:
+            If ``True`` collect the headings written to the outfile in a
+            `fabsetup.utils.markdown.TableOfContents` (``self.toc``).
+
+        :param HostOutfiles `host_outfiles`:
+            If given the output written within `host_outfile()` goes into
+            the outfile of that host instead of ``filename``.
+
+        Further callables which get each text written to the outfile could
+        be added to ``self.outfile_observers`` before `start()`.
         """
         self.outfile_name = filename
         self.prefix = prefix
+        self.strip_color_codes = strip_color_codes
+        self.toc = fabsetup.utils.markdown.TableOfContents() if toc else None
+        self.outfile_observers = [self.toc.feed] if toc else []
+        self.spill_count = itertools.count(1)
+        self.host_outfiles = host_outfiles
 
         os.makedirs(
             os.path.dirname(os.path.abspath(os.path.expanduser(filename))),
@@ -179,43 +669,139 @@ class Tee(metaclass=Singleton):
             self.default_stdout = sys.stdout
             self.default_stderr = sys.stderr
 
-            self.outfile_handle = open(self.outfile_name, mode)
+            self.outfile_handle = open_outfile(self.outfile_name, mode)
+            self.outfile_buffer = OutfileBuffer(
+                self.outfile_handle,
+                on_text=self._notify_observers if self.outfile_observers else None,
+            )
+            stream2 = self.outfile_buffer
+            if self.host_outfiles:
+                self.host_outfiles.open(self.outfile_buffer)
+                stream2 = self.host_outfiles
 
-            sys.stdout = stream_tee(
+            self.stdout_tee = buffered_stream_tee(
                 sys.stdout,
-                self.outfile_handle,
+                stream2,
                 # stream2_line_prefix="(stdout) ",
+                stream2_filter=self._color_code_filter(),
+                on_write=self._write_observer("stdout"),
             )
             # TODO: configurable errstream color
-            sys.stderr = stream_tee(
+            self.stderr_tee = buffered_stream_tee(
                 sys.stderr,
-                self.outfile_handle,
+                stream2,
                 stream1_color=fabsetup.utils.colors.red,
                 # stream2_line_prefix="(STDERR) ",
+                stream2_filter=self._color_code_filter(),
+                on_write=self._write_observer("stderr"),
             )
+            sys.stdout = self.stdout_tee
+            sys.stderr = self.stderr_tee
+
+    def _notify_observers(self, text):
+        for observer in self.outfile_observers:
+            observer(text)
+
+    def _write_observer(self, stream_name):
+        if self.on_write is None:
+            return None
+        return functools.partial(self.on_write, stream_name)
+
+    def _color_code_filter(self):
+        if self.strip_color_codes:
+            return ColorCodeFilter()
+        return None
+
+    def _write_outfile(self, text):
+        if self.strip_color_codes:
+            text = remove_color_codes_str(text)
+        (self.host_outfiles or self.outfile_buffer).write(text)
 
     def start(self):
         """Set up stdout, stderr and outfile handles and if given write prefix
         to outfile.
 
-        Uses `fabsetup.utils.outfile.stream_tee()`.
+        Uses `fabsetup.utils.outfile.buffered_stream_tee()`.
         """
         self._start()
 
         if self.prefix:
 
-            self.outfile_handle.write(self.prefix)
+            self._write_outfile(self.prefix)
             self.prefix = None
 
     def stop(self):
         """Reset stdout and stderr to previous handles and close outfile handle."""
         if self.outfile_handle:
 
+            self.stdout_tee.flush_stream2_filter()
+            self.stderr_tee.flush_stream2_filter()
+            self.outfile_buffer.flush()
+            if self.host_outfiles:
+                self.host_outfiles.close()
+
             self.outfile_handle.close()
 
             sys.stdout = self.default_stdout
             sys.stderr = self.default_stderr
 
+    @contextlib.contextmanager
+    def host_outfile(self, host, failed=False):
+        """Within this context write the output into the outfile of ``host``
+        if there is one outfile per host (cf. `HostOutfiles`), else (or if
+        ``host`` is ``None``) into the outfile.
+
+        The execution on ``host`` is recorded as failed if ``failed`` or if
+        an exception is raised within this context.
+        """
+        if host is None or not self.host_outfiles or self.outfile_handle is None:
+            yield
+            return
+        self._flush_stream2_filters()
+        try:
+            with self.host_outfiles.host(host):
+                try:
+                    yield
+                finally:
+                    self._flush_stream2_filters()
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.host_outfiles.status(host, failed)
+
+    def _flush_stream2_filters(self):
+        # write color codes held back by the filters into the current outfile
+        self.stdout_tee.flush_stream2_filter()
+        self.stderr_tee.flush_stream2_filter()
+
+    def output_limiter(self, head, tail, spill=True):
+        """Return an `OutputLimiter` for the output of a command written to
+        the outfile, or ``None`` if no outfile is written or if ``head`` and
+        ``tail`` are ``0``.
+
+        With ``spill`` the complete output is written into a file in the
+        directory ``<outfile>.d`` next to the outfile, compressed like the
+        outfile.
+        """
+        if not self.outfile_handle or self.outfile_handle.closed:
+            return None
+        if not head and not tail:
+            return None
+        spill_filename = None
+        if spill:
+            compression = compression_of(self.outfile_name)
+            stem = self.outfile_name
+            if compression:
+                stem = stem[: -len(COMPRESSION_SUFFIXES[compression])]
+            spill_filename = compressed_name(
+                "{}.d/command-{:04d}.txt".format(
+                    os.path.splitext(stem)[0], next(self.spill_count)
+                ),
+                compression,
+            )
+        return OutputLimiter(head, tail, spill_filename)
+
     def pause(self):
         """Alias for `stop()`"""
         self.stop()
@@ -229,20 +815,529 @@ class Tee(metaclass=Singleton):
         """
         self._start(append=True)
         if self.outfile_handle and missed_output:
-            self.outfile_handle.write(missed_output)
+            self._write_outfile(missed_output)
+
+
+# markers of limiter changes recorded by an ``OutputBuffer``
+_SET_LIMITER = object()
+_CLOSE_LIMITER = object()
+
+
+class OutputBuffer:
+    """Record output written to stdout and stderr in order to replay it
+    later on.
+
+    Each recorded chunk remembers its stream and the line prefix which was
+    active when it was written (cf. ``stream_tee.add_prefix``).
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.prefixes = {"stdout": None, "stderr": None}
+
+    def write(self, stream_name, text):
+        self.chunks.append((stream_name, text, self.prefixes[stream_name]))
+
+    def stream(self, stream_name):
+        """Return a file-like object which writes into this buffer as
+        ``stream_name`` (``'stdout'`` or ``'stderr'``).
+        """
+        return _buffer_stream(self, stream_name)
+
+    def set_limiter(self, stream_name, limiter):
+        self.chunks.append((stream_name, limiter, _SET_LIMITER))
+
+    def close_limiter(self, stream_name):
+        self.chunks.append((stream_name, None, _CLOSE_LIMITER))
+
+    def replay(self, stdout, stderr):
+        """Write all recorded chunks to ``stdout`` and ``stderr``.
+
+        If a target stream is a ``stream_tee`` the recorded line prefixes are
+        re-applied, if it is a ``buffered_stream_tee`` also the recorded
+        output limiters.
+        """
+        streams = {"stdout": stdout, "stderr": stderr}
+        for stream_name, text, prefix in self.chunks:
+            stream = streams[stream_name]
+            if prefix is _SET_LIMITER:
+                if hasattr(stream, "set_stream2_limiter"):
+                    stream.set_stream2_limiter(text)
+                continue
+            if prefix is _CLOSE_LIMITER:
+                if hasattr(stream, "close_stream2_limiter"):
+                    stream.close_stream2_limiter()
+                continue
+            with_prefix = prefix is not None and hasattr(stream, "add_prefix")
+            if with_prefix:
+                stream.add_prefix = True
+                stream.stream2_line_prefix = prefix
+            stream.write(text)
+            if with_prefix:
+                stream.add_prefix = False
+        stdout.flush()
+        stderr.flush()
+        self.chunks = []
+
+
+class _buffer_stream:
+    """File-like writer into an ``OutputBuffer``."""
+
+    def __init__(self, buffer, stream_name):
+        self.buffer = buffer
+        self.stream_name = stream_name
+
+    def write(self, text):
+        self.buffer.write(self.stream_name, text)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class ContextLocal:
+    """Like ``threading.local`` but based on a ``contextvars.ContextVar``.
+
+    Each thread and each asyncio task has its own attributes.  An asyncio
+    task starts with the attributes of its creator, attributes set by it are
+    not visible to its creator.  Used by ``fabsetup.aio`` to buffer the
+    output of asyncio tasks executed concurrently in one thread.  Before
+    Python 3.7 (no ``contextvars``) this is ``threading.local``.
+
+    Example:
+
+        >>> import threading
+        >>> local = ContextLocal()
+        >>> local.name = 'main'
+        >>> def work():
+        ...     local.name = 'thread'
+        >>> thread = threading.Thread(target=work)
+        >>> thread.start(); thread.join()
+        >>> local.name
+        'main'
+    """
+
+    def __init__(self):
+        object.__setattr__(
+            self, "_var", contextvars.ContextVar("ContextLocal-{}".format(id(self)))
+        )
+
+    def _dict(self):
+        return self._var.get({})
+
+    def __getattr__(self, name):
+        try:
+            return self._dict()[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        attributes = dict(self._dict())
+        attributes[name] = value
+        self._var.set(attributes)
+
+    def __delattr__(self, name):
+        attributes = dict(self._dict())
+        if name not in attributes:
+            raise AttributeError(name)
+        del attributes[name]
+        self._var.set(attributes)
+
+
+if contextvars is None:  # Python < 3.7, asyncio tasks are not supported
+    ContextLocal = threading.local  # noqa: F811
+
+
+class stream_demux:
+    """Route writes of a thread into the ``OutputBuffer`` registered for this
+    thread, writes of all other threads go to ``stream``.
+
+    Used by ``fabsetup.executor.ParallelExecutor`` so that the output of
+    concurrently executed tasks does not interleave.
+
+    :param typing.TextIO stream:
+        The wrapped filehandle, e.g. a ``stream_tee``.
+
+    :param str stream_name:
+        ``'stdout'`` or ``'stderr'``.
+
+    :param threading.local local:
+        Thread local storage with an attribute ``buffer`` (if registered).
+    """
+
+    def __init__(self, stream, stream_name, local):
+        self.stream = stream
+        self.stream_name = stream_name
+        self.local = local
+
+    def _buffer(self):
+        return getattr(self.local, "buffer", None)
+
+    def thread_stream(self):
+        """Return a writer into the buffer of the current thread or ``None``.
+
+        Invoke writes command output from its own worker threads, so the
+        writer has to be handed over explicitly as ``out_stream`` or
+        ``err_stream`` (cf. ``fabsetup.task.wrapped_run_method()``).
+        """
+        buffer = self._buffer()
+        if buffer is None:
+            return None
+        return buffer.stream(self.stream_name)
+
+    def write(self, text):
+        buffer = self._buffer()
+        if buffer is None:
+            return self.stream.write(text)
+        buffer.write(self.stream_name, text)
+        return len(text)
+
+    def flush(self):
+        if self._buffer() is None:
+            self.stream.flush()
+
+    def set_stream2_limiter(self, limiter):
+        buffer = self._buffer()
+        if buffer is None:
+            if hasattr(self.stream, "set_stream2_limiter"):
+                self.stream.set_stream2_limiter(limiter)
+        else:
+            buffer.set_limiter(self.stream_name, limiter)
+
+    def close_stream2_limiter(self):
+        buffer = self._buffer()
+        if buffer is None:
+            if hasattr(self.stream, "close_stream2_limiter"):
+                self.stream.close_stream2_limiter()
+        else:
+            buffer.close_limiter(self.stream_name)
+
+    @property
+    def add_prefix(self):
+        buffer = self._buffer()
+        if buffer is None:
+            return getattr(self.stream, "add_prefix", False)
+        return buffer.prefixes[self.stream_name] is not None
+
+    @add_prefix.setter
+    def add_prefix(self, value):
+        buffer = self._buffer()
+        if buffer is None:
+            if hasattr(self.stream, "add_prefix"):
+                self.stream.add_prefix = value
+        elif not value:
+            buffer.prefixes[self.stream_name] = None
+        elif buffer.prefixes[self.stream_name] is None:
+            buffer.prefixes[self.stream_name] = ""
+
+    @property
+    def stream2_line_prefix(self):
+        buffer = self._buffer()
+        if buffer is None:
+            return getattr(self.stream, "stream2_line_prefix", None)
+        return buffer.prefixes[self.stream_name]
+
+    @stream2_line_prefix.setter
+    def stream2_line_prefix(self, value):
+        buffer = self._buffer()
+        if buffer is None:
+            if hasattr(self.stream, "stream2_line_prefix"):
+                self.stream.stream2_line_prefix = value
+        else:
+            buffer.prefixes[self.stream_name] = value or ""
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class OutputDemux:
+    """Collect stdout and stderr output per thread.
+
+    Example:
+
+        >>> import io, sys, threading
+        >>> stdout_orig = sys.stdout
+        >>> demux = OutputDemux()
+        >>> demux.start()
+        >>> buffers = []
+        >>> def work(text):
+        ...     with demux.buffered() as buffer:
+        ...         print(text)
+        ...     buffers.append(buffer)
+        >>> thread = threading.Thread(target=work, args=('from thread',))
+        >>> thread.start(); thread.join()
+        >>> print('from main thread')
+        from main thread
+        >>> demux.replay(buffers[0])
+        from thread
+        >>> demux.stop()
+        >>> sys.stdout is stdout_orig
+        True
+    """
+
+    def __init__(self, local=None):
+        self.local = local if local is not None else threading.local()
+        self.default_stdout = None
+        self.default_stderr = None
+        self.nested = False
+
+    def start(self):
+        """Wrap ``sys.stdout`` and ``sys.stderr`` by ``stream_demux``.
+
+        If they are already wrapped (e.g. subtasks executed concurrently by
+        ``fabsetup.task.run_subtasks()`` within a task executed by
+        ``fabsetup.executor.ParallelExecutor``) the thread local storage of
+        the existing ``stream_demux`` is used.  Then replayed output of a
+        buffer goes into the buffer of the replaying thread.
+        """
+        self.default_stdout = sys.stdout
+        self.default_stderr = sys.stderr
+        self.nested = isinstance(sys.stdout, stream_demux)
+        if self.nested:
+            self.local = sys.stdout.local
+        else:
+            sys.stdout = stream_demux(sys.stdout, "stdout", self.local)
+            sys.stderr = stream_demux(sys.stderr, "stderr", self.local)
+
+    def stop(self):
+        """Reset ``sys.stdout`` and ``sys.stderr``."""
+        if not self.nested:
+            sys.stdout = self.default_stdout
+            sys.stderr = self.default_stderr
+
+    @contextlib.contextmanager
+    def buffered(self):
+        """Within this context all output of the current thread is written
+        into a new ``OutputBuffer`` which is yielded.
+        """
+        buffer = OutputBuffer()
+        self.local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            del self.local.buffer
+
+    def replay(self, buffer):
+        """Write ``buffer`` to the wrapped stdout and stderr."""
+        buffer.replay(self.default_stdout, self.default_stderr)
 
 
 # regex source: https://stackoverflow.com/a/15780675
+COLOR_CODE_REGEX = re.compile(
+    r"\x1b\[([0-9,A-Z]{1,2}(;[0-9]{1,2})?(;[0-9]{3})?)?[m|K]?"
+)
+
+# the (incomplete) beginning of a color code at the end of a text
+PARTIAL_COLOR_CODE_REGEX = re.compile(r"\x1b(\[[0-9,A-Z;]{0,9})?")
+
+# maximum length of a color code matched by ``COLOR_CODE_REGEX``
+COLOR_CODE_MAX_LEN = 12
+
+
+def remove_color_codes_str(text):
+    """Return ``text`` without ANSI color codes.
+
+    Example:
+
+        >>> remove_color_codes_str('\x1b[1;31mred\x1b[0m text')
+        'red text'
+    """
+    return COLOR_CODE_REGEX.sub("", text)
+
+
+class ColorCodeFilter:
+    """Remove ANSI color codes from a stream of texts.
+
+    A color code could be split over two consecutively written texts, so the
+    beginning of a color code at the end of a text is held back until the
+    next text (or ``flush()``) arrives.
+
+    Example:
+
+        >>> color_code_filter = ColorCodeFilter()
+        >>> color_code_filter('\x1b[1;3')
+        ''
+        >>> color_code_filter('1mred\x1b[0m text\x1b[')
+        'red text'
+        >>> color_code_filter.flush()
+        ''
+    """
+
+    def __init__(self):
+        self.pending = ""
+
+    def __call__(self, text):
+        text = self.pending + text
+        self.pending = ""
+        index = text.rfind("\x1b", -COLOR_CODE_MAX_LEN)
+        if index != -1 and PARTIAL_COLOR_CODE_REGEX.fullmatch(text, index):
+            self.pending = text[index:]
+            text = text[:index]
+        return remove_color_codes_str(text)
+
+    def flush(self):
+        """Return the held back text without color codes."""
+        text = remove_color_codes_str(self.pending)
+        self.pending = ""
+        return text
+
+
 def remove_color_codes(filename):
     """Remove ANSI color codes from a file inplace.
 
+    Not required for outfiles written by a ``Tee`` with
+    ``strip_color_codes=True``.
+
     :param str `filename`:
     """
     with fileinput.input(filename, inplace=True) as text:
         for line in text:
-            print(
-                re.sub(
-                    r"\x1b\[([0-9,A-Z]{1,2}(;[0-9]{1,2})?(;[0-9]{3})?)?[m|K]?", "", line
-                ),
-                end="",
-            )
+            print(remove_color_codes_str(line), end="")
+
+
+def _copy_file_contents(fh_from, fh_to):
+    """Append the contents of ``fh_from`` to ``fh_to``.
+
+    Uses ``os.sendfile()`` if available so the data is copied by the kernel
+    without reading it into memory, else falls back to a chunked copy.
+    """
+    fh_to.flush()
+    if hasattr(os, "sendfile"):
+        offset = 0
+        try:
+            while True:
+                sent = os.sendfile(
+                    fh_to.fileno(), fh_from.fileno(), offset, 1024 * 1024
+                )
+                if sent == 0:
+                    return
+                offset += sent
+        except OSError:
+            if offset:
+                raise
+            # sendfile() not supported for these files
+    shutil.copyfileobj(fh_from, fh_to)
+
+
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+def compression_of(filename):
+    """Return the compression of ``filename`` determined by its suffix.
+
+    Example:
+
+        >>> compression_of('run.md.gz'), compression_of('run.md')
+        ('gzip', '')
+    """
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if filename.endswith(suffix):
+            return compression
+    return ""
+
+
+def compressed_name(filename, compression):
+    """Return ``filename`` with the suffix of ``compression`` appended.
+
+    :param str compression:
+        ``''`` (no compression), ``'gzip'`` or ``'zstd'``.
+
+    Example:
+
+        >>> compressed_name('run.md', 'zstd')
+        'run.md.zst'
+        >>> compressed_name('run.md.gz', 'gzip')
+        'run.md.gz'
+    """
+    if compression and compression_of(filename) != compression:
+        try:
+            return filename + COMPRESSION_SUFFIXES[compression]
+        except KeyError:
+            raise ValueError("unknown compression: '{}'".format(compression))
+    return filename
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            "zstd compression requires the zstandard package, install it "
+            "with: pip install 'fabsetup[zstd]'"
+        )
+    return zstandard
+
+
+def open_outfile(filename, mode="r"):
+    """Open an outfile which is transparently compressed and decompressed
+    according to the suffix of ``filename``: ``.gz`` (gzip) or ``.zst``
+    (zstd, requires the ``zstandard`` package).
+
+    Appending to a compressed file adds a new gzip member or zstd frame,
+    decompression reads all of them.
+
+    :param str mode:
+        ``'r'``, ``'w'`` or ``'a'``, with ``'b'`` for binary mode.
+    """
+    compression = compression_of(filename)
+    if compression and "b" not in mode:
+        mode += "t"
+    if compression == "gzip":
+        return gzip.open(filename, mode, compresslevel=6)
+    if compression == "zstd":
+        return _zstandard().open(filename, mode)
+    return open(filename, mode)
+
+
+def compress(data, compression):
+    """Return the bytes ``data`` compressed as one gzip member or zstd
+    frame."""
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "zstd":
+        return _zstandard().ZstdCompressor().compress(data)
+    return data
+
+
+def cat_run(filename, stream=None):
+    """Write the decompressed content of the outfile ``filename`` to
+    ``stream`` (default: stdout)."""
+    stream = stream or sys.stdout.buffer
+    with open_outfile(os.path.expanduser(filename), "rb") as fh:
+        shutil.copyfileobj(fh, stream, 1024 * 1024)
+    stream.flush()
+
+
+def prepend_to_file(filename, header):
+    """Prepend ``header`` to a file without reading the file into memory.
+
+    ``header`` is written into a temporary file next to ``filename``, the
+    contents of ``filename`` are appended to it and the temporary file
+    replaces ``filename`` afterwards.
+
+    A compressed outfile (cf. `open_outfile()`) is not decompressed, the
+    compressed ``header`` is put in front of the compressed contents as
+    separate gzip member or zstd frame.
+
+    :param str `filename`:
+
+    :param str `header`:
+    """
+    fname = os.path.abspath(os.path.expanduser(filename))
+    fd, tmp_fname = tempfile.mkstemp(
+        dir=os.path.dirname(fname), prefix=".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as fh_out:
+            fh_out.write(compress(header.encode(), compression_of(fname)))
+            fh_out.flush()
+            with open(fname, "rb") as fh_in:
+                _copy_file_contents(fh_in, fh_out)
+        shutil.copymode(fname, tmp_fname)
+        os.replace(tmp_fname, fname)
+    except BaseException:
+        os.unlink(tmp_fname)
+        raise
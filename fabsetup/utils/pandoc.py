@@ -1,20 +1,162 @@
 """With a locally installed `Pandoc <https://pandoc.org/>`_ add a table of
 content (toc) to Markdown files and create HTML from Markdown files.
+
+With the command ``"builtin"`` no pandoc process is started, the renderer of
+`fabsetup.utils.markdown` is used instead.
 """
 
+import concurrent.futures
 import os
 import os.path
 import pathlib
+import shutil
 import subprocess
 
 from invoke.util import debug
 
+import fabsetup.utils.markdown
+from fabsetup.utils.markdown import BUILTIN
+from fabsetup.utils.outfile import COMPRESSION_SUFFIXES, compression_of, open_outfile
+
+HTML_SCRIPT = os.path.join(os.path.dirname(__file__), "css", "html-script.js")
+OUTFILE_CSS = os.path.join(os.path.dirname(__file__), "css", "outfile.css")
+
+MARKDOWN_SUFFIXES = tuple(
+    [".md"] + [".md" + suffix for suffix in COMPRESSION_SUFFIXES.values()]
+)
+
+
+def html_basename(filename):
+    """Return the basename of the HTML file created from the Markdown file
+    ``filename``.
+
+    Example:
+
+        >>> html_basename('/tmp/fabsetup_2021-02-21_12-30-45_me-hello.md.gz')
+        'fabsetup_2021-02-21_12-30-45_me-hello.html'
+        >>> html_basename('/tmp/run.d/fabsetup_me-hello_me@web1.example.com.md')
+        'fabsetup_me-hello_me@web1.example.com.html'
+    """
+    basename = os.path.basename(filename)
+    for suffix in COMPRESSION_SUFFIXES.values():
+        if basename.endswith(suffix):
+            basename = basename[: -len(suffix)]
+            break
+    if basename.endswith(".md"):
+        basename = basename[: -len(".md")]
+    return basename + ".html"
+
+
+def outdated(filename_from, filename_to, assets=(HTML_SCRIPT, OUTFILE_CSS)):
+    """Return ``True`` if the HTML file ``filename_to`` does not exist or is
+    older than the Markdown file ``filename_from`` or one of the ``assets``
+    embedded into it."""
+    try:
+        mtime = os.stat(filename_to).st_mtime
+    except FileNotFoundError:
+        return True
+    return any(os.stat(path).st_mtime > mtime for path in (filename_from,) + assets)
+
+
+def find_outfiles(directory):
+    """Yield the Markdown outfiles in ``directory`` and its subdirectories
+    (e.g. the outfiles per host, cf. ``outfile.per_host``), sorted by
+    name."""
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith("."))
+        for name in sorted(filenames):
+            if name.endswith(MARKDOWN_SUFFIXES) and not name.startswith("."):
+                yield os.path.join(dirpath, name)
+
+
+def _render(command, filename_from, filename_to):
+    # executed by a worker process of `render_files()`
+    return Pandoc(command).create_html(
+        filename_from, filename_to, css_url=OUTFILE_CSS, inline=True
+    )
+
+
+def render_runs(directory, command="pandoc", html_dir="", workers=None):
+    """Create the HTML files of all Markdown outfiles in ``directory`` by a
+    pool of ``workers`` processes (default: the number of CPUs).
+
+    An outfile is skipped if its HTML file is newer than the outfile and
+    than the CSS and JavaScript files embedded into it (cf. `outdated()`).
+
+    :param str `command`:
+        Pandoc executable or ``"builtin"``, cf. `Pandoc`.
+
+    :param str `html_dir`:
+        Directory of the HTML files, by default the HTML file is created
+        next to its outfile.  The subdirectories of ``directory`` are kept.
+
+    :returns:
+        list of tuples ``(filename_from, filename_to, status)`` with status
+        ``'created'``, ``'up to date'`` or ``'failed'``.
+    """
+    directory = os.path.abspath(os.path.expanduser(directory))
+    html_dir = os.path.abspath(os.path.expanduser(html_dir)) if html_dir else ""
+
+    results = []
+    for filename_from in find_outfiles(directory):
+        dirname = os.path.dirname(filename_from)
+        if html_dir:
+            dirname = os.path.join(html_dir, os.path.relpath(dirname, directory))
+        filename_to = os.path.join(dirname, html_basename(filename_from))
+        status = "up to date"
+        if outdated(filename_from, filename_to):
+            status = None
+        results.append([filename_from, filename_to, status])
+
+    pending = [result for result in results if result[2] is None]
+    statuses = render_files(
+        [(filename_from, filename_to) for filename_from, filename_to, _ in pending],
+        command=command,
+        workers=workers,
+    )
+    for result, status in zip(pending, statuses):
+        result[2] = status
+
+    return [tuple(result) for result in results]
+
+
+def render_files(filenames, command="pandoc", workers=None):
+    """Create HTML files from Markdown files by a pool of ``workers``
+    processes (default: the number of CPUs).
+
+    :param list `filenames`:
+        ``(filename_from, filename_to)`` tuples.
+
+    :param str `command`:
+        Pandoc executable or ``"builtin"``, cf. `Pandoc`.
+
+    :returns:
+        list of the statuses ``'created'`` or ``'failed'``, in the order of
+        ``filenames``.
+    """
+    filenames = list(filenames)
+    if not filenames:
+        return []
+    statuses = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(_render, command, filename_from, filename_to)
+            for filename_from, filename_to in filenames
+        ]
+        for future in futures:
+            try:
+                statuses.append("created" if future.result() else "failed")
+            except Exception:
+                statuses.append("failed")
+    return statuses
+
 
 class Pandoc:
     """Pandoc command execution interface.
 
     :param str `command`:
-        Optionally, path to Pandoc executable.
+        Optionally, path to Pandoc executable or ``"builtin"`` to use
+        `fabsetup.utils.markdown`.
     """
 
     def __init__(self, command="/usr/bin/pandoc"):
@@ -25,11 +167,16 @@ class Pandoc:
 
         Return `True` if command is available, else `False`.
         """
-        process = subprocess.Popen(
-            [self.command, "--version"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.STDOUT,
-        )
+        if self.command == BUILTIN:
+            return True
+        try:
+            process = subprocess.Popen(
+                [self.command, "--version"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.STDOUT,
+            )
+        except OSError:  # e.g. pandoc not installed
+            return False
         process.communicate()
         return process.returncode == 0
 
@@ -42,6 +189,10 @@ class Pandoc:
         :returns:
             `True` if toc has been added, else `False`.
         """
+        if self.command == BUILTIN or compression_of(filename):
+            # pandoc can not rewrite a compressed file inplace
+            return fabsetup.utils.markdown.add_toc(filename)
+
         fname = os.path.abspath(os.path.expanduser(filename))
         # fname_stem = pathlib.Path(fname).stem
         process = subprocess.Popen(
@@ -73,7 +224,8 @@ class Pandoc:
         Recursively create parent dirs of ``filename_to`` if they not exist.
 
         :param str `filename_from`:
-            Name of the Markdown file.
+            Name of the Markdown file, could be compressed (cf.
+            `fabsetup.utils.outfile.open_outfile()`).
 
         :param str `filename_to`:
             Name of the HTML file.
@@ -87,6 +239,15 @@ class Pandoc:
         :returns:
             `True` if HTML file has been created, else `False`.
         """
+        if self.command == BUILTIN:
+            return fabsetup.utils.markdown.create_html(
+                filename_from,
+                filename_to,
+                css_url=css_url,
+                inline=inline,
+                after_body=HTML_SCRIPT,
+            )
+
         os.makedirs(
             os.path.dirname(os.path.abspath(os.path.expanduser(filename_to))),
             exist_ok=True,
@@ -100,7 +261,7 @@ class Pandoc:
         options = [
             # "--standalone",
             "--include-after-body",
-            os.path.join(os.path.dirname(__file__), "css", "html-script.js"),
+            HTML_SCRIPT,
             '--metadata=pagetitle:"{stem}"'.format(stem=fname_to_stem),
         ]
 
@@ -126,11 +287,26 @@ class Pandoc:
             + [
                 "--output",
                 fname_to,
-                fname_from,
             ]
         )
-        # print(' '.join(cmd))  # TODO DEVEL
+
+        if not compression_of(fname_from):
+            cmd.append(fname_from)
+            # print(' '.join(cmd))  # TODO DEVEL
+            debug(cmd)
+            process = subprocess.Popen(cmd)
+            process.communicate()
+            return process.returncode == 0
+
+        # stream the decompressed outfile into pandoc's stdin
         debug(cmd)
-        process = subprocess.Popen(cmd)
-        process.communicate()
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        try:
+            with open_outfile(fname_from, "rb") as fh_in:
+                shutil.copyfileobj(fh_in, process.stdin, 1024 * 1024)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+        process.wait()
         return process.returncode == 0
@@ -0,0 +1,278 @@
+"""Record wall-clock and CPU timings of tasks, subtasks and commands."""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+from fabsetup.utils.events import EventLog
+from fabsetup.utils.outfile import ContextLocal, Singleton
+
+
+def cpu_time():
+    """Return the CPU time (user + system) of the current thread in seconds,
+    so tasks executed in parallel threads do not count the CPU time of each
+    other.
+
+    Without ``time.thread_time()`` (before Python 3.7) return the CPU time of
+    this process and its finished child processes instead.
+    """
+    if hasattr(time, "thread_time"):
+        return time.thread_time()
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def children_cpu_time():
+    """Return the CPU time (user + system) of the finished child processes of
+    this process in seconds, e.g. of local commands (or of the ``ssh``
+    client of a remote command)."""
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class TimingNode:
+    """Timing of a task, subtask or command.
+
+    :param str kind:
+        ``'run'``, ``'task'``, ``'subtask'`` or ``'command'``.
+
+    :param str name:
+        Name of the task or subtask or the command.
+
+    :param str host:
+        Optionally the host the task or command was executed on.
+    """
+
+    def __init__(self, kind, name, host=None):
+        self.kind = kind
+        self.name = name
+        self.host = host
+        self.children = []
+        self.return_code = None
+        self.args = {}  # additional information, e.g. byte counts
+        self.thread = None
+        self.started = None  # seconds since the epoch
+        self.wall = None  # seconds
+        self.cpu = None  # seconds
+        self._start_wall = None
+        self._start_cpu = None
+
+    def _cpu_time(self):
+        # a command is executed by a child process, not by the thread
+        if self.kind == "command":
+            return children_cpu_time()
+        return cpu_time()
+
+    def start(self):
+        self.thread = threading.current_thread().name
+        self.started = time.time()
+        self._start_cpu = self._cpu_time()
+        self._start_wall = time.perf_counter()
+
+    def stop(self, return_code=None):
+        self.wall = time.perf_counter() - self._start_wall
+        self.cpu = self._cpu_time() - self._start_cpu
+        if return_code is not None:
+            self.return_code = return_code
+
+    def walk(self):
+        """Iterate depth-first over this node and all of its descendants."""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+def _table_cell(text):
+    return str(text).replace("\n", " ").replace("|", "\\|")
+
+
+class Timings(metaclass=Singleton):
+    """Run-scoped tree of `TimingNode` objects.
+
+    Uses `fabsetup.utils.outfile.Singleton` as metaclass.  Each thread (and
+    each asyncio task, cf. `fabsetup.utils.outfile.ContextLocal`) has its own
+    stack of currently measured nodes, so tasks executed in parallel on
+    several hosts (cf. ``fabsetup.executor.ParallelExecutor``) are recorded as
+    separate subtrees.
+
+    Example:
+
+        >>> timings = Timings()
+        >>> timings.reset()
+        >>> with timings.measure('task', 'mytask') as task:
+        ...     with timings.measure('command', 'true') as command:
+        ...         command.return_code = 0
+        >>> [node.name for node in timings.root.walk()]
+        ['fabsetup', 'mytask', 'true']
+        >>> task.wall >= command.wall
+        True
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Start a new, empty timing tree."""
+        self.root = TimingNode("run", "fabsetup")
+        self.root.start()
+        self._local = ContextLocal()
+
+    def _stack(self):
+        # the stack is a tuple which is replaced on each change, so an
+        # asyncio task never changes the stack of the task which created it
+        return getattr(self._local, "stack", ())
+
+    def current(self):
+        """Return the innermost node measured by this thread (or the root)."""
+        stack = self._stack()
+        return stack[-1] if stack else self.root
+
+    @contextlib.contextmanager
+    def inherit(self, parent):
+        """Within this context nodes measured by the current thread are
+        added as children of ``parent``, e.g. the node of the subtask which
+        started the thread (cf. ``fabsetup.task.run_subtasks()``).
+        """
+        stack = self._stack()
+        self._local.stack = stack + (parent,)
+        try:
+            yield parent
+        finally:
+            self._local.stack = stack
+
+    @contextlib.contextmanager
+    def measure(self, kind, name, host=None):
+        """Measure the execution of the ``with`` block as child of the
+        current node.
+
+        Emits the events ``<kind>_start`` and ``<kind>_end`` to the
+        `fabsetup.utils.events.EventLog`.
+
+        :returns:
+            The `TimingNode`, e.g. to set its ``return_code``.
+        """
+        node = TimingNode(kind, name, host=host)
+        parent = self.current()
+        with self.lock:
+            parent.children.append(node)
+        stack = self._stack()
+        self._local.stack = stack + (node,)
+        events = EventLog()
+        events.emit(kind + "_start", name=name, host=host)
+        node.start()
+        try:
+            yield node
+        finally:
+            node.stop()
+            self._local.stack = stack
+            events.emit(
+                kind + "_end",
+                name=name,
+                host=host,
+                return_code=node.return_code,
+                wall=node.wall,
+                cpu=node.cpu,
+                **node.args,
+            )
+
+    def nodes(self, kinds):
+        """Return all finished nodes of the given ``kinds``."""
+        return [
+            node
+            for node in self.root.walk()
+            if node.kind in kinds and node.wall is not None
+        ]
+
+    def slowest(self, kinds, number):
+        """Return the ``number`` slowest nodes of the given ``kinds``."""
+        nodes = sorted(self.nodes(kinds), key=lambda node: node.wall, reverse=True)
+        return nodes[:number]
+
+    def summary(self, number=10):
+        """Return a Markdown section with tables of the ``number`` slowest
+        tasks and commands.
+        """
+        lines = ["", "# Timing Summary", ""]
+        lines.append(
+            "Total: {:.3f} s".format(time.perf_counter() - self.root._start_wall)
+        )
+        for heading, kinds, name_header in [
+            ("Slowest Tasks", ("task", "subtask"), "Task"),
+            ("Slowest Commands", ("command",), "Command"),
+        ]:
+            lines += [
+                "",
+                "## {}".format(heading),
+                "",
+                "| {} | Host | Wall [s] | CPU [s] | Return Code |".format(name_header),
+                "|---|---|--:|--:|--:|",
+            ]
+            for node in self.slowest(kinds, number):
+                lines.append(
+                    "| {} | {} | {:.3f} | {:.3f} | {} |".format(
+                        _table_cell(node.name),
+                        _table_cell(node.host or ""),
+                        node.wall,
+                        node.cpu,
+                        "" if node.return_code is None else node.return_code,
+                    )
+                )
+        return "\n".join(lines) + "\n"
+
+    def chrome_trace(self):
+        """Return the timing tree in the `Chrome Trace Event Format
+        <https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU>`_,
+        viewable in Perfetto or ``chrome://tracing``.
+
+        Each node becomes a complete event (``"ph": "X"``), each thread gets
+        its own track.
+        """
+        threads = {}
+        events = []
+        for node in self.root.walk():
+            if node.started is None:
+                continue
+            tid = threads.setdefault(node.thread, len(threads) + 1)
+            wall = node.wall
+            if wall is None:  # still running, e.g. the root
+                wall = time.perf_counter() - node._start_wall
+            args = dict(node.args)
+            if node.host:
+                args["host"] = node.host
+            if node.return_code is not None:
+                args["return_code"] = node.return_code
+            if node.cpu is not None:
+                args["cpu_s"] = round(node.cpu, 6)
+            events.append(
+                {
+                    "name": node.name,
+                    "cat": node.kind,
+                    "ph": "X",
+                    "ts": round(node.started * 1e6),
+                    "dur": round(wall * 1e6),
+                    "pid": 1,
+                    "tid": tid,
+                    "args": args,
+                }
+            )
+        for thread, tid in threads.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": tid,
+                    "args": {"name": thread},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, filename):
+        """Write `chrome_trace()` as JSON into ``filename``."""
+        fname = os.path.abspath(os.path.expanduser(filename))
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "w") as fh:
+            json.dump(self.chrome_trace(), fh)
@@ -74,6 +74,9 @@ setup(
             "recommonmark",
             "sphinx",
             "tox",
-        ]
+        ],
+        "zstd": [
+            "zstandard",
+        ],
     },
 )
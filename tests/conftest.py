@@ -0,0 +1,46 @@
+import importlib
+import os
+import sys
+
+import invoke
+import pytest
+
+import fabsetup.__main__
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "benchmark: informational timing, only run with FABSETUP_BENCHMARK=1",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if os.environ.get("FABSETUP_BENCHMARK"):
+        return
+    skip = pytest.mark.skip(reason="benchmark, set FABSETUP_BENCHMARK=1 to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture
+def run_fabsetup(tmpdir, monkeypatch, capsys):
+    """Return a function which writes ``source`` as fabfile into ``tmpdir``,
+    executes ``fabsetup`` with ``argv`` on its tasks and returns the captured
+    output."""
+
+    def run(source, argv):
+        tmpdir.join("fabfile.py").write(source)
+        sys.path.insert(0, str(tmpdir))
+        try:
+            fabfile = importlib.reload(importlib.import_module("fabfile"))
+            namespace = invoke.Collection.from_module(fabfile)
+            monkeypatch.setattr(sys, "argv", ["fabsetup"] + argv)
+            capsys.readouterr()
+            fabsetup.__main__.main(namespace)
+            return capsys.readouterr()
+        finally:
+            sys.path.pop(0)
+
+    return run
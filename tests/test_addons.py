@@ -285,3 +285,107 @@ def test_merge_or_add_r(tmpdir):
         "foo",
     ]
     assert tasks_of(first_sub_coll(first_sub_coll(namespace))) == ["aaa", "bbb"]
+
+
+def test_manifest_lazy_load_repo_addons(tmpdir, monkeypatch):
+
+    monkeypatch.setattr(fabsetup.addons, "REPOS_DIR", str(tmpdir.mkdir("repos")))
+    monkeypatch.setattr(fabsetup.addons, "REPO_MODULES", [])
+    manifest_file = str(tmpdir.join("manifest.json"))
+
+    create_fabsetup_addon(
+        tmpdir.join("repos"), "fabsetup-lazyuser-lazy", ["lazy_one", "lazy_two"]
+    )
+
+    # first load imports the addon and writes the manifest
+    manifest = fabsetup.addons.Manifest.load(manifest_file)
+    collections = fabsetup.addons.load_repo_addons(manifest)
+    manifest.save()
+
+    assert tasks_of(collections[0]) == ["lazy_one", "lazy_two"]
+    assert fabsetup.addons.REPO_MODULES[0].__name__ == "fabsetup_lazyuser_lazy"
+
+    # second load takes the tasks from the manifest without any import
+    imported = []
+    import_module = importlib.import_module
+
+    def tracking_import_module(name, *args, **kwargs):
+        imported.append(name)
+        return import_module(name, *args, **kwargs)
+
+    monkeypatch.setattr(importlib, "import_module", tracking_import_module)
+    fabsetup.addons.REPO_MODULES.clear()
+
+    manifest = fabsetup.addons.Manifest.load(manifest_file)
+    collections = fabsetup.addons.load_repo_addons(manifest)
+
+    assert imported == []
+    assert manifest.changed is False
+    assert tasks_of(collections[0]) == ["lazy_one", "lazy_two"]
+    assert collections[0]["lazy-one"].__doc__ == "docstring of lazy_one"
+    assert fabsetup.addons.REPO_MODULES[0].__version__ == "0.1.0"
+
+    # the module is imported when a task is executed
+    collections[0]["lazy-two"](invoke.Context())
+    assert imported == ["fabsetup_lazyuser_lazy"]
+
+
+def test_manifest_invalidated_by_mtime(tmpdir, monkeypatch):
+
+    monkeypatch.setattr(fabsetup.addons, "REPOS_DIR", str(tmpdir.mkdir("repos")))
+    monkeypatch.setattr(fabsetup.addons, "REPO_MODULES", [])
+    manifest_file = str(tmpdir.join("manifest.json"))
+
+    create_fabsetup_addon(tmpdir.join("repos"), "fabsetup-mtimeuser-mt", ["mt"])
+
+    manifest = fabsetup.addons.Manifest.load(manifest_file)
+    fabsetup.addons.load_repo_addons(manifest)
+    manifest.save()
+
+    module_dirname = str(
+        tmpdir.join("repos", "fabsetup-mtimeuser-mt", "fabsetup_mtimeuser_mt")
+    )
+    manifest = fabsetup.addons.Manifest.load(manifest_file)
+    assert manifest.lookup("fabsetup-mtimeuser-mt", module_dirname) is not None
+
+    init_file = tmpdir.join(
+        "repos", "fabsetup-mtimeuser-mt", "fabsetup_mtimeuser_mt", "__init__.py"
+    )
+    init_file.setmtime(init_file.mtime() + 10)
+
+    assert manifest.lookup("fabsetup-mtimeuser-mt", module_dirname) is None
+
+    fabsetup.addons.load_repo_addons(manifest)
+    assert manifest.changed is True
+    assert manifest.lookup("fabsetup-mtimeuser-mt", module_dirname) is not None
+
+
+def test_manifest_single_file_repo_addon(tmpdir, monkeypatch):
+
+    monkeypatch.setattr(fabsetup.addons, "REPOS_DIR", str(tmpdir.mkdir("repos")))
+    monkeypatch.setattr(fabsetup.addons, "REPO_MODULES", [])
+    module_file = tmpdir.join(
+        "repos", "fabsetup-fileuser-single", "fabsetup_fileuser_single.py"
+    )
+    module_file.write(
+        '''\
+from fabsetup.task import task
+
+__version__ = "0.1.0"
+
+@task
+def single(c):
+    """docstring of single"""
+''',
+        ensure=True,
+    )
+
+    # a manifest file which can not be written does not abort the run
+    manifest_file = str(tmpdir.join("nonexistent", "manifest.json"))
+    manifest = fabsetup.addons.Manifest.load(manifest_file)
+    collections = fabsetup.addons.load_repo_addons(manifest)
+    manifest.save()
+
+    assert tasks_of(collections[0]) == ["single"]
+    assert manifest.lookup("fabsetup-fileuser-single", str(module_file))
+    assert manifest.changed is True
@@ -0,0 +1,89 @@
+import sys
+import threading
+import time
+
+import invoke
+import invoke.exceptions
+
+import fabsetup.aio
+from fabsetup.task import subtask
+
+# stand-in of the ssh client: executes the command (last argument) locally
+FAKE_SSH = (
+    sys.executable
+    + " -c 'import subprocess, sys; "
+    + 'sys.exit(subprocess.call(["/bin/sh", "-c", sys.argv[-1]]))\''
+)
+
+
+def make_contexts(hosts):
+    contexts = []
+    for host in hosts:
+        config = invoke.Config(overrides={"run": {"ssh_command": FAKE_SSH}})
+        contexts.append(fabsetup.aio.AsyncContext(config, host=host, user="me"))
+    return contexts
+
+
+def test_ssh_argv():
+    (context,) = make_contexts(["web1"])
+    context.port = 2222
+    assert context.ssh_argv("uptime")[-4:] == ["-p", "2222", "me@web1", "uptime"]
+
+
+def test_run_batch(capsys):
+    threads = []
+
+    @fabsetup.aio.task
+    async def mytask(c, text):
+        """docstring of mytask"""
+        threads.append(threading.active_count())
+        res = await c.run("sleep 0.5; echo {} {}".format(text, c.host))
+        threads.append(threading.active_count())
+        return res.stdout
+
+    hosts = ["host{}".format(number) for number in range(50)]
+    start = time.time()
+    outcomes = fabsetup.aio.run_batch(mytask, make_contexts(hosts), args=("hi",))
+    elapsed = time.time() - start
+
+    assert elapsed < 10  # instead of 50 * 0.5 s
+    assert max(threads) < 10  # no thread per host
+    assert outcomes == [("hi {}\n".format(host), None) for host in hosts]
+
+    out = capsys.readouterr().out
+    assert out.count("docstring of mytask") == 50
+    positions = [out.index("\nhi {}\n".format(host)) for host in hosts]
+    assert positions == sorted(positions)
+
+
+def test_run_batch_failed(capsys):
+    @fabsetup.aio.task
+    async def mytask(c):
+        """docstring of mytask"""
+        await c.run("test {} != host1".format(c.host))
+        await c.run("echo done")
+
+    outcomes = fabsetup.aio.run_batch(mytask, make_contexts(["host0", "host1"]))
+
+    assert outcomes[0] == (None, None)
+    assert isinstance(outcomes[1][1], invoke.exceptions.UnexpectedExit)
+    out = capsys.readouterr().out
+    assert out.count("echo done") == 1
+    assert "[1]" in out
+
+
+def test_sync(capsys):
+    @subtask
+    def mysubtask(c):
+        """docstring of mysubtask"""
+        return c.run("echo sync", hide=True).stdout
+
+    @fabsetup.aio.task
+    async def mytask(c):
+        """docstring of mytask"""
+        return await c.sync(mysubtask)
+
+    outcomes = fabsetup.aio.run_batch(mytask, make_contexts(["localhost"] * 2))
+
+    assert outcomes == [("sync\n", None)] * 2
+    assert capsys.readouterr().out.count("docstring of mysubtask") == 2
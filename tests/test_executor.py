@@ -0,0 +1,133 @@
+import fabric.tasks
+import invoke
+import pytest
+
+import fabsetup.executor
+
+
+def test_shifted_numbered_state():
+    assert fabsetup.executor.shifted_numbered_state("0", 0) == "0"
+    assert fabsetup.executor.shifted_numbered_state("0", 2) == "2"
+    assert fabsetup.executor.shifted_numbered_state("3.1", 1) == "3.2"
+
+
+def test_batches():
+    @invoke.task
+    def task1(c):
+        pass
+
+    @invoke.task
+    def task2(c):
+        pass
+
+    def connection_call(task, host):
+        return fabric.tasks.ConnectionCall(task, init_kwargs={"host": host})
+
+    calls = [
+        invoke.Call(task1),
+        connection_call(task1, "host1"),
+        connection_call(task1, "host2"),
+        connection_call(task2, "host1"),
+        connection_call(task2, "host2"),
+        connection_call(task2, "host3"),
+        invoke.Call(task2),
+    ]
+
+    batches = fabsetup.executor.ParallelExecutor.batches(calls)
+
+    assert [len(batch) for batch in batches] == [1, 2, 3, 1]
+    assert batches[1] == calls[1:3]
+    assert batches[2] == calls[3:6]
+
+
+FABFILES = {
+    "thread": '''\
+from fabsetup.task import task, subtask
+
+@subtask
+def mysubtask(c):
+    """docstring of mysubtask"""
+    c.run("sleep 0.1; echo out; echo err >&2")
+
+@task
+def mytask(c):
+    """docstring of mytask"""
+    print(c.host)
+    mysubtask(c)
+''',
+    "asyncio": '''\
+import fabsetup.aio
+from fabsetup.task import subtask
+
+@subtask
+def mysubtask(c):
+    """docstring of mysubtask"""
+    c.run("sleep 0.1; echo out; echo err >&2")
+
+@fabsetup.aio.task
+async def mytask(c):
+    """docstring of mytask"""
+    print(c.host)
+    await c.sync(mysubtask)
+''',
+}
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.parametrize("backend", ["thread", "asyncio"])
+def test_parallel_output_equals_sequential_output(run_fabsetup, backend):
+    hosts = ["--hosts", "localhost,localhost,localhost"]
+
+    sequential = run_fabsetup(FABFILES[backend], hosts + ["mytask", "mytask"])
+    parallel = run_fabsetup(
+        FABFILES[backend], hosts + ["--parallel", "3", "mytask", "mytask"]
+    )
+
+    assert parallel.out == sequential.out
+    assert parallel.err == sequential.err
+    for number in range(1, 7):
+        assert "# {} mytask".format(number) in parallel.out
+        assert "## {}.1 mysubtask".format(number) in parallel.out
+
+
+def test_outfile_per_host(tmpdir, run_fabsetup):
+    hosts = ["--hosts", "localhost,me@localhost"]
+    outfile = tmpdir.join("run.md")
+
+    for parallel in ["1", "2"]:
+        argv = hosts + ["--parallel", parallel, "--outfile", str(outfile)]
+        run_fabsetup(FABFILES["thread"], argv + ["--outfile-per-host", "mytask"])
+
+        index = outfile.read()
+        assert "mysubtask" not in index
+        assert "| localhost | ok | [fabsetup_" in index
+        assert "_mytask_me@localhost.md](run.d/fabsetup_" in index
+
+        host_outfiles = sorted(tmpdir.join("run.d").listdir())
+        assert host_outfiles[0].basename.endswith("_mytask_localhost.md")
+        assert host_outfiles[1].basename.endswith("_mytask_me@localhost.md")
+        for number, path in enumerate(host_outfiles, 1):
+            assert "## {}.1 mysubtask".format(number) in path.read()
+        tmpdir.join("run.d").remove()
+
+
+def test_outfile_per_host_html(tmpdir, monkeypatch, run_fabsetup):
+    monkeypatch.setenv("FABSETUP_OUTFILE_PANDOC_COMMAND", "builtin")
+    monkeypatch.setenv(
+        "FABSETUP_OUTFILE_PANDOC_HTML_NAME", str(tmpdir.join("html", "run.html"))
+    )
+    argv = ["--hosts", "localhost,me@localhost", "--outfile", str(tmpdir / "run.md")]
+
+    for live in [[], ["--live-html"]]:
+        run_fabsetup(FABFILES["thread"], argv + live + ["--outfile-per-host", "mytask"])
+
+        html = tmpdir.join("html", "run.html").read()
+        assert "_mytask_me@localhost.html</a>" in html
+        assert '<a href="run.d/fabsetup_' in html
+
+        host_htmls = sorted(tmpdir.join("html", "run.d").listdir())
+        assert host_htmls[0].basename.endswith("_mytask_localhost.html")
+        assert host_htmls[1].basename.endswith("_mytask_me@localhost.html")
+        for number, path in enumerate(host_htmls, 1):
+            assert "{}.1 mysubtask</h2>".format(number) in path.read()
+        tmpdir.join("html").remove()
@@ -0,0 +1,190 @@
+import os
+
+import fabric.connection
+import invoke.exceptions
+import pytest
+
+import fabsetup.fabutils.addon
+
+
+def create_addon(tmpdir):
+    module_dir = tmpdir.mkdir("fabsetup-me-hello").mkdir("fabsetup_me_hello")
+    files_dir = module_dir.join("fabfile-data", "files")
+    files_dir.join("home", "USERNAME", ".hello.template").write(
+        "hello {{name}}\n", ensure=True
+    )
+    files_dir.join("etc", "hello", "script.sh").write("#!/bin/sh\n", ensure=True)
+    files_dir.join("etc", "hello", "script.sh").chmod(0o755)
+    return str(module_dir)
+
+
+def test_install_files(tmpdir, monkeypatch, capsys):
+
+    home = tmpdir.mkdir("home")
+    monkeypatch.setenv("HOME", str(home))
+    module_dir = create_addon(tmpdir)
+    context = fabric.connection.Connection("localhost")
+    addon = fabsetup.fabutils.addon.Addon(module_dir, context)
+
+    commands = []
+    local = context.local
+
+    def spy_local(command, *args, **kwargs):
+        commands.append(command)
+        return local(command, *args, **kwargs)
+
+    monkeypatch.setattr(context, "local", spy_local)
+
+    script = os.path.join(module_dir, "fabfile-data/files/etc/hello/script.sh")
+    os.utime(script, (1600000000, 1600000000))
+
+    target_dir = tmpdir.join("target")
+    addon.install_files(
+        [
+            "~/.hello",
+            (
+                str(target_dir.join("hello", "script.sh")),
+                os.path.join(module_dir, "fabfile-data/files/etc/hello/script.sh"),
+            ),
+        ],
+        local=True,
+        name="world",
+    )
+
+    assert home.join(".hello").read() == "hello world\n"
+    assert target_dir.join("hello", "script.sh").read() == "#!/bin/sh\n"
+    assert target_dir.join("hello", "script.sh").stat().mode & 0o777 == 0o755
+    # the mtime of the source file is kept
+    assert target_dir.join("hello", "script.sh").mtime() == 1600000000
+
+    # one tar command per destination root dir, no mkdir or cp
+    assert len(commands) == 2
+    assert all(command.startswith("tar --extract") for command in commands)
+
+    captured = capsys.readouterr()
+    assert "batch installation failed" not in captured.out
+
+
+def test_install_files_fallback(tmpdir, monkeypatch, capsys):
+
+    home = tmpdir.mkdir("home")
+    monkeypatch.setenv("HOME", str(home))
+    module_dir = create_addon(tmpdir)
+    context = fabric.connection.Connection("localhost")
+    addon = fabsetup.fabutils.addon.Addon(module_dir, context)
+
+    def failing_install_tar_local(root, data, sudo):
+        raise OSError("no tar")
+
+    monkeypatch.setattr(addon, "_install_tar_local", failing_install_tar_local)
+
+    addon.install_files(["~/.hello"], local=True, name="world")
+
+    assert home.join(".hello").read() == "hello world\n"
+    captured = capsys.readouterr()
+    assert "batch installation failed (no tar)" in captured.out
+
+
+def test_install_files_skip_unchanged(tmpdir, monkeypatch, capsys):
+
+    home = tmpdir.mkdir("home")
+    monkeypatch.setenv("HOME", str(home))
+    module_dir = create_addon(tmpdir)
+    context = fabric.connection.Connection("localhost")
+    addon = fabsetup.fabutils.addon.Addon(module_dir, context)
+
+    addon.install_files(["~/.hello"], local=True, name="world")
+    capsys.readouterr()
+
+    addon.install_files(["~/.hello"], local=True, name="world")
+    captured = capsys.readouterr()
+    assert "* unchanged: `~/.hello`" in captured.out
+
+    addon.install_file("~/.hello", local=True, name="world")
+    captured = capsys.readouterr()
+    assert "* unchanged: `~/.hello`" in captured.out
+
+    addon.install_files(["~/.hello"], local=True, name="fabsetup")
+    captured = capsys.readouterr()
+    assert "unchanged" not in captured.out
+    assert home.join(".hello").read() == "hello fabsetup\n"
+
+
+def test_sha256sums_single_command(tmpdir, monkeypatch):
+
+    module_dir = create_addon(tmpdir)
+    context = fabric.connection.Connection("localhost")
+    addon = fabsetup.fabutils.addon.Addon(module_dir, context)
+
+    commands = []
+
+    def run(command, *args, **kwargs):
+        # execute "remote" command locally
+        commands.append((command, kwargs))
+        return context.local(command, *args, **kwargs)
+
+    monkeypatch.setattr(context, "run", run)
+
+    existing = tmpdir.join("existing file")
+    existing.write("foo")
+    missing = tmpdir.join("missing")
+
+    sha256sums = addon._sha256sums([str(existing), str(missing)])
+
+    assert len(commands) == 1
+    assert commands[0][1]["hide"] is True
+    assert sha256sums == [
+        "2c26b46b68ffc68ff99b453c1d30413413422d706483bfa0f98a5e886266e7ae",
+        None,
+    ]
+
+
+def test_install_tar_remote(tmpdir, monkeypatch):
+
+    module_dir = create_addon(tmpdir)
+    context = fabric.connection.Connection("localhost")
+    addon = fabsetup.fabutils.addon.Addon(module_dir, context)
+
+    tar_filenames = []
+
+    def run(command, *args, **kwargs):
+        # execute "remote" command locally
+        return context.local(command, *args, **kwargs)
+
+    def put(local, remote):
+        tar_filenames.append(remote)
+        assert os.stat(remote).st_mode & 0o777 == 0o600
+        with open(remote, "wb") as fh:
+            fh.write(local.read())
+
+    monkeypatch.setattr(context, "run", run)
+    monkeypatch.setattr(context, "put", put)
+
+    data = addon._tar_archives([(str(tmpdir.join("x")), b"x", module_dir)])["/"]
+    addon._install_tar_remote(str(tmpdir.mkdir("target")), data, sudo=False)
+    assert tmpdir.join("target", str(tmpdir.join("x")).lstrip("/")).read() == "x"
+
+    # the archive is removed even if tar fails
+    with pytest.raises(invoke.exceptions.UnexpectedExit):
+        addon._install_tar_remote(str(tmpdir.join("missing")), data, sudo=False)
+
+    assert len(tar_filenames) == 2
+    assert not any(os.path.exists(filename) for filename in tar_filenames)
+
+
+def test_install_remote_creates_parent_dir(tmpdir, monkeypatch):
+
+    module_dir = create_addon(tmpdir)
+    context = fabric.connection.Connection("localhost")
+    addon = fabsetup.fabutils.addon.Addon(module_dir, context)
+
+    commands = []
+    monkeypatch.setattr(
+        context, "run", lambda command, **kwargs: commands.append(command)
+    )
+    monkeypatch.setattr(context, "put", lambda local, remote: commands.append("put"))
+
+    # the parent dir exists locally, but not necessarily on the remote host
+    addon._install_remote("hello", str(tmpdir.join("hello")))
+
+    assert commands == ["mkdir -p {}".format(tmpdir), "put"]
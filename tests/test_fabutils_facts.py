@@ -0,0 +1,126 @@
+import hashlib
+
+import fabric
+import invoke
+
+import fabsetup.fabutils.facts
+import fabsetup.task
+
+
+class CountingRun:
+    def __init__(self):
+        self.run = invoke.Context().run
+        self.scripts = []
+
+    def __call__(self, script, *args, **kwargs):
+        self.scripts.append(script)
+        return self.run(script, *args, **kwargs)
+
+
+def test_host_facts(tmpdir):
+
+    tmpdir.join("file").write("content")
+    tmpdir.mkdir("dir")
+    run = CountingRun()
+    facts = fabsetup.fabutils.facts.HostFacts(
+        run, "user@localhost", directory=str(tmpdir.join("facts"))
+    )
+
+    # one round trip for all facts
+    facts.gather(
+        which=["sh", "nonexistent-command"],
+        paths=[str(tmpdir.join("dir")), str(tmpdir.join("nonexistent"))],
+        sha256=[str(tmpdir.join("file"))],
+    )
+    assert len(run.scripts) == 1
+    assert facts.which("sh").endswith("/sh")
+    assert facts.which("nonexistent-command") == ""
+    assert facts.is_dir(str(tmpdir.join("dir")))
+    assert not facts.exists(str(tmpdir.join("nonexistent")))
+    assert facts.sha256(str(tmpdir.join("file"))) == (
+        hashlib.sha256(b"content").hexdigest()
+    )
+    assert facts.get("os")
+    assert len(run.scripts) == 1
+
+    # a not yet gathered fact costs one more round trip, without base facts
+    assert facts.exists(str(tmpdir.join("file")))
+    assert len(run.scripts) == 2
+    assert "uname" not in run.scripts[1]
+
+    # the next run answers from the on-disk cache
+    run = CountingRun()
+    cached = fabsetup.fabutils.facts.HostFacts(
+        run, "user@localhost", directory=str(tmpdir.join("facts"))
+    )
+    assert cached.which("sh") == facts.which("sh")
+    assert run.scripts == []
+
+    # expired facts are gathered again
+    expired = fabsetup.fabutils.facts.HostFacts(
+        run, "user@localhost", directory=str(tmpdir.join("facts")), ttl=0.0
+    )
+    expired.which("sh")
+    assert len(run.scripts) == 1
+
+    # invalidated facts are gathered again
+    cached.invalidate()
+    assert not cached.facts
+    assert not tmpdir.join("facts", "user_localhost.json").exists()
+    cached.which("sh")
+    assert len(run.scripts) == 2
+    assert tmpdir.join("facts", "user_localhost.json").exists()
+
+
+def test_invalidate_facts_next_run(tmpdir):
+
+    marker = str(tmpdir.join("marker"))
+    directory = str(tmpdir.join("facts"))
+    run = CountingRun()
+
+    # first run: the command creates the marker after its fact was gathered
+    facts = fabsetup.fabutils.facts.HostFacts(run, "localhost", directory=directory)
+    assert not facts.exists(marker)
+    run("touch {}".format(marker))
+    facts.invalidate()
+    facts.invalidate()  # idempotent
+
+    # second run
+    facts = fabsetup.fabutils.facts.HostFacts(run, "localhost", directory=directory)
+    assert facts.exists(marker)
+
+
+def test_invalidate_facts():
+
+    c = invoke.Context()
+    run = CountingRun()
+    fabsetup.task.attach_facts(c, run, "user@localhost")
+    c.facts.get("os")
+
+    # commands of another run method do not change the host
+    fabsetup.task.invalidate_facts(c, run_method=print)
+    assert c.facts.facts
+
+    fabsetup.task.invalidate_facts(c, run_method=run)
+    assert not c.facts.facts
+
+
+def test_facts_per_host():
+
+    seen = []
+
+    @fabsetup.task.task
+    def mytask(c):
+        """docstring of mytask"""
+        seen.append((c, c.facts))
+
+    # the connections of all hosts share one config, cf. invoke's Executor
+    config = fabric.Config()
+    for user in ["user1", "user2"]:
+        mytask(fabric.Connection("localhost", user=user, config=config))
+
+    (c1, facts1), (c2, facts2) = seen
+    assert facts1 is not facts2
+    assert facts1.run.__self__ is c1
+    assert facts2.run.__self__ is c2
+    assert "facts" not in config
@@ -0,0 +1,88 @@
+import fabric
+import invoke
+import pytest
+
+import fabsetup.fabutils.pipeline
+import fabsetup.task
+
+
+def test_shell_session_framing():
+
+    session = fabsetup.fabutils.pipeline.ShellSession(invoke.Context().run)
+
+    # output without trailing newline, on stdout and stderr
+    res = session.run("printf foo; printf bar >&2; (exit 3)", hide=True, warn=True)
+    assert (res.stdout, res.stderr, res.return_code) == ("foo", "bar", 3)
+
+    # output which looks like the beginning of the sentinel
+    res = session.run("printf '__fabsetup_'", hide=True)
+    assert res.stdout == "__fabsetup_"
+
+    with pytest.raises(invoke.exceptions.UnexpectedExit):
+        session.run("false", hide=True)
+
+    # commands do not read the commands sent to the shell
+    assert session.run("cat", hide=True).stdout == ""
+
+    # `exit` terminates the session
+    assert session.run("exit 5", hide=True, warn=True).return_code == 5
+    assert not session.alive
+    assert session.close() == 5
+
+
+def test_pipeline_wrapped_run_method(capsys):
+
+    c = invoke.Context()
+    run_calls = []
+    run_method = c.run
+
+    def spy_run(cmd, *args, **kwargs):
+        run_calls.append(cmd)
+        return run_method(cmd, *args, **kwargs)
+
+    fabsetup.task.attach_pipeline(c, spy_run)
+    run = fabsetup.task.wrapped_run_method(
+        c, spy_run, remote=False, local_cmd_formatter="{cmd}"
+    )
+
+    with c.pipeline():
+        run("cd /tmp")
+        run("pwd")
+        run("echo error >&2; false", warn=True)
+        run("pwd", pty=False)  # not supported by the session
+    run("pwd")
+
+    # one shell for the three commands of the pipeline
+    assert run_calls == ["/bin/sh", "pwd", "pwd"]
+
+    captured = capsys.readouterr()
+    codeblocks = captured.out.split("```sh\n")[1:]
+    assert len(codeblocks) == 5
+    assert codeblocks[1].endswith("\n/tmp\n```\n\n")
+    assert captured.err == "error\n"
+    assert "[1]" in codeblocks[2]
+    assert "/tmp" not in codeblocks[3]
+
+
+def test_pipeline_per_host(capsys):
+
+    seen = []
+
+    @fabsetup.task.task
+    def mytask(c):
+        """docstring of mytask"""
+        with c.pipeline() as session:
+            seen.append((c, c.pipeline, session, c.run("echo piped").stdout))
+
+    # the connections of all hosts share one config, cf. invoke's Executor
+    config = fabric.Config()
+    for user in ["user1", "user2"]:
+        mytask(fabric.Connection("localhost", user=user, config=config))
+
+    (c1, pipeline1, session1, out1), (c2, pipeline2, session2, out2) = seen
+    assert pipeline1 is not pipeline2
+    assert pipeline1.run.__self__ is c1
+    assert pipeline2.run.__self__ is c2
+    assert session1 is not session2
+    assert out1 == out2 == "piped\n"
+    assert "pipeline" not in config
@@ -0,0 +1,55 @@
+import fabsetup.history
+import fabsetup.utils.timing
+
+
+def create_nodes(host, return_code):
+    task = fabsetup.utils.timing.TimingNode("task", "hello", host=host)
+    command = fabsetup.utils.timing.TimingNode("command", "apt-get update", host=host)
+    for node in (task, command):
+        node.start()
+        node.stop()
+    command.return_code = return_code
+    return [task, command]
+
+
+def test_history(tmpdir):
+
+    history = fabsetup.history.History(str(tmpdir.join("runs", "history.sqlite3")))
+
+    for started, hosts, exit_code in [
+        (1000.0, ["web1"], 0),
+        (2000.0, ["web1", "web2"], 1),
+        (3000.0, ["web2"], 1),
+        (4000.0, ["web1"], 0),
+    ]:
+        history.record(
+            started=started,
+            wall=1.5,
+            command="fabsetup -H {} me.hello".format(",".join(hosts)),
+            tasks=["me.hello"],
+            hosts=hosts,
+            exit_code=exit_code,
+            outfile="",
+            nodes=create_nodes(hosts[-1], exit_code and 100),
+        )
+
+    # when did task me.hello last fail on host web1?
+    runs = history.runs(task="me.hello", host="web1", failed=True)
+    assert [run["started"] for run in runs] == [2000.0]
+    assert runs[0]["hosts"] == ["web1", "web2"]
+
+    assert [run["started"] for run in history.runs(limit=2)] == [4000.0, 3000.0]
+    assert history.runs(task="other") == []
+
+    commands = history.commands("apt-get", failed=True)
+    assert [(row["host"], row["return_code"]) for row in commands] == [
+        ("web2", 100),
+        ("web2", 100),
+    ]
+
+    markdown = history.query_markdown("task=me.hello,failed,limit=1")
+    assert markdown.startswith("| Run | Started | Tasks |")
+    assert len(markdown.splitlines()) == 3
+    assert "| me.hello | web2 | 1.500 | 1 |" in markdown
+
+    history.close()
@@ -1,4 +1,6 @@
 import collections
+import subprocess
+import sys
 
 import fabsetup.__init__
 
@@ -52,3 +54,46 @@ def test_version_str():
     assert "\nfabric==" in version_str
     assert "\nparamiko==" in version_str
     assert "\ninvoke==" in version_str
+
+
+# Budget for the cumulative import time of the fabsetup package in
+# microseconds, measured with `python -X importtime -c "import fabsetup"`.
+IMPORT_TIME_BUDGET_US = 50000
+
+HEAVY_MODULES = ["cryptography", "fabric", "invoke", "paramiko"]
+
+
+def import_times(statement):
+    """Run ``statement`` in a fresh interpreter and return the cumulative
+    import times (in microseconds) of all imported modules as dict.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_import_time():
+    times = import_times("import fabsetup")
+
+    for module in HEAVY_MODULES:
+        assert module not in times, "import fabsetup imports {}".format(module)
+
+    assert times["fabsetup"] < IMPORT_TIME_BUDGET_US
+
+
+def test_import_utils_time():
+    times = import_times("import fabsetup.utils.outfile, fabsetup.print")
+
+    for module in HEAVY_MODULES:
+        assert module not in times
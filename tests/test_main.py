@@ -1,9 +1,10 @@
 import sys
 
-# import pytest
+import pytest
 
 import fabsetup.main
 import fabsetup.__main__
+import fabsetup.utils.outfile
 
 
 # # # test main.py # # #
@@ -18,12 +19,20 @@ def test_defaults():
             "basename_formatter": "fabsetup_{now}{tasks}{hosts}.md",
             "now_format": "%F_%H-%M-%S",
             "name": "",
+            "compression": "",
+            "truncate": {
+                "head": 0,
+                "tail": 0,
+                "spill": True,
+            },
+            "per_host": False,
             "keep_color": False,
             "pandoc": {
                 "command": "pandoc",
                 "html": {
                     "dir": "",
                     "name": "",
+                    "live": False,
                     "css": {
                         "disabled": False,
                         "inline": True,
@@ -35,6 +44,8 @@ def test_defaults():
             },
             "prepend_executed_fabsetup_command": True,
             "fabsetup_command_prefix": "*Executed fabsetup command:*\n\n",
+            "events": "",
+            "trace_file": "",
             "command_output_prefix": "(stdout) ",
             "command_errput_prefix": "(STDERR) ",
         },
@@ -58,21 +69,44 @@ def test_defaults():
             "numbered": True,
             "numbered_state": "0",
             "task_depth": 1,
+            "timing": False,
+            "timing_summary": 0,
         },
         "run": {
             "interactive": False,
+            "parallel": 1,
+            "subtask_workers": 4,
+            "ssh_command": "ssh -o BatchMode=yes -o ControlMaster=auto "
+            "-o ControlPersist=60 -o ControlPath=~/.ssh/fabsetup-%C",
         },
         "load_invoke_tasks_file": False,
         "load_fabric_fabfile": False,
         # "search_root": None,
         "run_before": "",
         "run_finally": "",
+        "history": {
+            "file": "~/.fabsetup-runs/history.sqlite3",
+            "record": False,
+        },
+        "checkpoint": {
+            "dir": "~/.fabsetup-runs/checkpoints",
+            "resume": False,
+        },
+        "facts_cache": {
+            "dir": "~/.fabsetup-runs/facts",
+            "ttl": 3600,
+        },
     }
 
 
 # # # test __main__.py # # #
 
 
+def test_main_namespace_is_created_on_call():
+    # no collection is built on `import fabsetup.__main__`
+    assert fabsetup.__main__.main.__defaults__ == (None,)
+
+
 def test_print_version(capsys, monkeypatch):
     monkeypatch.setattr(sys, "argv", ["program-name", "--version"])
 
@@ -147,3 +181,72 @@ def test_main_info(capsys, monkeypatch):
 
     for text in ["program-name", "Versions", "Help", "List tasks", "Show task help"]:
         assert text in captured.out
+
+
+def test_outfile_header(tmpdir, monkeypatch, run_fabsetup):
+    source = "\n".join(
+        [
+            "from fabsetup.task import task",
+            "",
+            "",
+            "@task",
+            "def mytask(c):",
+            '    """docstring of mytask"""',
+            "",
+        ]
+    )
+    prepended = []
+    prepend_to_file = fabsetup.utils.outfile.prepend_to_file
+
+    def prepend_once(filename, text):
+        prepended.append(text)
+        prepend_to_file(filename, text)
+
+    monkeypatch.setattr(fabsetup.utils.outfile, "prepend_to_file", prepend_once)
+    monkeypatch.setenv("FABSETUP_OUTFILE_PANDOC_TOC", "1")
+    outfile = tmpdir.join("run.md")
+
+    run_fabsetup(source, ["--outfile", str(outfile), "mytask"])
+
+    assert len(prepended) == 1
+    content = outfile.read()
+    command = content.index("```\nfabsetup --outfile")
+    toc = content.index("-   [1 mytask](#mytask)")
+    line = content.index("----\n")
+    heading = content.index("# 1 mytask")
+    assert command < toc < line < heading
+
+
+FAILING_FABFILE = """\
+from fabsetup.task import task
+
+
+@task
+def failing(c):
+    \"\"\"docstring of failing\"\"\"
+    c.run("exit 3")
+"""
+
+
+def test_history_invalid_filter(tmpdir, monkeypatch, capsys):
+    monkeypatch.setenv("FABSETUP_HISTORY_FILE", str(tmpdir.join("history.sqlite3")))
+    monkeypatch.setattr(sys, "argv", ["program-name", "--history", "bogus"])
+
+    with pytest.raises(SystemExit) as exc_info:
+        fabsetup.__main__.main()
+
+    assert exc_info.value.code == 2
+    assert "unknown history filter: 'bogus'" in capsys.readouterr().err
+
+
+def test_history_not_recorded(tmpdir, monkeypatch, capsys, run_fabsetup):
+    # a directory can not be opened as sqlite database
+    monkeypatch.setenv("FABSETUP_HISTORY_FILE", str(tmpdir.mkdir("history")))
+    monkeypatch.setenv("FABSETUP_HISTORY_RECORD", "1")
+
+    with pytest.raises(SystemExit) as exc_info:
+        run_fabsetup(FAILING_FABFILE, ["failing"])
+
+    # the exit code of the run is kept
+    assert exc_info.value.code == 3
+    assert "run not recorded in the history: " in capsys.readouterr().err
@@ -1,16 +1,23 @@
 import collections
 import getpass
 import importlib
+import io
 import os
+import re
 import socket
 import sys
+import threading
 
 import fabric.main
+import invoke.context
 import invoke.main
+import pytest
 
 import fabsetup.__main__
 import fabsetup.task
 import fabsetup.utils.colors
+import fabsetup.utils.outfile
+import fabsetup.utils.timing
 
 from tests.test_utils_decorators import MockContext
 
@@ -671,6 +678,131 @@ some output
     )
 
 
+def test_run_subtasks(capsys):
+
+    c = invoke.context.Context()
+    c.config.output = {"numbered": True, "numbered_state": "1.0", "task_depth": 2}
+    started = []
+    second_started = threading.Event()
+
+    @fabsetup.task.subtask(
+        color=fabsetup.utils.colors.no_color, doc=False, name="first"
+    )
+    def first(c):
+        started.append("first")
+        # runs concurrently with the independent subtask second
+        assert second_started.wait(timeout=10)
+        print("output of first")
+        return 1
+
+    @fabsetup.task.subtask(
+        color=fabsetup.utils.colors.no_color, doc=False, name="second"
+    )
+    def second(c):
+        started.append("second")
+        second_started.set()
+        print("output of second")
+        return 2
+
+    @fabsetup.task.subtask(
+        color=fabsetup.utils.colors.no_color, doc=False, name="third", after=[first]
+    )
+    def third(c):
+        started.append("third")
+        print("output of third")
+        return 3
+
+    timings = fabsetup.utils.timing.Timings()
+    timings.reset()
+    with timings.measure("task", "mytask"):
+        results = fabsetup.task.run_subtasks(c, [first, second, third], workers=3)
+
+    assert results == [1, 2, 3]
+    assert started.index("third") > started.index("first")
+    assert capsys.readouterr().out == (
+        "\n## 1.1 first\n\noutput of first\n"
+        "\n## 1.2 second\n\noutput of second\n"
+        "\n## 1.3 third\n\noutput of third\n"
+    )
+    # numbering continues after the subtasks
+    assert c.config.output.numbered_state == "1.3"
+    # subtasks are recorded as children of the calling task
+    task = timings.root.children[0]
+    assert sorted(node.name for node in task.children) == [
+        "first",
+        "second",
+        "third",
+    ]
+
+    # dependencies have to be listed first
+    with pytest.raises(ValueError):
+        fabsetup.task.run_subtasks(c, [third, first])
+
+
+def test_run_subtasks_failed(capsys):
+
+    c = invoke.context.Context()
+
+    @fabsetup.task.subtask(color=fabsetup.utils.colors.no_color, doc=False)
+    def failing(c):
+        print("before failure")
+        raise RuntimeError("failed")
+
+    @fabsetup.task.subtask(
+        color=fabsetup.utils.colors.no_color, doc=False, after=[failing]
+    )
+    def dependent(c):
+        print("not started")
+
+    with pytest.raises(RuntimeError):
+        fabsetup.task.run_subtasks(c, [failing, dependent], workers=2)
+
+    out = capsys.readouterr().out
+    assert "before failure" in out
+    assert "not started" not in out
+
+
+def test_resume_subtasks(capsys, tmpdir):
+
+    executed = []
+    fail = [True]
+
+    @fabsetup.task.subtask(color=fabsetup.utils.colors.no_color, doc=False)
+    def step(c, number):
+        executed.append(number)
+        if number == 3 and fail[0]:
+            raise RuntimeError("transient failure")
+
+    def run(resume):
+        c = invoke.context.Context()
+        c.config.output = {"numbered": True, "numbered_state": "0"}
+        c.config.checkpoint = {"dir": str(tmpdir), "resume": resume}
+        with fabsetup.task.task_checkpoint(c, "mytask"):
+            for number in range(1, 5):
+                step(c, number)
+
+    with pytest.raises(RuntimeError):
+        run(resume=False)
+    assert executed == [1, 2, 3]
+    assert tmpdir.join("mytask_local.json").exists()
+    capsys.readouterr()
+
+    # completed steps 1 and 2 are skipped
+    executed.clear()
+    fail[0] = False
+    run(resume=True)
+    assert executed == [3, 4]
+    out = capsys.readouterr().out
+    assert "2 test_resume_subtasks.<locals>.step\n\n*Skipped" in out
+    # the checkpoint of the completed task is removed
+    assert not tmpdir.join("mytask_local.json").exists()
+
+    # after a completed run nothing is skipped
+    executed.clear()
+    run(resume=True)
+    assert executed == [1, 2, 3, 4]
+
+
 # def mysubsubtask():
 #     """This is my subsubtask"""
 #     print("another output")
@@ -818,3 +950,117 @@ some output
 #     decorated()
 # trace_msg = "got multiple values for keyword argument 'depth'"
 # assert trace_msg in str(excinfo.value)
+
+
+class FakeTransfer:
+    """Record uploads of ``fabric.transfer.Transfer`` without a connection."""
+
+    def __init__(self, c):
+        self.c = c
+        self.sftp = self
+        self.dirs = {"."}
+        self.puts = c.puts
+
+    def is_remote_dir(self, path):
+        return path in self.dirs
+
+    def mkdir(self, path):
+        self.dirs.add(path)
+        self.puts.append(("mkdir", path))
+
+    def put(self, local, remote):
+        self.puts.append((local, remote))
+        return remote
+
+
+def test_sftp_put(tmpdir, monkeypatch, capsys):
+
+    monkeypatch.setattr(fabsetup.task.fabric.transfer, "Transfer", FakeTransfer)
+    c = AttributeDict(host="example.com", puts=[])
+
+    local_dir = tmpdir.mkdir("dotfiles")
+    local_dir.join("a").write("a")
+    local_dir.mkdir("sub").join("b").write("b")
+
+    assert fabsetup.task.sftp_put(c, str(local_dir.join("a")), "~/a") == "a"
+
+    fabsetup.task.sftp_put(c, str(local_dir), "~", recursive=True)
+
+    assert c.puts == [
+        (str(local_dir.join("a")), "a"),
+        ("mkdir", "dotfiles"),
+        (str(local_dir.join("a")), "dotfiles/a"),
+        ("mkdir", "dotfiles/sub"),
+        (str(local_dir.join("sub", "b")), "dotfiles/sub/b"),
+    ]
+    captured = capsys.readouterr()
+    assert "* put: `{}` → `example.com:a`".format(local_dir.join("a")) in captured.out
+
+
+def test_cp_put_file_like(tmpdir):
+
+    remote = tmpdir.join("remote")
+    fabsetup.task.cp_put(MockContext(), io.BytesIO(b"data"), str(remote))
+    assert remote.read() == "data"
+
+
+def test_wrapped_run_method_timing(capsys):
+
+    timings = fabsetup.utils.timing.Timings()
+    timings.reset()
+
+    context = MockContext()
+    context.config["output"] = {"timing": True}
+
+    run = fabsetup.task.wrapped_run_method(
+        context, create_mocked_run_method(3), remote=True
+    )
+    run("echo foo")
+    run("echo bar", hide=True)
+
+    captured = capsys.readouterr()
+    assert captured.out.startswith("\n```sh\nusername@hostname> ")
+    assert re.search(r"\nfoo\n\[3\]\n\(\d+\.\d{3} s\)\n```\n$", captured.out)
+
+    commands = timings.nodes(["command"])
+    assert [(node.name, node.host, node.return_code) for node in commands] == [
+        ("echo foo", "hostname", 3),
+        ("echo bar", "hostname", 3),
+    ]
+    assert all(node.wall >= 0 and node.cpu >= 0 for node in commands)
+
+
+def test_wrapped_run_method_truncate(tmpdir):
+
+    context = MockContext()
+    context.config["outfile"] = {"truncate": {"head": 2, "tail": 1}}
+
+    def noisy_run_method(cmd, **kwargs):
+        for number in range(1, 101):
+            print("line {}".format(number))
+        Result = collections.namedtuple(typename="Result", field_names=["return_code"])
+        return Result(0)
+
+    outfile = tmpdir.join("run.md")
+    tee = fabsetup.utils.outfile.Tee()
+    tee.set_outfile(str(outfile), strip_color_codes=True)
+    tee.start()
+    try:
+        run = fabsetup.task.wrapped_run_method(context, noisy_run_method, remote=False)
+        run("noisy")
+        run("noisy", truncate_head=0, truncate_tail=0)
+    finally:
+        tee.stop()
+
+    spill_file = tmpdir.join("run.d", "command-0001.txt")
+    codeblocks = outfile.read().split("```sh\n")[1:]
+    assert codeblocks[0].split("\n", 1)[1] == (
+        "line 1\nline 2\n"
+        "[... 97 lines omitted, full output: {} ...]\n"
+        "line 100\n```\n\n".format(spill_file)
+    )
+    assert codeblocks[1].count("\nline ") == 100
+    assert spill_file.read() == "".join(
+        "line {}\n".format(number) for number in range(1, 101)
+    )
+    assert tmpdir.join("run.d").listdir() == [spill_file]
@@ -0,0 +1,46 @@
+import json
+
+import fabsetup.utils.events
+import fabsetup.utils.timing
+
+
+def test_event_log(tmpdir):
+
+    events = fabsetup.utils.events.EventLog()
+    timings = fabsetup.utils.timing.Timings()
+    timings.reset()
+
+    # disabled: nothing happens
+    events.emit("ignored")
+
+    events_file = tmpdir.join("logs", "events.jsonl")
+    events.open(str(events_file))
+    try:
+        with timings.measure("task", "mytask", host="host"):
+            with timings.measure("command", "echo foo", host="host") as command:
+                command.return_code = 0
+                command.args["stdout_bytes"] = 4
+    finally:
+        events.close()
+
+    assert not events.enabled
+
+    lines = [json.loads(line) for line in events_file.read().splitlines()]
+
+    assert [(line["event"], line["name"]) for line in lines] == [
+        ("task_start", "mytask"),
+        ("command_start", "echo foo"),
+        ("command_end", "echo foo"),
+        ("task_end", "mytask"),
+    ]
+    assert lines[2]["return_code"] == 0
+    assert lines[2]["stdout_bytes"] == 4
+    assert lines[2]["host"] == "host"
+    assert lines[3]["wall"] >= lines[2]["wall"]
+    assert all(line["thread"] == "MainThread" for line in lines)
+
+    # append-only
+    events.open(str(events_file))
+    events.emit("run_end", exit_code=0)
+    events.close()
+    assert len(events_file.read().splitlines()) == 5
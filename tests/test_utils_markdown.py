@@ -0,0 +1,363 @@
+import os.path
+import shutil
+import subprocess
+import time
+
+import pytest
+
+import fabsetup.utils.markdown
+import fabsetup.utils.outfile
+import fabsetup.utils.pandoc
+
+OUTFILE = """\
+*Executed fabsetup command:*
+
+    fabsetup --outfile out.md me.hello
+
+----
+
+# 1 Hello Task
+
+Say *hello* to [fabsetup](https://github.com/theno/fabsetup).
+
+## 1.1 Run `echo`
+
+```sh
+echo "<hello> & 'bye'"
+```
+
+```
+(stdout) <hello> & 'bye'
+```
+
+* first
+* second
+    * nested
+* third
+
+----
+
+# Timing Summary
+
+| Task | Host | Wall [s] |
+|---|---|--:|
+| me.hello | web\\|1 | 0.123 |
+"""
+
+
+def render(markdown):
+    html = []
+    fabsetup.utils.markdown.render_html_body(markdown.splitlines(), html.append)
+    return "".join(html)
+
+
+def test_render_html_body():
+
+    html = render(OUTFILE)
+
+    assert "<pre><code>fabsetup --outfile out.md me.hello</code></pre>" in html
+    assert html.count("<hr />") == 2
+    assert '<h1 id="hello-task">1 Hello Task</h1>' in html
+    assert '<h2 id="run-echo">1.1 Run <code>echo</code></h2>' in html
+    assert (
+        '<p>Say <em>hello</em> to <a href="https://github.com/theno/fabsetup">'
+        "fabsetup</a>.</p>"
+    ) in html
+    assert (
+        '<pre class="sh"><code>echo "&lt;hello&gt; &amp; \'bye\'"</code></pre>'
+    ) in html
+    assert "<pre><code>(stdout) &lt;hello&gt; &amp; 'bye'</code></pre>" in html
+    assert (
+        "<ul>\n<li>first</li>\n<li>second\n<ul>\n<li>nested</li>\n</ul>\n"
+        "</li>\n<li>third</li>\n</ul>\n"
+    ) in html
+    assert '<th style="text-align: right;">Wall [s]</th>' in html
+    assert "<td>web|1</td>" in html
+    assert '<td style="text-align: right;">0.123</td>' in html
+
+
+def test_render_unclosed_blocks():
+
+    assert render("```\nfoo") == "<pre><code>foo</code></pre>\n"
+    assert render("foo\nbar") == "<p>foo\nbar</p>\n"
+    assert render("a | b\nno table") == "<p>a | b\nno table</p>\n"
+
+
+def test_create_html(tmpdir):
+
+    markdown_file = tmpdir.join("out.md")
+    markdown_file.write(OUTFILE)
+    css_file = tmpdir.join("style.css")
+    css_file.write("pre.sh { color: red; }\n")
+    after_body = tmpdir.join("script.js")
+    after_body.write("<script></script>\n")
+
+    # fragment only, as pandoc without --standalone
+    html_file = tmpdir.join("html", "fragment.html")
+    assert fabsetup.utils.markdown.create_html(
+        str(markdown_file), str(html_file), after_body=str(after_body)
+    )
+    fragment = html_file.read()
+    assert fragment.startswith("<p><em>Executed fabsetup command:</em></p>")
+    assert fragment.endswith("<script></script>\n")
+
+    # standalone with inlined css
+    html_file = tmpdir.join("html", "standalone.html")
+    fabsetup.utils.markdown.create_html(
+        str(markdown_file), str(html_file), css_url=str(css_file), inline=True
+    )
+    standalone = html_file.read()
+    assert standalone.startswith("<!DOCTYPE html>")
+    assert "<title>standalone</title>" in standalone
+    assert "pre.sh { color: red; }" in standalone
+    assert standalone.endswith("</body>\n</html>\n")
+
+
+def test_create_html_from_compressed_outfile(tmpdir):
+
+    markdown_file = tmpdir.join("out.md.gz")
+    with fabsetup.utils.outfile.open_outfile(str(markdown_file), "w") as fh:
+        fh.write(OUTFILE)
+    html_file = tmpdir.join("out.html")
+
+    pandoc = fabsetup.utils.pandoc.Pandoc(fabsetup.utils.markdown.BUILTIN)
+    assert pandoc.add_toc(str(markdown_file))
+    assert pandoc.create_html(str(markdown_file), str(html_file))
+
+    assert '<a href="#hello-task">1 Hello Task</a>' in html_file.read()
+    assert render(OUTFILE) in html_file.read()
+
+
+def test_add_toc(tmpdir):
+
+    markdown_file = tmpdir.join("out.md")
+    markdown_file.write(OUTFILE)
+
+    assert fabsetup.utils.markdown.add_toc(str(markdown_file))
+
+    toc = markdown_file.read().split("\n\n")[0]
+    assert toc.splitlines() == [
+        "-   [1 Hello Task](#hello-task)",
+        "    -   [1.1 Run `echo`](#run-echo)",
+        "-   [Timing Summary](#timing-summary)",
+    ]
+    assert markdown_file.read().endswith(OUTFILE)
+
+
+def test_live_html(tmpdir):
+
+    after_body = tmpdir.join("script.js")
+    after_body.write("<script></script>\n")
+    html_file = tmpdir.join("html", "live.html")
+
+    live_html = fabsetup.utils.markdown.LiveHtml(
+        str(html_file), after_body=str(after_body), refresh=3, header_size=0
+    )
+    first_section, rest = OUTFILE.split("```sh")
+    live_html.feed(first_section)
+
+    # completed sections and the tail have been written
+    html = html_file.read()
+    assert '<meta name="fabsetup-live" content="3" />' in html
+    assert "http-equiv" not in html
+    assert '<h1 id="hello-task">1 Hello Task</h1>' in html
+    assert "run-echo" not in html
+    assert html.endswith("<script></script>\n</body>\n</html>\n")
+
+    for char in "```sh" + rest:
+        live_html.feed(char)
+    live_html.close()
+
+    html = html_file.read()
+    assert '<meta name="fabsetup-live"' not in html
+    assert html.count("</html>") == 1
+    body = html.split("<body>\n")[1].split("<script></script>")[0]
+    assert body == "\n" + render(OUTFILE)
+
+
+@pytest.mark.parametrize("header_size", [16 * 1024, 10])
+def test_live_html_header(tmpdir, header_size):
+
+    html_file = tmpdir.join("live.html")
+    preamble, rest = OUTFILE.split("----\n", 1)
+    header = preamble + "-   [1 Hello Task](#hello-task)\n\n"
+
+    live_html = fabsetup.utils.markdown.LiveHtml(
+        str(html_file), preamble=preamble, header_size=header_size
+    )
+    assert render(preamble) in html_file.read()
+    inode = html_file.stat().ino
+
+    live_html.feed("----\n" + rest)
+    live_html.close(header)
+
+    html = html_file.read()
+    assert '<meta name="fabsetup-live"' not in html
+    body = html.split("<body>\n")[1].split("</body>")[0]
+    assert body.startswith(render(header))
+    assert body[len(render(header)) :].lstrip() == render("----\n" + rest)
+    # the header is written in place if it fits into the reserved space
+    assert (html_file.stat().ino == inode) == (header_size > 10)
+
+
+def test_table_of_contents_fed_in_pieces():
+
+    toc = fabsetup.utils.markdown.TableOfContents()
+    for char in OUTFILE:
+        toc.feed(char)
+    toc.close()
+
+    assert toc.headings == [
+        (1, "1 Hello Task"),
+        (2, "1.1 Run `echo`"),
+        (1, "Timing Summary"),
+    ]
+
+    toc = fabsetup.utils.markdown.TableOfContents()
+    toc.feed("no heading\n")
+    assert toc.markdown() == ""
+
+
+def test_pandoc_builtin(tmpdir):
+
+    pandoc = fabsetup.utils.pandoc.Pandoc(fabsetup.utils.markdown.BUILTIN)
+    assert pandoc.command_available()
+
+    markdown_file = tmpdir.join("out.md")
+    markdown_file.write(OUTFILE)
+    html_file = tmpdir.join("out.html")
+
+    assert pandoc.add_toc(str(markdown_file))
+    assert pandoc.create_html(
+        str(markdown_file), str(html_file), css_url="", inline=True
+    )
+    html = html_file.read()
+    assert '<a href="#hello-task">1 Hello Task</a>' in html
+    # script of html-script.js is included after the body
+    assert "collapse_expand" in html
+
+
+def test_render_runs(tmpdir):
+    tmpdir.join("run1.md").write(OUTFILE)
+    tmpdir.join("run1.d").mkdir()
+    with fabsetup.utils.outfile.open_outfile(
+        str(tmpdir.join("run1.d", "host1.md.gz")), "w"
+    ) as fh:
+        fh.write(OUTFILE)
+    tmpdir.join("run1.d", "command-0001.txt").write("spilled output")
+
+    def render():
+        return fabsetup.utils.pandoc.render_runs(
+            str(tmpdir), command=fabsetup.utils.markdown.BUILTIN, workers=2
+        )
+
+    results = render()
+    assert results == [
+        (str(tmpdir.join("run1.md")), str(tmpdir.join("run1.html")), "created"),
+        (
+            str(tmpdir.join("run1.d", "host1.md.gz")),
+            str(tmpdir.join("run1.d", "host1.html")),
+            "created",
+        ),
+    ]
+    assert "Hello Task" in tmpdir.join("run1.d", "host1.html").read()
+
+    assert [result[2] for result in render()] == ["up to date", "up to date"]
+
+    mtime = tmpdir.join("run1.html").mtime()
+    tmpdir.join("run1.md").setmtime(mtime + 1)
+    assert [result[2] for result in render()] == ["created", "up to date"]
+
+
+def test_big_outfile_builtin_vs_pandoc(tmpdir):
+
+    markdown_file = tmpdir.join("big.md")
+    markdown_file.write(OUTFILE * 500)  # about 250 KiB
+
+    fabsetup.utils.markdown.create_html(
+        str(markdown_file), str(tmpdir.join("builtin.html")), inline=True
+    )
+    builtin = tmpdir.join("builtin.html").read()
+    assert builtin.count("<h2 ") == 500
+    assert builtin.count("</html>") == 1
+
+    pandoc_command = shutil.which("pandoc")
+    if not pandoc_command:
+        pytest.skip("pandoc not installed, no comparison")
+
+    subprocess.run(
+        [
+            pandoc_command,
+            "--from",
+            "markdown",
+            "--to",
+            "html",
+            "--standalone",
+            "--output",
+            str(tmpdir.join("pandoc.html")),
+            str(markdown_file),
+        ],
+        check=True,
+    )
+    pandoc = tmpdir.join("pandoc.html").read()
+    assert builtin.count("<h2 ") == pandoc.count("<h2 ")
+
+
+def test_render_runs_dotted_hosts(tmpdir):
+
+    runs = tmpdir.join("runs")
+    runs.join("run.d", "fabsetup_me-hello_web1.example.com.md").write(
+        OUTFILE, ensure=True
+    )
+    runs.join("run.d", "fabsetup_me-hello_web2.example.com.md").write(OUTFILE)
+
+    results = fabsetup.utils.pandoc.render_runs(
+        str(runs), command="builtin", html_dir=str(tmpdir.join("html")), workers=1
+    )
+
+    assert [os.path.basename(filename_to) for _, filename_to, _ in results] == [
+        "fabsetup_me-hello_web1.example.com.html",
+        "fabsetup_me-hello_web2.example.com.html",
+    ]
+    assert [status for _, _, status in results] == ["created", "created"]
+
+
+@pytest.mark.benchmark
+def test_benchmark_builtin_vs_pandoc(tmpdir):
+
+    markdown_file = tmpdir.join("big.md")
+    markdown_file.write(OUTFILE * 500)  # about 250 KiB
+    size = markdown_file.size()
+
+    start = time.perf_counter()
+    fabsetup.utils.markdown.create_html(
+        str(markdown_file), str(tmpdir.join("builtin.html")), inline=True
+    )
+    builtin = time.perf_counter() - start
+    print(
+        "\nbuiltin: {:.3f} s ({:.1f} MB/s)".format(builtin, size / builtin / 1e6),
+        end="",
+    )
+
+    pandoc_command = shutil.which("pandoc")
+    if not pandoc_command:
+        print()
+        pytest.skip("pandoc not installed, no comparison")
+
+    start = time.perf_counter()
+    subprocess.run(
+        [
+            pandoc_command,
+            "--from",
+            "markdown",
+            "--to",
+            "html",
+            "--standalone",
+            "--output",
+            str(tmpdir.join("pandoc.html")),
+            str(markdown_file),
+        ],
+        check=True,
+    )
+    pandoc = time.perf_counter() - start
+    print(", pandoc: {:.3f} s ({:.1f} MB/s)".format(pandoc, size / pandoc / 1e6))
@@ -1,5 +1,10 @@
+import io
 import sys
 import collections
+import threading
+import time
+
+import pytest
 
 import fabsetup.utils.outfile
 
@@ -91,3 +96,371 @@ def test_stream_tee(capsys):
         # restore
         sys.stdout = default_stdout
         sys.stderr = default_stderr
+
+
+def test_output_demux(capsys):
+
+    import threading
+
+    demux = fabsetup.utils.outfile.OutputDemux()
+    demux.start()
+
+    buffers = {}
+    barrier = threading.Barrier(2)
+
+    def work(name):
+        with demux.buffered() as buffer:
+            barrier.wait()
+            for i in range(3):
+                print("{} {}".format(name, i))
+            print("{} err".format(name), file=sys.stderr)
+        buffers[name] = buffer
+
+    threads = [threading.Thread(target=work, args=(name,)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print("main")
+
+    demux.replay(buffers["b"])
+    demux.replay(buffers["a"])
+    demux.stop()
+
+    captured = capsys.readouterr()
+    assert captured.out == "main\nb 0\nb 1\nb 2\na 0\na 1\na 2\n"
+    assert captured.err == "b err\na err\n"
+
+
+def test_output_buffer_replay_prefix(capsys):
+
+    buffer = fabsetup.utils.outfile.OutputBuffer()
+    stream = buffer.stream("stdout")
+    stream.write("no prefix\n")
+    buffer.prefixes["stdout"] = "(stdout) "
+    stream.write("with prefix\n")
+
+    stdout = fabsetup.utils.outfile.stream_tee(sys.stdout, sys.stderr)
+    buffer.replay(stdout, sys.stderr)
+
+    captured = capsys.readouterr()
+    assert captured.out == "no prefix\nwith prefix\n"
+    assert captured.err == "no prefix\n(stdout) with prefix\n"
+
+
+def test_color_code_filter():
+
+    text = (
+        "\033[35m\n# task\n\033[0m\n\033[1;32mecho foo\033[0m\n"
+        "foo \033[1;31;123mbar\033[K\n\033[1"
+    )
+    expected = fabsetup.utils.outfile.remove_color_codes_str(text)
+    assert expected == "\n# task\n\necho foo\nfoo bar\n"
+
+    # split text at every position into two chunks
+    for index in range(len(text) + 1):
+        color_code_filter = fabsetup.utils.outfile.ColorCodeFilter()
+        got = (
+            color_code_filter(text[:index])
+            + color_code_filter(text[index:])
+            + color_code_filter.flush()
+        )
+        assert got == expected
+
+    # write char by char
+    color_code_filter = fabsetup.utils.outfile.ColorCodeFilter()
+    got = "".join(color_code_filter(char) for char in text) + color_code_filter.flush()
+    assert got == expected
+
+
+def test_tee_strip_color_codes(tmpdir):
+
+    default_stdout = sys.stdout
+    default_stderr = sys.stderr
+
+    for strip_color_codes, expected in [
+        (True, "red\nfoo\nbar\n"),
+        (False, "\033[31mred\033[0m\nfoo\n\033[32mbar\n"),
+    ]:
+        outfile = tmpdir.join("outfile.md")
+
+        tee = fabsetup.utils.outfile.Tee()
+        tee.set_outfile(str(outfile), strip_color_codes=strip_color_codes)
+        tee.start()
+        try:
+            print("\033[31mred\033[0m")
+            sys.stdout.write("foo\n\033[3")
+            sys.stdout.write("2mbar\n")
+        finally:
+            tee.stop()
+
+        assert outfile.read() == expected
+
+    assert sys.stdout is default_stdout
+    assert sys.stderr is default_stderr
+
+
+def test_tee_toc(tmpdir):
+
+    outfile = tmpdir.join("outfile.md")
+
+    tee = fabsetup.utils.outfile.Tee()
+    tee.set_outfile(str(outfile), strip_color_codes=True, toc=True)
+    tee.start()
+    try:
+        print("\033[35m\n# 1 task\n\033[0m")
+        print("```\n# comment in a code block\n```")
+        sys.stdout.write("\n## 1.1 sub")
+        sys.stdout.write("task\n")
+        sys.stderr.write("\n# 2 failing task\n")
+    finally:
+        tee.stop()
+
+    assert tee.toc.headings == [
+        (1, "1 task"),
+        (2, "1.1 subtask"),
+        (1, "2 failing task"),
+    ]
+    assert tee.toc.markdown() == (
+        "-   [1 task](#task)\n"
+        "    -   [1.1 subtask](#subtask)\n"
+        "-   [2 failing task](#failing-task)\n"
+    )
+
+    tee.set_outfile(str(outfile))
+    assert tee.toc is None
+
+
+def test_prepend_to_file(tmpdir):
+
+    outfile = tmpdir.join("outfile.md")
+    body = "line\n" * 100000
+    outfile.write(body)
+    outfile.chmod(0o640)
+
+    fabsetup.utils.outfile.prepend_to_file(str(outfile), "header\n\n")
+
+    assert outfile.read() == "header\n\n" + body
+    assert outfile.stat().mode & 0o777 == 0o640
+    assert tmpdir.listdir() == [outfile]
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_tee_compressed_outfile(tmpdir, compression):
+
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+    outfile = tmpdir.join(
+        fabsetup.utils.outfile.compressed_name("outfile.md", compression)
+    )
+
+    tee = fabsetup.utils.outfile.Tee()
+    tee.set_outfile(str(outfile), strip_color_codes=True)
+    tee.start()
+    try:
+        print("\033[31mred\033[0m")
+    finally:
+        tee.stop()
+    tee.resume(missed_output="missed\n")
+    try:
+        print("line\n" * 1000, end="")
+    finally:
+        tee.stop()
+
+    fabsetup.utils.outfile.prepend_to_file(str(outfile), "header\n\n")
+
+    expected = "header\n\nred\nmissed\n" + "line\n" * 1000
+    with fabsetup.utils.outfile.open_outfile(str(outfile), "r") as fh:
+        assert fh.read() == expected
+    assert outfile.size() < len(expected) / 10
+
+    stream = io.BytesIO()
+    fabsetup.utils.outfile.cat_run(str(outfile), stream)
+    assert stream.getvalue() == expected.encode()
+
+
+def test_compressed_name():
+
+    with pytest.raises(ValueError):
+        fabsetup.utils.outfile.compressed_name("outfile.md", "rar")
+
+
+def test_buffered_stream_tee_concurrent_writers():
+
+    stream1 = io.StringIO()
+    stream2 = io.StringIO()
+    buffer = fabsetup.utils.outfile.OutfileBuffer(stream2, buffer_size=100)
+    stdout = fabsetup.utils.outfile.buffered_stream_tee(stream1, buffer)
+    stderr = fabsetup.utils.outfile.buffered_stream_tee(stream1, buffer)
+
+    def writer(stream, name):
+        for index in range(1000):
+            stream.write("{} {}\n".format(name, index))
+
+    threads = [
+        threading.Thread(target=writer, args=(stream, str(index)))
+        for index, stream in enumerate([stdout, stderr, stdout, stderr])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stdout.flush_stream2()
+
+    lines = stream2.getvalue().splitlines()
+    assert stream2.getvalue() == stream1.getvalue()
+    assert len(lines) == 4000
+    for name in "0123":
+        assert [line for line in lines if line.startswith(name + " ")] == [
+            "{} {}".format(name, index) for index in range(1000)
+        ]
+
+
+def test_buffered_stream_tee_concurrent_filter():
+
+    stream1 = io.StringIO()
+    stream2 = io.StringIO()
+    tee = fabsetup.utils.outfile.buffered_stream_tee(
+        stream1,
+        fabsetup.utils.outfile.OutfileBuffer(stream2, buffer_size=100),
+        stream2_filter=fabsetup.utils.outfile.ColorCodeFilter(),
+    )
+
+    def writer(name):
+        for index in range(1000):
+            tee.write("\033[32m{} {}\033[0m\n".format(name, index))
+
+    threads = [
+        threading.Thread(target=writer, args=(str(index),)) for index in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    tee.flush_stream2()
+
+    lines = stream2.getvalue().splitlines()
+    assert "\033" not in stream2.getvalue()
+    assert lines == [
+        fabsetup.utils.outfile.remove_color_codes_str(line)
+        for line in stream1.getvalue().splitlines()
+    ]
+    for name in "0123":
+        assert [line for line in lines if line.startswith(name + " ")] == [
+            "{} {}".format(name, index) for index in range(1000)
+        ]
+
+
+def test_buffered_stream_tee_buffer():
+
+    stream1 = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+    stream2 = io.StringIO()
+    tee = fabsetup.utils.outfile.buffered_stream_tee(
+        stream1, fabsetup.utils.outfile.OutfileBuffer(stream2)
+    )
+
+    tee.write("text\n")
+    tee.buffer.write("bytes \u2713\n".encode())
+    tee.flush()
+    tee.flush_stream2()
+
+    assert stream2.getvalue() == "text\nbytes \u2713\n"
+    assert stream1.buffer.getvalue().decode() == "text\nbytes \u2713\n"
+    assert tee.buffer is tee.buffer
+
+
+def throughput(tee_class, stream2, chunk, size):
+    """Return throughput of ``tee_class`` in MB/s (best of three)."""
+    best = 0
+    for _ in range(3):
+        tee = tee_class(io.StringIO(), stream2)
+        tee.add_prefix = True
+        tee.stream2_line_prefix = "    "
+        start = time.perf_counter()
+        for _ in range(size // len(chunk)):
+            tee.write(chunk)
+            tee.flush()
+        best = max(best, size / (time.perf_counter() - start) / 1e6)
+    return best
+
+
+@pytest.mark.benchmark
+def test_buffered_stream_tee_throughput():
+
+    chunk = "x" * 79 + "\n"  # invoke reads command output in small chunks
+    size = 4 * 1000 * 1000
+
+    before = throughput(fabsetup.utils.outfile.stream_tee, io.StringIO(), chunk, size)
+    after = throughput(
+        fabsetup.utils.outfile.buffered_stream_tee,
+        fabsetup.utils.outfile.OutfileBuffer(io.StringIO()),
+        chunk,
+        size,
+    )
+    print(
+        "\nstream_tee: {:.1f} MB/s, buffered_stream_tee: {:.1f} MB/s".format(
+            before, after
+        )
+    )
+
+
+def test_output_limiter(tmpdir):
+
+    text = "".join("line {}\n".format(number) for number in range(1, 11))
+
+    for head, tail, chunks, expected in [
+        # not truncated
+        (5, 5, [text], text),
+        # partial last line
+        (1, 1, ["a\nb", "\nc\nd"], "a\n[... 1 lines omitted ...]\nc\nd"),
+        (0, 2, [text], "[... 8 lines omitted ...]\nline 9\nline 10\n"),
+        (2, 0, [text], "line 1\nline 2\n[... 8 lines omitted ...]\n"),
+    ]:
+        limiter = fabsetup.utils.outfile.OutputLimiter(head, tail)
+        assert "".join(limiter(chunk) for chunk in chunks) + limiter.close() == (
+            expected
+        )
+
+    # written char by char, with spill file
+    spill_file = tmpdir.join("spill", "command.txt.gz")
+    limiter = fabsetup.utils.outfile.OutputLimiter(3, 2, str(spill_file))
+    got = "".join(limiter(char) for char in text) + limiter.close()
+    assert got == (
+        "line 1\nline 2\nline 3\n"
+        "[... 5 lines omitted, full output: {} ...]\n"
+        "line 9\nline 10\n".format(spill_file)
+    )
+    with fabsetup.utils.outfile.open_outfile(str(spill_file)) as fh:
+        assert fh.read() == text
+
+    # no spill file if nothing is omitted
+    limiter = fabsetup.utils.outfile.OutputLimiter(3, 20, str(spill_file))
+    assert limiter(text) + limiter.close() == text
+    assert not spill_file.exists()
+
+
+def test_output_limiter_replay(tmpdir):
+
+    buffer = fabsetup.utils.outfile.OutputBuffer()
+    limiter = fabsetup.utils.outfile.OutputLimiter(1, 1)
+    buffer.write("stdout", "before\n")
+    buffer.set_limiter("stdout", limiter)
+    buffer.set_limiter("stderr", limiter)
+    buffer.write("stdout", "1\n2\n")
+    buffer.write("stderr", "3\n")
+    buffer.write("stdout", "4\n")
+    buffer.set_limiter("stderr", None)
+    buffer.close_limiter("stdout")
+    buffer.write("stdout", "after\n")
+
+    stream1, stream2 = io.StringIO(), io.StringIO()
+    outfile_buffer = fabsetup.utils.outfile.OutfileBuffer(stream2)
+    stdout = fabsetup.utils.outfile.buffered_stream_tee(stream1, outfile_buffer)
+    stderr = fabsetup.utils.outfile.buffered_stream_tee(stream1, outfile_buffer)
+    buffer.replay(stdout, stderr)
+    outfile_buffer.flush()
+
+    assert stream1.getvalue() == "before\n1\n2\n3\n4\nafter\n"
+    assert stream2.getvalue() == "before\n1\n[... 2 lines omitted ...]\n4\nafter\n"
@@ -0,0 +1,134 @@
+import json
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import fabsetup.utils.timing
+
+
+def test_timings_threads():
+
+    timings = fabsetup.utils.timing.Timings()
+    timings.reset()
+
+    def task(host):
+        with timings.measure("task", "mytask", host=host):
+            with timings.measure("command", "true", host=host) as command:
+                command.return_code = 0
+
+    with timings.measure("task", "main"):
+        threads = [
+            threading.Thread(target=task, args=(host,)) for host in ["h1", "h2"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # each thread records its own subtree
+    tasks = [node for node in timings.root.children if node.name == "mytask"]
+    assert sorted(node.host for node in tasks) == ["h1", "h2"]
+    for node in tasks:
+        assert [(child.name, child.host) for child in node.children] == [
+            ("true", node.host)
+        ]
+
+
+def test_timings_summary():
+
+    timings = fabsetup.utils.timing.Timings()
+    timings.reset()
+
+    for name, wall in [("fast", 0.5), ("slow", 2.0), ("medium", 1.0)]:
+        with timings.measure("subtask", name) as node:
+            pass
+        node.wall = wall
+    with timings.measure("command", "echo 'a | b'", host="host") as node:
+        node.return_code = 1
+
+    summary = timings.summary(number=2)
+
+    assert "\n# Timing Summary\n" in summary
+    assert "| slow |  | 2.000 |" in summary
+    assert "| medium |  | 1.000 |" in summary
+    assert "fast" not in summary
+    assert "| echo 'a \\| b' | host |" in summary
+    assert summary.rstrip().endswith("| 1 |")
+
+
+def test_write_chrome_trace(tmpdir):
+
+    timings = fabsetup.utils.timing.Timings()
+    timings.reset()
+
+    with timings.measure("task", "mytask", host="host"):
+        with timings.measure("command", "echo foo", host="host") as command:
+            command.return_code = 0
+            command.args["stdout_bytes"] = 4
+
+    trace_file = tmpdir.join("traces", "run.json")
+    timings.write_chrome_trace(str(trace_file))
+
+    events = json.loads(trace_file.read())["traceEvents"]
+    spans = {event["name"]: event for event in events if event["ph"] == "X"}
+
+    assert sorted(spans) == ["echo foo", "fabsetup", "mytask"]
+    assert spans["echo foo"]["cat"] == "command"
+    assert spans["echo foo"]["args"]["host"] == "host"
+    assert spans["echo foo"]["args"]["return_code"] == 0
+    assert spans["echo foo"]["args"]["stdout_bytes"] == 4
+    assert spans["mytask"]["ts"] <= spans["echo foo"]["ts"]
+    assert spans["mytask"]["dur"] >= spans["echo foo"]["dur"]
+    assert {event["tid"] for event in spans.values()} == {1}
+    assert [event["args"]["name"] for event in events if event["ph"] == "M"] == [
+        "MainThread"
+    ]
+
+
+@pytest.mark.skipif(
+    not hasattr(time, "thread_time"), reason="time.thread_time() requires Python 3.7"
+)
+def test_timings_cpu_per_thread():
+
+    timings = fabsetup.utils.timing.Timings()
+    timings.reset()
+    done = threading.Event()
+
+    def busy():
+        while not done.is_set():
+            pass
+
+    thread = threading.Thread(target=busy)
+    thread.start()
+    try:
+        with timings.measure("task", "sleeping") as node:
+            time.sleep(0.3)
+    finally:
+        done.set()
+        thread.join()
+
+    # the CPU time of the busy thread is not counted
+    assert node.cpu < 0.1
+
+
+def test_timings_cpu_of_command():
+
+    timings = fabsetup.utils.timing.Timings()
+    timings.reset()
+
+    with timings.measure("command", "busy") as node:
+        subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import time\nend = time.process_time() + 0.2\n"
+                "while time.process_time() < end: pass",
+            ],
+            check=True,
+        )
+
+    # the CPU time of the child process is counted
+    assert node.cpu >= 0.15